@@ -12,115 +12,216 @@ Last update: November 11, 2025 by hbarbosa
 """
 
 import os
-import sys
-import ast
+import argparse
 import pandas as pd
 import aerodog_function as adf
-import aerodog_graphics_function as agf
-
-# During development, force the reload of our libraries
-import importlib
-importlib.reload(adf)
-importlib.reload(agf)
-
-print('''
+import aerodog_storage as ads
+import aerodog_manifest as adm
+import aerodog_tasks as at
+import aerodog_rendering as ar
+import aerodog_streaming as astm
+import aerodog_cache as adc
+import aerodog_profiling as apf
+import aerodog_partitions as apt
+
+# matplotlib and seaborn (aerodog_graphics_function) are only imported when
+# Module 4 runs (see aerodog_rendering.py), so runs of the other modules
+# (e.g. --stages organize,merge) start faster
+
+# Modules (stages) run by default; use the command line option --stages to run
+# only some of them, e.g. --stages organize,merge. A stage that runs without the
+# stage before it reads that stage's files (e.g. derive reads the v02 file)
+STAGES = ['organize', 'merge', 'derive', 'climatology', 'plot']
+
+# Format of the intermediate files (v01 organized, v02 merged and v03 derived data):
+#    'parquet' (typed, compressed columnar files; needs pyarrow)
+#    'feather' (typed, uncompressed and memory-mapped columnar files; needs pyarrow)
+#    'csv' (text files with 6 decimals, as in previous versions)
+storageformat = ads.default_storage()
+
+# Module 1 only organizes the raw files that are new or changed since the last run
+# (see aerodog_manifest.py), and Module 2 only resamples the rows added to the v01
+# files since the last run (see adf.mining_aeronet_data_incremental).
+# Set to False to organize and resample all the data again.
+incremental = True
+
+
+# Module 1 (organizing the raw files) and Module 2 (resampling the organized files)
+# can run their files/variables in parallel, on a pool of worker processes. Use the
+# command line option --workers N to choose the number of processes (default: 1,
+# everything runs in this process). The results are the same for any N.
+workers = 1
+
+# When Module 1 runs in this process (workers = 1), the next raw files are read on a
+# background thread and the v01 files are written on another one while the current
+# file is cleaned (see at.pipelining_organize). prefetch is the number of files read
+# ahead and waiting to be written (it bounds the memory used). Use the command line
+# option --prefetch N (0 reads, cleans and writes one file after the other).
+prefetch = 2
+
+# Module 2 and Module 3 can process the data one site and one time window at a
+# time (see aerodog_streaming.py), so the memory used does not grow with the
+# size of the archive. Use the command line option --window (e.g. YS for years,
+# MS for months) or set the window here (default: None, all the data in memory).
+window = None
+
+# Compact mode: the organized, resampled and merged data are kept as float32 (instead
+# of float64), with AERONET_Site as a categorical column and Day_of_Year as integers
+# (see adf.compacting_frame), so about twice as much data fits in memory. The optical
+# products are then float32 too. Use the command line option --compact (default: off).
+compact = False
+
+# The results of Module 2 (resampled variables), Module 3 (optical products) and
+# the data of the boxplot and Angstrom matrix graphics are kept in an on-disk cache
+# (aerodog_cache/ in the folder where AERODOG runs, see aerodog_cache.py), keyed by
+# the content of the input data, the function and its parameters (e.g. average_time),
+# so a run with the same data only pays for the steps that changed. The cache keeps
+# at most cachesize MB (least recently used results are removed first). Use the
+# command line option --no-cache to calculate everything without the cache.
+cache = True
+cachesize = 2048
+
+# The merged (v02) and derived (v03) data can also be saved in a store partitioned
+# by site, year and month (<v02 or v03 file>.store/, see aerodog_partitions.py),
+# with the rows sorted by time and an index of the time range and min/max of each
+# partition, so apt.querying_store reads only the sites and months asked for.
+# Use the command line option --partitioned (default: off).
+partitioned = False
+
+def organizing_module(rootdir, workers=1):
+    '''
+=============================================
+MODULE 1 - organize the raw AERONET files listed in the 01-inputfiles (v01 data)
+=============================================
+'''
+    print('''
 =============================================
-MODULE 1 
+MODULE 1
 
 Reading the input raw directsun and inversion data from AERONET to organize - removing NaN or incorrect values
 These organized files is saved as version 01 raw data, i.e., v01)
 =============================================
 ''')
 
-# This follows the convection defined for the download tool (dad.py),
-# where input files go in a separate folder (input_dir).  That helps,
-# for example, if the user is processing multiple sites at the same
-# time.
-rootdir = os.getcwd()
-print('Locating input files...')
-inputdatadir = 'input_dir'
-inputfilename = '01-inputfile_rawdata'
-inputdir = os.sep.join([rootdir, inputdatadir])
-
-#inputfilenames = [name for name in os.listdir(rootdir) if name.startswith('01-inputfile_rawdata')]
-inputfilenames = [name for name in os.listdir(inputdir) if name.startswith(inputfilename)]
-print('Number of 01-inputfiles to read:', len(inputfilenames))
-print('List of 01-inputfiles found:')
-print(inputfilenames)
-
-# loop over multiple 01-inputfiles
-for afile in inputfilenames:
-
-    # read the input file
-    # step1 input file has the following format: 
-    #    filetype,use_cols,rows_to_skip,level,rawdatadir,outputdir,process
-    newfile = os.sep.join([inputdir, afile])
-    print('Reading input file:', newfile)
-
-    inputfile = pd.read_csv(newfile, sep = ',')
-    print('Number of variables requested:', len(inputfile))
-
-    # bug 6-nov-2025
-    # Here, the code assumed only one input file for each product (e.g., aod).
-    # However, reading_aeronet_data() can return multiple files, which would cause
-    # a missmatch (rawfilenames[j] would not point to the j-th product file).
-    #
-    #rawfilenames = []
-
-    # process all the lines in the input file
-    for j in range(0,len(inputfile)):
-
-        # only process the lines marked as 'on' in the input file
-        if inputfile['process'][j] == 'on':
-            print("processing variable: " + inputfile['filetype'][j])
-
-            # Output from step 1 is saved in 01-organized/ folder
-            outputdir = os.sep.join(['01-organized', inputfile['outputdir'][j]])
-            if not os.path.exists(os.sep.join([rootdir, outputdir])):
-                os.makedirs(os.sep.join([rootdir, outputdir]))
-            
-            # Rawdata (downloaded with dad.py) is found in 00-rawdata/ folder
-            rawdatadir = os.sep.join(['00-rawdata', inputfile['rawdatadir'][j]])
-            # bug 6-nov-2025
-            # create a fresh list, instead of appending
-            #rawfilenames.append(adf.reading_aeronet_data(rootdir,inputfile['filetype'][j],rawdatadir))
-            rawfilenames = adf.reading_aeronet_data(rootdir,inputfile['filetype'][j],rawdatadir)
-            print("List of files with that variable:")
-            print(rawfilenames)
-            
-            # bug 6-nov-2025
-            # we cannot just read the j-th file from the cumulative list, we have to process all of them
-            #adf.organizing_aeronet_data(rootdir, rawfilenames[j],inputfile['filetype'][j],list(ast.literal_eval(inputfile['use_cols'][j])),
-            #                            inputfile['rows_to_skip'][j],inputfile['level'][j],rawdatadir,outputdir)
-
-            # loop over all the files for this variable
-            for arawfile in rawfilenames: 
-                adf.organizing_aeronet_data(rootdir, arawfile,inputfile['filetype'][j],list(ast.literal_eval(inputfile['use_cols'][j])),
-                                            inputfile['rows_to_skip'][j],inputfile['level'][j],rawdatadir,outputdir)
-
-print('''
+    # This follows the convection defined for the download tool (dad.py),
+    # where input files go in a separate folder (input_dir).  That helps,
+    # for example, if the user is processing multiple sites at the same
+    # time.
+    print('Locating input files...')
+    inputdatadir = 'input_dir'
+    inputfilename = '01-inputfile_rawdata'
+    inputdir = os.sep.join([rootdir, inputdatadir])
+
+    #inputfilenames = [name for name in os.listdir(rootdir) if name.startswith('01-inputfile_rawdata')]
+    inputfilenames = [name for name in os.listdir(inputdir) if name.startswith(inputfilename)]
+    print('Number of 01-inputfiles to read:', len(inputfilenames))
+    print('List of 01-inputfiles found:')
+    print(inputfilenames)
+
+    # quality control (QC) rules of the organized data: sentinel values, physical
+    # ranges and required columns of each filetype (see adf.reading_qc_rules).
+    # Without this file (or with only its default line), -999 and 0 are missing values
+    # and all the columns are required.
+    qcfile = os.sep.join([inputdir, '01-inputfile_qc.csv'])
+    qcrules = adf.reading_qc_rules(qcfile)
+    if qcrules is not adf.QC_DEFAULT_RULES:
+        print('Reading QC rules:', qcfile)
+
+    # manifests of the output folders, with the raw files already organized
+    manifests = {}
+    # one task per raw file to organize: (function, args) and what to record in the manifest
+    tasks = []
+    records = []
+
+    # loop over multiple 01-inputfiles
+    for afile in inputfilenames:
+
+        # read the input file
+        # step1 input file has the following format:
+        #    filetype,use_cols,rows_to_skip,level,rawdatadir,outputdir,process
+        newfile = os.sep.join([inputdir, afile])
+        print('Reading input file:', newfile)
+
+        inputfile = pd.read_csv(newfile, sep = ',')
+        print('Number of variables requested:', len(inputfile))
+
+        # process all the lines in the input file
+        for j in range(0,len(inputfile)):
+
+            # only process the lines marked as 'on' in the input file
+            if inputfile['process'][j] == 'on':
+                print("processing variable: " + inputfile['filetype'][j])
+
+                # Output from step 1 is saved in 01-organized/ folder
+                outputdir = os.sep.join(['01-organized', inputfile['outputdir'][j]])
+                if not os.path.exists(os.sep.join([rootdir, outputdir])):
+                    os.makedirs(os.sep.join([rootdir, outputdir]))
+
+                # Rawdata (downloaded with dad.py) is found in 00-rawdata/ folder
+                rawdatadir = os.sep.join(['00-rawdata', inputfile['rawdatadir'][j]])
+                rawfilenames = adf.reading_aeronet_data(rootdir,inputfile['filetype'][j],rawdatadir)
+                print("List of files with that variable:")
+                print(rawfilenames)
+
+                # manifest with the raw files already organized into this output folder
+                if outputdir not in manifests:
+                    manifests[outputdir] = adm.reading_manifest(os.sep.join([rootdir, outputdir]))
+                use_cols = adf.parsing_use_cols(inputfile['use_cols'][j])
+                params = adm.organizing_params(inputfile['filetype'][j],use_cols,inputfile['rows_to_skip'][j],inputfile['level'][j],storageformat,compact,
+                                               None if qcrules is adf.QC_DEFAULT_RULES else adf.selecting_qc_rules(qcrules, inputfile['filetype'][j]))
+
+                # loop over all the files for this variable
+                for arawfile in rawfilenames:
+                    rawfilepath = os.sep.join([rootdir, rawdatadir, arawfile])
+                    v01filepath = adf.organized_filename(rootdir,arawfile,inputfile['filetype'][j],inputfile['level'][j],rawdatadir,outputdir,storageformat)
+                    if incremental and adm.checking_manifest(manifests[outputdir], rawfilepath, params, v01filepath):
+                        print('Up to date, skipping:', arawfile)
+                        continue
+                    tasks.append((at.organizing_task, (rootdir, arawfile,inputfile['filetype'][j],use_cols,
+                                                       inputfile['rows_to_skip'][j],inputfile['level'][j],rawdatadir,outputdir,storageformat,compact,qcrules)))
+                    records.append((outputdir, rawfilepath, params, v01filepath))
+
+    print('Number of files to organize:', len(tasks), 'with', workers, 'worker(s)')
+    if workers <= 1 and prefetch > 0 and len(tasks) > 1:
+        results = at.pipelining_organize(tasks, prefetch)
+    else:
+        results = at.running_tasks(tasks, workers)
+    for (outputdir, rawfilepath, params, v01filepath), (nrows, quality) in zip(records, results):
+        print('Organized', nrows, 'rows:', os.path.basename(v01filepath))
+        adm.updating_manifest(manifests[outputdir], rawfilepath, params, v01filepath, quality)
+    # wait for the last v01 files to be written
+    results.close()
+    for outputdir, manifest in manifests.items():
+        adm.writing_manifest(os.sep.join([rootdir, outputdir]), manifest)
+
+def reading_merging_inputs(rootdir):
+    '''
 =============================================
-MODULE 2
+Function to read the 02-inputfiles: each input file is one merge (typically
+all the products of one site), with the variables marked as 'on'
 
-Reading the organized raw data in order to make a time average and merge all direct-sun and inversion data in to a single dataframe
+Output:
+List of merges (dicts with the name of the input file and the list of its
+variables, dicts with filetype, level, average_time, v01datadir,
+v02outputdir and join)
 =============================================
-''')
+'''
+    print('Locating input files...')
+    inputdatadirv02 = 'input_dir'
+    inputfilenamev02 = '02-inputfile_organized'
+    inputdirv02 = os.sep.join([rootdir, inputdatadirv02])
 
-print('Locating input files...')
-inputdatadirv02 = 'input_dir'
-inputfilenamev02 = '02-inputfile_organized'
-inputdirv02 = os.sep.join([rootdir, inputdatadirv02])
+    inputfilenamesv02 = [name for name in os.listdir(inputdirv02) if name.startswith(inputfilenamev02)]
+    print('Number of input files to read:', len(inputfilenamesv02))
+    print('List of input files found:')
+    print(inputfilenamesv02)
 
-inputfilenamesv02 = [name for name in os.listdir(inputdirv02) if name.startswith(inputfilenamev02)]
-print('Number of input files to read:', len(inputfilenamesv02))
-print('List of input files found:')
-print(inputfilenamesv02)
+    merges = []
+    # loop over multiple input files
+    for afile in inputfilenamesv02:
 
-# loop over multiple input files
-for afile in inputfilenamesv02:
-        
         # read the input file
-        # step2 input file has the following format: 
+        # step2 input file has the following format:
         #    filetype,level,average_time,v01datadir,v02outputdir,process
         newfilev02 = os.sep.join([inputdirv02, afile])
         print('Reading input file:', newfilev02)
@@ -128,90 +229,264 @@ for afile in inputfilenamesv02:
         inputfilev02 = pd.read_csv(newfilev02, sep = ',')
         print('Number of variables requested:', len(inputfilev02))
 
-        filenamesv02 = []
-        aeronetfilev02 = []
-
         # process all the lines in the input file (typically one product per line, all from the same site)
-        # then, merge all variables into a single file
+        variables = []
         for j in range(0,len(inputfilev02)):
 
             # only process the lines marked as 'on' in the input file
-            if inputfilev02['process'][j] == 'on':                
-                print("processing variable: " + inputfilev02['filetype'][j])
+            if inputfilev02['process'][j] == 'on':
+                variable = {name: inputfilev02[name][j] for name in ['filetype','level','average_time','v01datadir','v02outputdir']}
+
+                # join policy of this product in the merge (inner if not given)
+                if 'join' in inputfilev02.columns and not pd.isna(inputfilev02['join'][j]):
+                    variable['join'] = inputfilev02['join'][j]
+                else:
+                    variable['join'] = 'inner'
+                variables.append(variable)
+
+        if len(variables) > 0:
+            merges.append({'inputfile': afile, 'variables': variables})
+    return merges
+
+def listing_variable(rootdir, variable):
+    '''Function to list the v01 files of a variable of a 02-inputfile. Returns the folder of the files and their names'''
+    # Output from step 1 is found in 01-organized/ folder
+    outputdirv01 = os.sep.join(['01-organized', variable['v01datadir']])
+    return os.sep.join([rootdir, outputdirv01]), adf.reading_aeronet_data(rootdir,variable['filetype'],outputdirv01)
+
+def resampling_variable(rootdir, variable):
+    '''Function to resample the v01 files of a variable of a 02-inputfile (adf.mining_aeronet_data). Returns the resampled DF'''
+    print("processing variable: " + variable['filetype'])
+    inputdirv01, filenamesv02 = listing_variable(rootdir, variable)
+    print("List of files with that variable:")
+    print(filenamesv02)
+
+    # state of the incremental resampling, per product and average time
+    statedir = None
+    if incremental:
+        statedir = os.sep.join([rootdir, '02-merged', variable['v02outputdir'], 'aerodog_state', variable['filetype'] + '_' + variable['average_time']])
+    inputs = adc.hashing_files([os.sep.join([inputdirv01, afile]) for afile in filenamesv02])
+    aeronetfile_mean = apf.measuring_call('mining_aeronet_data', adc.cached_call, adf.mining_aeronet_data, inputs, {'average_time': variable['average_time']},
+                                          inputdirv01,filenamesv02,variable['average_time'],statedir,storageformat)
+    if compact:
+        aeronetfile_mean = adf.compacting_frame(aeronetfile_mean)
+    return aeronetfile_mean
+
+def streaming_merge(merge, window):
+    '''Function to check if a merge is done by window (see aerodog_streaming.py): only for fixed average times, e.g. 15min or 1h'''
+    return window is not None and all([adf.fixed_step(variable['average_time']) for variable in merge['variables']])
+
+def merged_filename(rootdir, merge):
+    '''
+=============================================
+Function to name the merged file (v02 data) of a 02-inputfile, and create
+its folder
+
+Output:
+The path of the merged file (without extension), its AERONET level and
+average time (those of the variable that names the file)
+=============================================
+'''
+    variables = merge['variables']
+    # the merged file is named after the directsun file (or the first product, if there is no directsun),
+    # e.g. 20240701_20241031_Sao_Paulo_level15.directsun -> 20240701_20241031_Sao_Paulo_level15.merged
+    named = [variable for variable in variables if variable['filetype'] == 'directsun'] + [variables[0]]
+    inputdirv01, filenamesv02 = listing_variable(rootdir, named[0])
+    basename = ads.storage_basename(filenamesv02[0])
+    basename = basename[:len(basename)-len(named[0]['filetype'])] + 'merged'
+
+    # Output from step 2 is saved in 02-merged/ folder
+    outputdirv02 = os.sep.join(['02-merged', named[0]['v02outputdir']])
+    os.makedirs(os.sep.join([rootdir, outputdirv02]), exist_ok=True)
+    savefilename_v02 = os.sep.join([rootdir,outputdirv02,basename])
+    level, avgtime = named[0]['level'], named[0]['average_time']
+    return savefilename_v02, level, avgtime
+
+def derived_filename(savefilename_v02):
+    '''Function to name the derived file (v03 data) after the merged file (v02 data), both without extension'''
+    return savefilename_v02.replace('02-merged','03-derived').replace('datav02','datav03').replace('merged','derived')
+
+def storing_partitions(savefilename, df=None):
+    '''Function to save a v02 or v03 DF (or, when df is None, the file savefilename read in chunks) in its partitioned store'''
+    if df is None:
+        df = ads.loading_aeronet_chunks(savefilename + ads.STORAGE_EXTENSIONS[storageformat])
+    storedir, npartitions = apt.saving_store(df, apt.store_dirname(savefilename), storageformat)
+    print('Partitioned store saved:', storedir, 'with', npartitions, 'partition(s)')
+
+def merging_variables(rootdir, merge, window=None, *aeronetfilev02):
+    '''
+=============================================
+Function to merge the resampled variables of a 02-inputfile and save the
+merged DF (v02 data). With a window (see streaming_merge), the variables
+are resampled and merged here, one site and one window at a time.
+
+Input:
+rootdir        , string     Folder with input_dir/ and the data folders
+merge          , dict       Merge read by reading_merging_inputs()
+window         , string     Time window of the streaming mode (e.g. YS, MS), optional
+aeronetfilev02 , pandas DF  Resampled DF of each variable (resampling_variable), not
+                            used in the streaming mode
+
+Output:
+The merged DF (None when it was merged by window), the path where it was
+saved (without extension), its AERONET level and average time
+=============================================
+'''
+    variables = merge['variables']
+    joins = [variable['join'] for variable in variables]
+    avgtimes = [variable['average_time'] for variable in variables]
+
+    # table with the AERONET column names and the names used by AERODOG after the merge
+    columnnames = adf.reading_column_names(os.sep.join([rootdir, 'input_dir', '02-inputfile_columns.csv']))
+
+    savefilename_v02, level, avgtime = merged_filename(rootdir, merge)
+
+    # with a window, the variables are resampled and merged one site and one window at a time
+    # (only for fixed average times, e.g. 15min or 1h; the incremental state is not used)
+    if streaming_merge(merge, window):
+        print('Resampling and merging', len(variables), 'variables by site and', window, 'window, with joins:', joins)
+        products = [listing_variable(rootdir, variable) for variable in variables]
+        savefile, nrows = astm.streaming_aeronet_data(products, joins, avgtimes, window, savefilename_v02, storageformat, columnnames)
+        print('Merged', nrows, 'rows:', savefile)
+        if partitioned:
+            storing_partitions(savefilename_v02)
+        return None, savefilename_v02, level, avgtime
+
+    # merge all variables at once, and change the AERONET column names to the AERODOG names
+    print('Merging', len(aeronetfilev02), 'variables with joins:', joins)
+    main_aeronet_df = adf.merging_aeronet_data(list(aeronetfilev02), joins, avgtimes, columnnames)
+    if compact:
+        main_aeronet_df = adf.compacting_frame(main_aeronet_df)
+    print(main_aeronet_df)
+    print("number of columns after merge = ", len(main_aeronet_df.columns))
+
+    print('saving the merged DF...')
+    ads.saving_aeronet_data(main_aeronet_df,savefilename_v02,storageformat)
+    if partitioned:
+        storing_partitions(savefilename_v02, main_aeronet_df)
+    return main_aeronet_df, savefilename_v02, level, avgtime
+
+def merging_module(rootdir, workers=1, window=None):
+    '''
+=============================================
+MODULE 2 - resample the organized files listed in the 02-inputfiles and merge
+them into a single DF per input file (v02 data)
 
-                # Output from step 2 is saved in 02-merged/ folder
-                outputdirv02 = os.sep.join(['02-merged', inputfilev02['v02outputdir'][j]])
-                if not os.path.exists(os.sep.join([rootdir, outputdirv02])):
-                    os.makedirs(os.sep.join([rootdir, outputdirv02]))
+Output:
+The last merged DF (None when it was merged by window, see
+aerodog_streaming.py), the path where it was saved (without extension), its
+AERONET level and average time
+=============================================
+'''
+    print('''
+=============================================
+MODULE 2
 
-                # Output from step 1 is found in 01-organized/ folder
-                outputdirv01 = os.sep.join(['01-organized', inputfilev02['v01datadir'][j]])
-                filenamesv02.append(adf.reading_aeronet_data(rootdir,inputfilev02['filetype'][j],outputdirv01))                    
-                print("List of files with that variable:")
-                print(filenamesv02[j])
-
-                # why do we list the files above, if the next function will list them again??
-                aeronetfilev02.append(adf.mining_aeronet_data(rootdir,inputfilev02['filetype'][j],inputfilev02['level'][j],inputfilev02['average_time'][j],outputdirv01,outputdirv02))
-
-                print("number of PDs in concat = ",len(aeronetfilev02))
-                # this is wrong... how can we concat() before finish reading all files/variables?
-                main_aeronet_df = pd.concat(aeronetfilev02,axis=1,join='inner')
-                # this is also wrong... how can we manually change the column names? what if the user don't download the same columns?
-                # or if the products in the input file come in a different order ?!?!?
-                print(main_aeronet_df)
-                print("number of clumns after concat = ", len(main_aeronet_df.columns))
-                # uhm... what happens if we rename columns that don't exist? maybe it doesn't give an error?
-                # anyway, it would be better to concat/rename only once, after reading all files/products/variables
-                main_aeronet_df = main_aeronet_df.rename(columns = {'440-870_Angstrom_Exponent': 'AE_440_870nm', '380-500_Angstrom_Exponent': 'AE_380_500nm', '440-675_Angstrom_Exponent': 'AE_440_675nm', '500-870_Angstrom_Exponent': 'AE_500_870nm', '340-440_Angstrom_Exponent': 'AE_340_440nm',\
-                                                                    'Single_Scattering_Albedo[440nm]': 'SSA_440nm', 'Single_Scattering_Albedo[675nm]': 'SSA_675nm', 'Single_Scattering_Albedo[870nm]': 'SSA_870nm', 'Single_Scattering_Albedo[1020nm]': 'SSA_1020nm', \
-                                                                    '180.000000[440nm]': 'pfn180_440nm', '180.000000[675nm]': 'pfn180_675nm', '180.000000[870nm]': 'pfn180_870nm', '180.000000[1020nm]': 'pfn180_1020nm', \
-                                                                    'Absorption_AOD[440nm]': 'AAOD_440nm', 'Absorption_AOD[675nm]': 'AAOD_675nm', 'Absorption_AOD[870nm]': 'AAOD_870nm','Absorption_AOD[1020nm]': 'AAOD_1020nm', \
-                                                                    'Absorption_Angstrom_Exponent_440-870nm': 'AAE_440-870nm',\
-                                                                    'AOD_Extinction-Total[440nm]': 'EAOD_Total_440nm', 'AOD_Extinction-Total[675nm]': 'EAOD_Total_675nm', 'AOD_Extinction-Total[870nm]': 'EAOD_Total_870nm', 'AOD_Extinction-Total[1020nm]': 'EAOD_Total_1020nm', \
-                                                                    'AOD_Extinction-Fine[440nm]': 'EAOD_Fine_440nm','AOD_Extinction-Fine[675nm]': 'EAOD_Fine_675nm', 'AOD_Extinction-Fine[870nm]': 'EAOD_Fine_870nm', 'AOD_Extinction-Fine[1020nm]': 'EAOD_Fine_1020nm', \
-                                                                    'AOD_Extinction-Coarse[440nm]':'EAOD_Coarse_440nm','AOD_Extinction-Coarse[675nm]':'EAOD_Coarse_675nm','AOD_Extinction-Coarse[870nm]':'EAOD_Coarse_870nm', 'AOD_Extinction-Coarse[1020nm]':'EAOD_Coarse_1020nm', \
-                                                                    'Extinction_Angstrom_Exponent_440-870nm-Total': 'EAE_440-870nm',\
-                                                                    'Depolarization_Ratio[440nm]': 'DepRatio_440nm', 'Depolarization_Ratio[675nm]': 'DepRatio_675nm', 'Depolarization_Ratio[870nm]': 'DepRatio_870nm', 'Depolarization_Ratio[1020nm]': 'DepRatio_1020nm'})
-                main_aeronet_df = main_aeronet_df.reset_index()
-
-            # potential bug: if 'directsun' is not one of the variables, savefilename_v02 is never defined
-            # even if it is present, but it is not the first line... then filename will be used before being defined
-            if inputfilev02['filetype'][j] == 'directsun':
-                #bug - filename should not depend on the variables read.
-                # this is the 'merged' file, we should just use that instead
-                savefilename_v02 = os.sep.join([rootdir,outputdirv02,filenamesv02[j][0].replace('directsun','merged')])
-                #savefilename_v02 = os.sep.join([rootdir,outputdirv02,''.join([filenamesv02[j][0],'_inversion_merged_v02'])])
-
-            print('saving the merged DF...')
-            # BUG: we are saving the merged DF after reading each line (even the ones not processed = off)
-            # the merge should be saved only once
-            main_aeronet_df.to_csv(savefilename_v02,float_format="%.6f",index=False)
-
-
-print('''
+Reading the organized raw data in order to make a time average and merge all direct-sun and inversion data in to a single dataframe
+=============================================
+''')
+
+    main_aeronet_df, savefilename_v02, level, avgtime = None, None, None, None
+
+    for merge in reading_merging_inputs(rootdir):
+        if streaming_merge(merge, window):
+            main_aeronet_df, savefilename_v02, level, avgtime = merging_variables(rootdir, merge, window)
+            continue
+        if window is not None:
+            print('The average times', [variable['average_time'] for variable in merge['variables']],
+                  'are not all fixed steps, resampling all the data in memory')
+
+        # one resampling task per variable, all merged after they finish;
+        # the resampled DFs come back from the workers in the same order as the lines of the input file
+        tasks = [(resampling_variable, (rootdir, variable)) for variable in merge['variables']]
+        print('Resampling', len(tasks), 'variables with', workers, 'worker(s)')
+        aeronetfilev02 = list(at.running_tasks(tasks, workers))
+        main_aeronet_df, savefilename_v02, level, avgtime = merging_variables(rootdir, merge, None, *aeronetfilev02)
+
+    return main_aeronet_df, savefilename_v02, level, avgtime
+
+def deriving_module(rootdir, main_aeronet_df, savefilename_v02):
+    '''
+=============================================
+MODULE 3 - calculate the optical products of the merged DF (v03 data)
+
+Output:
+The derived DF and the path where it was saved (without extension)
+=============================================
+'''
+    print('''
 # =============================================
 # MODULE 3
 
-# Calculation of new optical products using direct-sun and inversion data 
+# Calculation of new optical products using direct-sun and inversion data
 # The new products are merged with the previous version 02 data (v02) in to a single dataframe and saved as version 03 data (v03)
 # This module uses the same input file as module 2
 # =============================================
 # ''')
 
-# BUG - code below would only process main_aeronet_df (the last merged dataframe in memory)
-# and it would save it based on the savefilename_v02 (the last saved filename)
-
-# we need to read the list of merged CSV files saved to disk
-
-df_aeronetdata = adf.optical_products(main_aeronet_df)
-savefilename_v03 = savefilename_v02.replace('02-merged','03-derived').replace('datav02','datav03').replace('merged','derived')
-print('savefilename_v03 = ',savefilename_v03)
-if not os.path.exists(os.path.dirname(savefilename_v03)):
-    os.makedirs(os.path.dirname(savefilename_v03))
-df_aeronetdata.to_csv(savefilename_v03,float_format="%.6f",index=False)
-
-
-print('''
+    # BUG - code below would only process main_aeronet_df (the last merged dataframe in memory)
+    # and it would save it based on the savefilename_v02 (the last saved filename)
+
+    # we need to read the list of merged CSV files saved to disk
+
+    # The 'products' column of the 03-inputfile selects the optical products to calculate:
+    #    all      - every product registered in adf.OPTICAL_PRODUCTS
+    #    graphics - only the products used by the graphics turned on in the 04-inputfile
+    #    a list of product names, e.g. "LR_532nm, AAE"
+    print('Locating input files...')
+    inputdir = os.sep.join([rootdir, 'input_dir'])
+    inputfilenamev03 = '03-inputfile_derived'
+    inputfilenamesv03 = [name for name in os.listdir(inputdir) if name.startswith(inputfilenamev03)]
+    print('List of input files found:')
+    print(inputfilenamesv03)
+
+    derivedproducts = []
+    for afile in inputfilenamesv03:
+        inputfilev03 = pd.read_csv(os.sep.join([inputdir, afile]), sep = ',')
+        for j in range(0,len(inputfilev03)):
+            if inputfilev03['process'][j] == 'on':
+                if 'products' not in inputfilev03.columns or pd.isna(inputfilev03['products'][j]) or inputfilev03['products'][j] == 'all':
+                    derivedproducts += list(adf.OPTICAL_PRODUCTS)
+                elif inputfilev03['products'][j] == 'graphics':
+                    for agraphfile in [name for name in os.listdir(inputdir) if name.startswith('04-inputfile_graphics')]:
+                        derivedproducts += adf.graphics_products(pd.read_csv(os.sep.join([inputdir, agraphfile]), sep = ','))
+                else:
+                    derivedproducts += [name.strip() for name in inputfilev03['products'][j].split(',')]
+    derivedproducts = [name for name in adf.OPTICAL_PRODUCTS if name in derivedproducts]
+    print('Optical products requested:', derivedproducts)
+
+    savefilename_v03 = derived_filename(savefilename_v02)
+    print('savefilename_v03 = ',savefilename_v03)
+    os.makedirs(os.path.dirname(savefilename_v03), exist_ok=True)
+    if main_aeronet_df is None:
+        # merged by window (see merging_module): the v02 file is read and the v03 file written chunk by chunk,
+        # then the v03 data (one row per average time) is read for the graphics
+        savefile, nrows = apf.measuring_call('streaming_products', astm.streaming_products, savefilename_v02 + ads.STORAGE_EXTENSIONS[storageformat], savefilename_v03,
+                                                  derivedproducts, storageformat)
+        print('Derived', nrows, 'rows:', savefile)
+        if partitioned:
+            storing_partitions(savefilename_v03)
+        df_aeronetdata = ads.loading_aeronet_data(savefile)
+    else:
+        # the formulas of all the registered products (a product may depend on others)
+        params = {'products': derivedproducts, 'registry': adc.registry_identity(adf.OPTICAL_PRODUCTS)}
+        df_aeronetdata = apf.measuring_call('optical_products', adc.cached_call, adf.optical_products, [adc.hashing_frame(main_aeronet_df)], params,
+                                            main_aeronet_df, derivedproducts)
+        ads.saving_aeronet_data(df_aeronetdata,savefilename_v03,storageformat)
+        if partitioned:
+            storing_partitions(savefilename_v03, df_aeronetdata)
+
+    return df_aeronetdata, savefilename_v03
+
+def plotting_module(rootdir, df_aeronetdata, savefilename_v03, level, avgtime, climatology=None, workers=1):
+    '''
+=============================================
+MODULE 4 - plot the graphics turned on in the 04-inputfiles from the derived DF
+(the boxplots are drawn from its climatology, see summarizing_site; it is
+calculated here when it is not given)
+=============================================
+'''
+    print('''
 =============================================
 MODULE 4
 
@@ -219,90 +494,288 @@ Using the version 3 organized data to plot graphics from AERONET products
 =============================================
 ''')
 
-'''Organizing data to boxplot graphics'''
-aeronetdatabp, aeronetmeanbp = adf.boxplotfunc(df_aeronetdata)
+    # the graphics are named after the derived file, e.g.
+    # 20240701_20241031_Sao_Paulo_level15.derived -> 20240701_20241031_Sao_Paulo_level15_LR_532nm.png
+    graphbasename = os.path.basename(savefilename_v03)
 
-'''Organizing data to boxplot graphics to Angstrom matrix graphics'''
-ssa_data, sae_data, derivssa = adf.angmatrixfunc(df_aeronetdata)
+    print('Locating input files...')
+    inputdatadirv04 = 'input_dir'
+    inputfilenamev04 = '04-inputfile_graphics'
+    inputdirv04 = os.sep.join([rootdir, inputdatadirv04])
 
-print('Locating input files...')
-inputdatadirv04 = 'input_dir'
-inputfilenamev04 = '04-inputfile_graphics'
-inputdirv04 = os.sep.join([rootdir, inputdatadirv04])
+    inputfilenamesv04 = [name for name in os.listdir(inputdirv04) if name.startswith(inputfilenamev04)]
+    print('Number of input files to read:', len(inputfilenamesv04))
+    print('List of input files found:')
+    print(inputfilenamesv04)
 
-#inputfilenamesv04 = [name for name in os.listdir(rootdir) if name.startswith('03-inputfile_graphics')]
-inputfilenamesv04 = [name for name in os.listdir(inputdirv04) if name.startswith(inputfilenamev04)]
-print('Number of input files to read:', len(inputfilenamesv04))
-print('List of input files found:')
-print(inputfilenamesv04)
-
-# loop over multiple input files
-for afile in inputfilenamesv04:
+    # collect the graphics of all the input files first (see aerodog_rendering.py),
+    # then render them all at once
+    jobs = []
+    for afile in inputfilenamesv04:
 
         # read the input file
-        # step3 input file has the following format: 
-        #    <TBD>
-
-        #newfilev04 = os.sep.join([rootdir, inputfilenamesv04[i]])
+        # step4 input file has the following format:
+        #    AOD,processed_aod,processed_boxplot_aod,processed_aod_allgraphics,AE,processed_AE,processed_AE_allgraphics,
+        #    LR,processed_boxplot_LR,AOD_vs_AE,AOD_vs_AE_graphics,v04outputdir,graphic_file_type
         newfilev04 = os.sep.join([inputdirv04, afile])
         print('Reading input file:', newfilev04)
 
         inputfilev04 = pd.read_csv(newfilev04, sep = ',')
         print('Number of variables requested:', len(inputfilev04))
-                
-        if not os.path.exists(os.sep.join([rootdir, '04-graphics', inputfilev04['v04outputdir'][0]])):
-                    os.makedirs(os.sep.join([rootdir, '04-graphics', inputfilev04['v04outputdir'][0]]))
-        
-        # for j in range(0,len(inputfilev04['processed_aod'])):
-        #     if inputfilev04['processed_aod'][j] == 'on':
-        #         print('The AOD graphic at '+ str(inputfilev04['AOD'][j]) + ' nm will be plotted' )
-        #         filegraphpath = os.sep.join([rootdir, inputfilev04['v04outputdir'][0],inputfilev04.columns[1],''.join([inputfilev04.columns[1],'_',str(inputfilev04['AOD'][j]),'nm'])])
-        #         graphname = ''.join([rawfilenames[0][0].replace('.directsun','_AOD_'),str(inputfilev04['AOD'][j]),'nm.',inputfilev04['graphic_file_type'][0]])
-        #         if not os.path.exists(filegraphpath):
-        #             os.makedirs(filegraphpath)
-        #         agf.aod_temporal_evolution(inputfilev04.columns[0], inputfile['level'][0], inputfilev02['average_time'][0], df_aeronetdata,inputfilev04['AOD'][j],filegraphpath,graphname)
-                       
-        # for k in range(0,len(inputfilev04['processed_aod_allgraphics'].dropna())):
-        #     if inputfilev04['processed_aod_allgraphics'][k] == 'on':
-        #         print('The AOD graphics of all wavelengths will be plotted')
-        #         filegraphpathall = os.sep.join([rootdir, inputfilev04['v04outputdir'][0],inputfilev04.columns[3].replace('graphics','wavelengths')])
-        #         graphnameall = ''.join([rawfilenames[0][0].replace('.directsun','_AOD_'),'allwavelengths.',inputfilev04['graphic_file_type'][0]])
-        #         if not os.path.exists(filegraphpathall):
-        #             os.makedirs(filegraphpathall)
-        #         agf.allaod_temporal_evolution(inputfilev04.columns[0],inputfile['level'][0], inputfilev02['average_time'][0], df_aeronetdata, inputfilev04['AOD'], inputfilev04['processed_aod'],filegraphpathall,graphnameall)
-
-        # for l in range(0,len(inputfilev04['processed_AE'].dropna())):
-        #     if inputfilev04['processed_AE'][l] == 'on':
-        #         print('The Angstrom Exponent graphic relation at '+ str(list(ast.literal_eval(inputfilev04['AE'][l]))[0]) + '-' + str(list(ast.literal_eval(inputfilev04['AE'][l]))[1]) + ' nm will be plotted' )
-        #         filegraphpathae = os.sep.join([rootdir, inputfilev04['v04outputdir'][0],inputfilev04.columns[5],''.join([inputfilev04.columns[5],str(list(ast.literal_eval(inputfilev04['AE'][l]))[0]),'-',str(list(ast.literal_eval(inputfilev04['AE'][l]))[1]),'nm'])])
-        #         graphnameae = ''.join([rawfilenames[0][0].replace('.directsun','_AE'),''.join([str(list(ast.literal_eval(inputfilev04['AE'][l]))[0]),'-',str(list(ast.literal_eval(inputfilev04['AE'][l]))[1])]),'nm.',inputfilev04['graphic_file_type'][0]])
-        #         if not os.path.exists(filegraphpathae):
-        #             os.makedirs(filegraphpathae)        
-        #         agf.angexp_temporal_evolution(inputfilev04.columns[4],inputfile['level'][0], inputfilev02['average_time'][0], df_aeronetdata,list(ast.literal_eval(inputfilev04['AE'][l])),filegraphpathae,graphnameae)
-
-        # for m in range(0,len(inputfilev04['AOD_vs_AE_graphics'].dropna())):
-        #     if inputfilev04['AOD_vs_AE_graphics'][m] == 'on':
-        #         print('The AOD x AE scatter plot graphic with AOD at '+ str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[0]) + ' and AE relation at ' + str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[1]) + '-' + str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[2]) + ' nm will be plotted' )
-        #         filegraphpathAODvsAE = os.sep.join([rootdir, inputfilev04['v04outputdir'][0],inputfilev04.columns[9],''.join([str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[0]),'vs',str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[1]),str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[2]),'nm'])])
-        #         graphnameAODvsAE = ''.join([rawfilenames[0][0].replace('.directsun','_AODvsAE_'),str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[0]),'vs',str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[1]),str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))[2]) ,'nm.',inputfilev04['graphic_file_type'][0]])
-        #         if not os.path.exists(filegraphpathAODvsAE):
-        #             os.makedirs(filegraphpathAODvsAE)
-        #         agf.scatterplot_AODvsAE(inputfilev04.columns[9], inputfile['level'][0], df_aeronetdata, inputfilev04['AOD_vs_AE'][m], filegraphpathAODvsAE, graphnameAODvsAE)
-                
-        for n in range(0,len(inputfilev04['processed_boxplot_LR'])):
-            if inputfilev04['processed_boxplot_LR'][n] == 'on':
-                print('The boxplot LR graphic at '+ str(inputfilev04['LR'][n]) + ' nm will be plotted' )
-                filegraphpathlr = os.sep.join([rootdir, '04-graphics', inputfilev04['v04outputdir'][0],inputfilev04.columns[8],''.join([inputfilev04.columns[8],'_',str(inputfilev04['LR'][n]),'nm'])])
-                print('filegraphpathlr = ',filegraphpathlr)
-                graphnamelr = ''.join([rawfilenames[0][0].replace('.directsun','_LR_'),str(inputfilev04['LR'][n]),'nm.',inputfilev04['graphic_file_type'][0]])
-                print('graphnamelr = ',graphnamelr)
-                if not os.path.exists(filegraphpathlr):
-                    os.makedirs(filegraphpathlr)
-                agf.boxplot_temporal_evolution(inputfilev04.columns[7], inputfile['level'][0], aeronetdatabp, aeronetmeanbp, inputfilev04['LR'][n], filegraphpathlr, graphnamelr)
-
-'''Plotting Angstrom Matrix graphics'''
-filegraphpath_angmatrix = os.sep.join([rootdir, '04-graphics', inputfilev04['v04outputdir'][0],'processed_angstrom_matrix','processed_angstrom_matrix_440-870nm'])
-graphname_angmatrix = ''.join([rawfilenames[0][0].replace('.directsun','_Angs_Matrix_'),'440-870nm.',inputfilev04['graphic_file_type'][0]])
-if not os.path.exists(filegraphpath_angmatrix):
-    os.makedirs(filegraphpath_angmatrix)
-agf.angsmatrix_plot(inputfile['level'][0], ssa_data, sae_data, derivssa, df_aeronetdata, filegraphpath_angmatrix,graphname_angmatrix)
+        jobs += ar.plotting_jobs(rootdir, inputfilev04, graphbasename, level, avgtime)
+
+    print('Plotting', len(jobs), 'graphics with', workers, 'worker(s)')
+    ar.rendering_plots(jobs, df_aeronetdata, workers, climatology)
+
+def resampling_site(rootdir, variable, organized):
+    '''Function to run resampling_variable() after Module 1 (a task of building_site_graph; organized, the result of the organize task, is not used)'''
+    return resampling_variable(rootdir, variable)
+
+def reading_merged(rootdir, merge):
+    '''Function to find the merged file (v02 data) of a 02-inputfile saved by a previous run, when Module 2 does not run. Returns the same as merging_variables(), without the DF'''
+    savefilename_v02, level, avgtime = merged_filename(rootdir, merge)
+    if not os.path.exists(savefilename_v02 + ads.STORAGE_EXTENSIONS[storageformat]):
+        raise FileNotFoundError('reading_merged:: run the merge stage first, no merged file ' + savefilename_v02 + ads.STORAGE_EXTENSIONS[storageformat])
+    print('Using the merged file of a previous run:', savefilename_v02 + ads.STORAGE_EXTENSIONS[storageformat])
+    return None, savefilename_v02, level, avgtime
+
+def reading_derived(rootdir, merged):
+    '''Function to load the derived file (v03 data) saved by a previous run, when Module 3 does not run. Returns the same as deriving_site()'''
+    main_aeronet_df, savefilename_v02, level, avgtime = merged
+    savefilename_v03 = derived_filename(savefilename_v02)
+    print('Using the derived file of a previous run:', savefilename_v03 + ads.STORAGE_EXTENSIONS[storageformat])
+    return ads.loading_aeronet_data(savefilename_v03 + ads.STORAGE_EXTENSIONS[storageformat]), savefilename_v03, level, avgtime
+
+def deriving_site(rootdir, merged):
+    '''Function to run Module 3 on the result of merging_variables() (a task of building_site_graph). Returns the derived DF, its path, level and average time'''
+    main_aeronet_df, savefilename_v02, level, avgtime = merged
+    df_aeronetdata, savefilename_v03 = deriving_module(rootdir, main_aeronet_df, savefilename_v02)
+    return df_aeronetdata, savefilename_v03, level, avgtime
+
+def climatology_filenames(savefilename_v03):
+    '''Function to name the climatology files (summaries and fliers) of the derived file (v03 data), without extension'''
+    dirname, basename = os.path.split(savefilename_v03)
+    basename = basename.replace('derived', 'climatology')
+    return os.sep.join([dirname, basename]), os.sep.join([dirname, basename + '_fliers'])
+
+def summarizing_site(rootdir, derived):
+    '''
+=============================================
+Function to calculate the monthly and seasonal climatology of the derived
+DF (adf.summarizing_aeronet_data: count, mean, quartiles and whiskers of
+each variable, by site and month or season) and save it next to the v03
+file (a task of building_site_graph). The boxplots of Module 4 are drawn
+from it.
+
+Output:
+The result of deriving_site(), with the climatology (summaries and fliers)
+=============================================
+'''
+    df_aeronetdata, savefilename_v03, level, avgtime = derived
+    climatology = apf.measuring_call('summarizing_aeronet_data', adc.cached_call, adf.summarizing_aeronet_data,
+                                     [adc.hashing_frame(df_aeronetdata)], {}, df_aeronetdata)
+    summaryfile, flierfile = climatology_filenames(savefilename_v03)
+    savefile = ads.saving_aeronet_data(climatology[0], summaryfile, storageformat)
+    ads.saving_aeronet_data(climatology[1], flierfile, storageformat)
+    print('Climatology of', climatology[0]['variable'].nunique(), 'variables saved:', savefile)
+    return df_aeronetdata, savefilename_v03, level, avgtime, climatology
+
+def reading_climatology(rootdir, derived):
+    '''Function to load the climatology saved by a previous run, when the climatology stage does not run (None when there is none, Module 4 then calculates it). Returns the same as summarizing_site()'''
+    df_aeronetdata, savefilename_v03, level, avgtime = derived
+    summaryfile, flierfile = [filename + ads.STORAGE_EXTENSIONS[storageformat] for filename in climatology_filenames(savefilename_v03)]
+    if not os.path.exists(summaryfile) or os.path.getmtime(summaryfile) < os.path.getmtime(savefilename_v03 + ads.STORAGE_EXTENSIONS[storageformat]):
+        return df_aeronetdata, savefilename_v03, level, avgtime, None
+    print('Using the climatology of a previous run:', summaryfile)
+    summaries, fliers = ads.loading_aeronet_data(summaryfile), ads.loading_aeronet_data(flierfile)
+    # the labels of the months (e.g. 07) are read back as numbers from csv files
+    summaries['label'] = ['%02d' % code if period == 'month' else adf.SEASONS[code - 1] for period, code in zip(summaries['period'], summaries['code'])]
+    return df_aeronetdata, savefilename_v03, level, avgtime, (summaries, fliers)
+
+def plotting_site(rootdir, summarized):
+    '''Function to run Module 4 (headless) on the result of summarizing_site() (a task of building_site_graph). Returns the path of the derived file'''
+    df_aeronetdata, savefilename_v03, level, avgtime, climatology = summarized
+    ar.rendering_headless()
+    plotting_module(rootdir, df_aeronetdata, savefilename_v03, level, avgtime, climatology)
+    return savefilename_v03
+
+def building_site_graph(rootdir, window=None, stages=STAGES):
+    '''
+=============================================
+Function to build the task graph of one site configuration (a folder with
+input_dir/ and 00-rawdata/, as in a single run of AERODOG):
+
+    organize -> resample (one task per variable) -> merge -> derive -> climatology -> plot
+
+with one resample/merge/derive/climatology/plot chain per 02-inputfile, so
+every merged file gets its v03 data and graphics (not only the last one)
+
+Input:
+rootdir , string           Folder of the site configuration
+window  , string           Time window of the streaming mode (e.g. YS, MS), optional
+stages  , list of strings  Stages to run (see STAGES); a stage that runs without
+                           the stage before it reads the files of a previous run
+
+Output:
+Task graph (see aerodog_tasks.running_graph), with the tasks named
+rootdir:stage or rootdir:02-inputfile:stage. The tasks are run through
+apf.measuring_call, so they are measured when the profiling is on
+=============================================
+'''
+    organize = rootdir + ':organize'
+    graph = {}
+    if 'organize' in stages:
+        graph[organize] = (apf.measuring_call, ('organize', organizing_module, rootdir), [])
+    for merge in reading_merging_inputs(rootdir):
+        label = rootdir + ':' + merge['inputfile']
+        if 'merge' in stages:
+            after = [organize] if organize in graph else []
+            resampled = []
+            if not streaming_merge(merge, window):
+                for k, variable in enumerate(merge['variables']):
+                    name = label + ':resample:' + str(k) + ':' + variable['filetype']
+                    if len(after) > 0:
+                        graph[name] = (apf.measuring_call, ('resample', resampling_site, rootdir, variable), after)
+                    else:
+                        graph[name] = (apf.measuring_call, ('resample', resampling_variable, rootdir, variable), [])
+                    resampled.append(name)
+            # the merge receives the resampled DFs (or, when streaming, the result of the organize task, not used)
+            graph[label + ':merge'] = (apf.measuring_call, ('merge', merging_variables, rootdir, merge, window), resampled if len(resampled) > 0 else after)
+        elif 'derive' in stages or 'climatology' in stages or 'plot' in stages:
+            graph[label + ':merge'] = (reading_merged, (rootdir, merge), [])
+        if 'derive' in stages:
+            graph[label + ':derive'] = (apf.measuring_call, ('derive', deriving_site, rootdir), [label + ':merge'])
+        elif 'climatology' in stages or 'plot' in stages:
+            graph[label + ':derive'] = (reading_derived, (rootdir,), [label + ':merge'])
+        if 'climatology' in stages:
+            graph[label + ':climatology'] = (apf.measuring_call, ('climatology', summarizing_site, rootdir), [label + ':derive'])
+        elif 'plot' in stages:
+            graph[label + ':climatology'] = (reading_climatology, (rootdir,), [label + ':derive'])
+        if 'plot' in stages:
+            graph[label + ':plot'] = (apf.measuring_call, ('plot', plotting_site, rootdir), [label + ':climatology'])
+    return graph
+
+def processing_sites(rootdirs, workers=1, executor='process', window=None, stages=STAGES):
+    '''
+=============================================
+Function to run AERODOG (Modules 1 to 4) on many site configurations in
+one run: the task graphs of all the sites (building_site_graph) are run
+together on one pool of workers, so the tasks of different sites run in
+parallel while each site keeps the order of its modules. The graphics are
+rendered headless (Agg).
+
+Input:
+rootdirs , list of strings  Folders of the site configurations
+workers  , integer          Number of tasks running at the same time
+executor , string           'process' or 'thread' (see at.running_graph)
+window   , string           Time window of the streaming mode, optional
+stages   , list of strings  Stages to run (see STAGES)
+
+Output:
+List with the results of the last stage of each chain (e.g. the derived
+files, without extension, whose graphics were plotted)
+=============================================
+'''
+    if 'plot' in stages:
+        ar.rendering_headless()
+    rootdirs = list(dict.fromkeys([os.path.abspath(rootdir) for rootdir in rootdirs]))
+    graph = {}
+    for rootdir in rootdirs:
+        graph.update(building_site_graph(rootdir, window, stages))
+    print('Running', len(graph), 'tasks of', len(rootdirs), 'site configuration(s) with', workers, executor, 'worker(s)')
+    return list(at.running_graph(graph, workers, executor).values())
+
+def configuring_run(config):
+    '''
+=============================================
+Function to set the configuration of a run (the command line options that
+change the module globals, the cache and the profiling) in this process.
+It is also the run initializer of the worker processes (see
+at.configuring_workers), so the workers use the same configuration as the
+main process whatever their start method (fork or spawn)
+
+Input:
+config , dict  {'compact': boolean, 'prefetch': integer, 'partitioned': boolean,
+               'cache': arguments of adc.configuring_cache or None,
+               'profiling': arguments of apf.configuring_profiling or None}
+=============================================
+'''
+    global compact, prefetch, partitioned
+    compact, prefetch, partitioned = config['compact'], config['prefetch'], config['partitioned']
+    if config['cache'] is not None:
+        adc.configuring_cache(*config['cache'])
+    if config['profiling'] is not None:
+        apf.configuring_profiling(*config['profiling'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AERODOG - AERONET Data Organization & Graphics')
+    parser.add_argument('--workers', type=int, default=workers,
+                        help='number of worker processes to organize (Module 1), resample (Module 2) the files and plot the graphics (Module 4); 0 uses all the CPUs')
+    parser.add_argument('--prefetch', type=int, default=prefetch,
+                        help='raw files read ahead and v01 files written in the background when Module 1 runs with one worker (0: off)')
+    parser.add_argument('--window', default=window,
+                        help='resample, merge (Module 2) and derive (Module 3) the data one site and one time window at a time, e.g. YS (years) or MS (months)')
+    parser.add_argument('--compact', action='store_true', default=compact,
+                        help='keep the data as float32, with categorical sites and integer days of the year (less memory)')
+    parser.add_argument('--partitioned', action='store_true', default=partitioned,
+                        help='also save the merged and derived data in stores partitioned by site, year and month (see aerodog_partitions.py)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='calculate everything again, without reading or writing the cache of results')
+    parser.add_argument('--cache-size', type=int, default=cachesize,
+                        help='maximum size of the cache of results, in MB')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma-separated stages to run, from ' + ','.join(STAGES) + ' (default: all), e.g. organize,merge')
+    parser.add_argument('--report', default=None, metavar='BASENAME',
+                        help='measure each stage and function call and save the run report in BASENAME.json and BASENAME.csv')
+    parser.add_argument('--profile', default=None, metavar='NAME',
+                        help='profile a stage (e.g. merge) or function (e.g. optical_products), saving the profile next to the report')
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile',
+                        help='profiler used by --profile (default: cprofile)')
+    parser.add_argument('--sites', nargs='+', default=None, metavar='DIR',
+                        help='run all the modules on many site configurations (folders with input_dir/ and 00-rawdata/) as one task graph')
+    parser.add_argument('--executor', choices=['process', 'thread'], default='process',
+                        help='workers of the --sites task graph: processes (default) or threads')
+    parser.add_argument('--start-method', choices=['fork', 'spawn', 'forkserver'], default=None,
+                        help='start method of the worker processes (default: the one of the platform)')
+    args = parser.parse_args()
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip() != '']
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error('unknown stage ' + stage + ', choose from ' + ','.join(STAGES))
+    if args.workers == 0:
+        args.workers = os.cpu_count()
+
+    print('Intermediate files will be saved as:', storageformat)
+    config = {'compact': args.compact, 'prefetch': args.prefetch, 'partitioned': args.partitioned, 'cache': None, 'profiling': None}
+    if cache:
+        config['cache'] = (os.sep.join([os.getcwd(), 'aerodog_cache']), args.cache_size*1024**2, args.no_cache)
+    if args.report is not None or args.profile is not None:
+        config['profiling'] = (True, args.profile, args.profiler, os.path.dirname(os.path.abspath(args.report or 'aerodog_report')))
+    configuring_run(config)
+    # the worker processes get the same configuration (see at.configuring_workers)
+    at.configuring_workers(configuring_run, (config,), args.start_method)
+    try:
+        if args.sites is not None:
+            processing_sites(args.sites, args.workers, args.executor, args.window, stages)
+        else:
+            rootdir = os.getcwd()
+            if 'organize' in stages:
+                apf.measuring_call('organize', organizing_module, rootdir, args.workers)
+            if 'merge' in stages:
+                merged = apf.measuring_call('merge', merging_module, rootdir, args.workers, args.window)
+            elif 'derive' in stages or 'climatology' in stages or 'plot' in stages:
+                # the last merged file, as merging_module
+                merged = reading_merged(rootdir, reading_merging_inputs(rootdir)[-1])
+            if 'derive' in stages:
+                derived = apf.measuring_call('derive', deriving_site, rootdir, merged)
+            elif 'climatology' in stages or 'plot' in stages:
+                derived = reading_derived(rootdir, merged)
+            if 'climatology' in stages:
+                summarized = apf.measuring_call('climatology', summarizing_site, rootdir, derived)
+            elif 'plot' in stages:
+                summarized = reading_climatology(rootdir, derived)
+            if 'plot' in stages:
+                apf.measuring_call('plot', plotting_module, rootdir, *summarized, args.workers)
+    finally:
+        if args.report is not None:
+            apf.writing_report(args.report)
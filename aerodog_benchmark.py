@@ -0,0 +1,568 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Benchmarks for the AERODOG processing functions
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+Usage:
+  python aerodog_benchmark.py globaltime [--rows 1000000]
+  python aerodog_benchmark.py optical [--rows 1000000]
+  python aerodog_benchmark.py compact [--rows 1000000]
+  python aerodog_benchmark.py pipeline [--sites 2] [--years 5] [--output aerodog_benchmark.json]
+  python aerodog_benchmark.py imports [--repeat 5] [--limit 1.0]
+
+The pipeline benchmark writes synthetic AERONET V3 files (directsun and all
+the inversion products) and times each AERODOG stage separately, saving
+the wall time, throughput and peak resident memory (RSS) of each stage in
+a JSON file.
+
+The imports benchmark times the import of the AERODOG modules in a new
+interpreter and fails when importing aerodog.py loads the graphics
+libraries (only needed by Module 4) or takes longer than --limit seconds.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import aerodog_function as adf
+import aerodog_profiling as apf
+import aerodog_graphics_function as agf
+
+# modules that importing aerodog.py must not load (only Module 4 needs them)
+DEFERRED_IMPORTS = ['matplotlib', 'seaborn', 'aerodog_graphics_function']
+
+def synthetic_datetime_file(filename, nrows, seed=0):
+    '''
+=============================================
+Write a synthetic all-points file with the AERONET Date(dd:mm:yyyy) and
+Time(hh:mm:ss) columns, spread over ~15 years of measurements
+=============================================
+'''
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2010-01-01').value // 10**9
+    seconds = np.sort(rng.integers(0, 15*365*86400, nrows)) + start
+    times = pd.to_datetime(seconds, unit='s')
+    f = pd.DataFrame({'AERONET_Site': 'Sao_Paulo',
+                      'Date(dd:mm:yyyy)': times.strftime('%d:%m:%Y'),
+                      'Time(hh:mm:ss)': times.strftime('%H:%M:%S'),
+                      'AOD_500nm': rng.uniform(0.01, 2., nrows)})
+    f.to_csv(filename, index=False)
+
+def benchmark_globaltime(nrows):
+    '''
+=============================================
+Compare the row-wise globaltime_function with the vectorized
+globaltime_column on a synthetic file with nrows lines (the results are
+checked by tests/test_optical_products.py)
+=============================================
+'''
+    tmpdir = tempfile.mkdtemp(prefix='aerodog_bench_')
+    filename = os.sep.join([tmpdir, 'globaltime.csv'])
+    print('Writing synthetic file with', nrows, 'rows:', filename)
+    synthetic_datetime_file(filename, nrows)
+    f = pd.read_csv(filename)
+
+    t0 = time.perf_counter()
+    rowwise = f.apply(adf.globaltime_function, axis=1)
+    rowwise = pd.to_datetime(rowwise, format='%Y-%m-%d %H:%M:%S')
+    t_rowwise = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    vectorized = adf.globaltime_column(f)
+    t_vectorized = time.perf_counter() - t0
+
+    print('row-wise apply(globaltime_function): %10.3f s' % t_rowwise)
+    print('vectorized globaltime_column():      %10.3f s' % t_vectorized)
+    print('speed-up:                            %10.1f x' % (t_rowwise/t_vectorized))
+    os.remove(filename)
+    os.rmdir(tmpdir)
+
+def sample_optical_frame(rawdatadir=os.sep.join(['00-rawdata', 'Sao_Paulo_2024_2024'])):
+    '''
+=============================================
+Build a frame with the columns used by optical_products() from the SSA and
+phase function files of the Sao Paulo sample. The sample has no directsun
+file, so the AOD and AE columns are filled with random values
+=============================================
+'''
+    rename = {}
+    for wavelength in [440, 675, 870, 1020]:
+        rename['Single_Scattering_Albedo[%dnm]' % wavelength] = 'SSA_%dnm' % wavelength
+        rename['180.000000[%dnm]' % wavelength] = 'pfn180_%dnm' % wavelength
+    frames = []
+    for filetype in ['ssa', 'pfn']:
+        files = adf.reading_aeronet_data(os.getcwd(), filetype, rawdatadir)
+        f = pd.read_csv(os.sep.join([rawdatadir, files[0]]), skiprows=6,
+                        usecols=lambda name: name in rename)
+        frames.append(f.rename(columns=rename))
+    f = pd.concat(frames, axis=1)
+    rng = np.random.default_rng(0)
+    for wavelength in [340, 380, 440, 500, 675]:
+        f['AOD_%dnm' % wavelength] = rng.uniform(0.05, 1.5, len(f))
+    f['AE_440_675nm'] = rng.uniform(0.2, 2., len(f))
+    f['AE_340_440nm'] = rng.uniform(0.2, 2., len(f))
+    return f
+
+def synthetic_optical_frame(sample, nrows, seed=1):
+    '''Build a frame with nrows lines from random lines of the sample frame, each value changed by up to 10%'''
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, len(sample), nrows)
+    synthetic = sample.iloc[index].reset_index(drop=True)
+    synthetic = synthetic * rng.uniform(0.9, 1.1, synthetic.shape)
+    synthetic['SSA_440nm'] = synthetic['SSA_440nm'].clip(upper=0.999)
+    synthetic['SSA_675nm'] = synthetic['SSA_675nm'].clip(upper=0.999)
+    return synthetic
+
+def benchmark_optical(nrows):
+    '''
+=============================================
+Compare the per-row optical product functions (df.apply(fn, axis=1)) with
+the columnar optical_products(), on the Sao Paulo sample and on a synthetic
+frame with nrows lines (the results are checked by tests/test_optical_products.py)
+=============================================
+'''
+    sample = sample_optical_frame()
+    synthetic = synthetic_optical_frame(sample, nrows)
+
+    for label, f in [('sample', sample), ('synthetic', synthetic)]:
+        t0 = time.perf_counter()
+        rowwise = f.copy()
+        for name in adf.resolving_products(adf.OPTICAL_PRODUCTS, f.columns):
+            rowwise[name] = rowwise.apply(adf.OPTICAL_PRODUCTS[name]['function'], axis=1)
+        t_rowwise = time.perf_counter() - t0
+        print('%s (%d rows)' % (label, len(f)))
+        print('  %-34s %10.3f s' % ('row-wise apply:', t_rowwise))
+
+        for engine in ['numpy', 'numexpr']:
+            t0 = time.perf_counter()
+            columnar = adf.optical_products(f.copy(), engine=engine)
+            t_columnar = time.perf_counter() - t0
+            print('  %-34s %10.3f s  (%.1f x)' % ('optical_products(engine='+engine+'):', t_columnar, t_rowwise/t_columnar))
+
+def benchmark_compact(nrows):
+    '''
+=============================================
+Compare the optical products of a synthetic merged frame with nrows lines
+(float64) with the ones of the same frame in the compact types (float32,
+categorical AERONET_Site, see adf.compacting_frame): memory, time and the
+largest difference of each product (the tolerance is checked by
+tests/test_optical_products.py). The synthetic values have all the float64
+digits, so the differences include the float32 rounding of the inputs
+=============================================
+'''
+    f = synthetic_optical_frame(sample_optical_frame(), nrows)
+    f.insert(0, 'globaltime', pd.date_range('2005-01-01', periods=nrows, freq='15min'))
+    f.insert(0, 'AERONET_Site', np.array(SYNTHETIC_SITES)[np.arange(nrows) * len(SYNTHETIC_SITES) // nrows])
+
+    t0 = time.perf_counter()
+    compact = adf.compacting_frame(f)
+    t_compacting = time.perf_counter() - t0
+    timing = {}
+    for label, frame in [('float64', f), ('compact', compact)]:
+        t0 = time.perf_counter()
+        frame = adf.optical_products(frame.copy())
+        timing[label] = time.perf_counter() - t0
+        print('%-8s %10.1f MB  optical_products %8.3f s' % (label, frame.memory_usage(deep=True).sum()/1024**2, timing[label]))
+        if label == 'float64':
+            reference = frame
+        else:
+            derived = frame
+    print('compacting_frame: %.3f s' % t_compacting)
+
+    for name in adf.OPTICAL_PRODUCTS:
+        x, y = derived[name].to_numpy(dtype=float), reference[name].to_numpy()
+        error = np.nanmax(np.abs(x - y))
+        relative = np.nanmax(np.abs(x - y) / np.maximum(np.abs(y), np.finfo(float).tiny))
+        print('  %-12s %-8s max abs error %9.2e  max rel error %9.2e' % (name, derived[name].dtype, error, relative))
+
+WAVELENGTHS = [440, 675, 870, 1020]
+DIRECTSUN_WAVELENGTHS = [1640, 1020, 870, 865, 779, 675, 667, 620, 560, 555, 551, 532, 531, 510, 500, 490, 443, 440, 412, 400, 380, 340]
+# channels measured by the standard CIMEL sun photometer (the other AOD columns are always -999)
+DIRECTSUN_CHANNELS = [1640, 1020, 870, 675, 500, 440, 380, 340]
+DIRECTSUN_AE = ['440-870_Angstrom_Exponent', '380-500_Angstrom_Exponent', '440-675_Angstrom_Exponent',
+                '500-870_Angstrom_Exponent', '340-440_Angstrom_Exponent', '440-675_Angstrom_Exponent[Polar]']
+PHASE_FUNCTION_ANGLES = [180., 178.29, 176.07, 173.84, 171.61, 169.37, 167.14, 164.9, 162.67, 160.43, 158.2, 155.96,
+                         153.72, 151.49, 149.25, 147.02, 144.78, 142.55, 140.31, 138.07, 135.84, 133.6, 131.37, 129.13,
+                         126.89, 124.66, 122.42, 120.19, 117.95, 115.71, 113.48, 111.24, 109.01, 106.77, 104.53, 102.3,
+                         100.06, 97.83, 95.59, 93.35, 91.12, 90., 88.88, 86.65, 84.41, 82.17, 79.94, 77.7, 75.47, 73.23,
+                         70.99, 68.76, 66.52, 64.29, 62.05, 59.81, 57.58, 55.34, 53.11, 50.87, 48.63, 46.4, 44.16, 41.93,
+                         39.69, 37.45, 35.22, 32.98, 30.75, 28.51, 26.28, 24.04, 21.8, 19.57, 17.33, 15.1, 12.86, 10.63,
+                         8.39, 6.16, 3.93, 1.71, 0.]
+SIZE_RADII = [0.05, 0.065604, 0.086077, 0.112939, 0.148184, 0.194429, 0.255105, 0.334716, 0.439173, 0.576227, 0.756052,
+              0.991996, 1.301571, 1.707757, 2.240702, 2.939966, 3.857452, 5.06126, 6.640745, 8.713145, 11.432287, 15.]
+
+# product columns of each inversion file (after AERONET_Site, date, time and day of year)
+INVERSION_COLUMNS = {
+    'ssa': ['Single_Scattering_Albedo[%dnm]' % w for w in WAVELENGTHS],
+    'lid': ['Lidar_Ratio[%dnm]' % w for w in WAVELENGTHS] + ['Depolarization_Ratio[%dnm]' % w for w in WAVELENGTHS],
+    'tab': ['Absorption_AOD[%dnm]' % w for w in WAVELENGTHS] + ['Absorption_Angstrom_Exponent_440-870nm'],
+    'aod': ['AOD_Extinction-%s[%dnm]' % (mode, w) for mode in ['Total', 'Fine', 'Coarse'] for w in WAVELENGTHS]
+           + ['Extinction_Angstrom_Exponent_440-870nm-Total'],
+    'rin': ['Refractive_Index-%s_Part[%dnm]' % (part, w) for part in ['Real', 'Imaginary'] for w in WAVELENGTHS],
+    'cad': ['AOD_Coincident_Input[%dnm]' % w for w in WAVELENGTHS] + ['Angstrom_Exponent_440-870nm_from_Coincident_Input_AOD'],
+    'siz': ['%.6f' % r for r in SIZE_RADII] + ['Inflection_Radius_of_Size_Distribution(um)'],
+    'pfn': ['%.6f[%dnm]' % (a, w) for w in WAVELENGTHS for a in PHASE_FUNCTION_ANGLES],
+    'pfncoarse': ['%.6f[%dnm]' % (a, w) for w in WAVELENGTHS for a in PHASE_FUNCTION_ANGLES],
+    'pfnfine': ['%.6f[%dnm]' % (a, w) for w in WAVELENGTHS for a in PHASE_FUNCTION_ANGLES],
+    }
+INVERSION_TRAILER = ['Average_Solar_Zenith_Angles_for_Flux_Calculation(Degrees)', 'Solar_Zenith_Angle_for_Measurement_Start(Degrees)',
+                     'Sky_Residual(%)', 'Sun_Residual(%)', 'Coincident_AOD440nm'] \
+                    + ['Scattering_Angle_Bin_%s[%dnm]' % (b, w) for w in WAVELENGTHS
+                       for b in ['3.2_to_<6_degrees', '6_to_<30_degrees', '30_to_<80_degrees', '80_degrees_and_over']] \
+                    + ['Surface_Albedo[%dm]' % w for w in WAVELENGTHS] \
+                    + ['If_Retrieval_is_L2(without_L2_0.4_AOD_440_threshold)', 'If_AOD_is_L2', 'Last_Processing_Date(dd:mm:yyyy)',
+                       'Last_Processing_Time(hh:mm:ss)', 'Instrument_Number', 'Latitude(Degrees)', 'Longitude(Degrees)',
+                       'Elevation(m)', 'Inversion_Data_Quality_Level', 'Retrieval_Measurement_Scan_Type']
+
+# range of the synthetic inversion values, by the start of the column name (default 0.01-1)
+COLUMN_RANGES = [('Single_Scattering_Albedo', 0.75, 0.99), ('Lidar_Ratio', 20., 100.), ('Depolarization_Ratio', 0.01, 0.3),
+                 ('Absorption_AOD', 0.001, 0.1), ('Absorption_Angstrom', 0.5, 2.5), ('AOD_', 0.02, 1.5),
+                 ('Extinction_Angstrom', 0.2, 2.2), ('Angstrom_Exponent', 0.2, 2.2), ('Refractive_Index-Real', 1.33, 1.6),
+                 ('Refractive_Index-Imaginary', 0.001, 0.05), ('Inflection', 0.4, 0.8), ('180.000000', 0.2, 0.6)]
+
+# columns organized from each file in the pipeline benchmark (as in input_dir/01-inputfile_rawdata.csv)
+BENCHMARK_USE_COLS = {'directsun': ['AOD_%dnm' % w for w in [1020, 870, 675, 500, 440, 380, 340]] + DIRECTSUN_AE[:5]}
+for filetype, columns in INVERSION_COLUMNS.items():
+    BENCHMARK_USE_COLS[filetype] = ['180.000000[%dnm]' % w for w in WAVELENGTHS] if filetype.startswith('pfn') else columns
+for filetype in BENCHMARK_USE_COLS:
+    BENCHMARK_USE_COLS[filetype] = ['AERONET_Site', 'Date(dd:mm:yyyy)', 'Time(hh:mm:ss)'] + BENCHMARK_USE_COLS[filetype]
+# products merged in Module 2 (as in input_dir/02-inputfile_organized.csv)
+BENCHMARK_MERGED = ['directsun', 'ssa', 'lid', 'tab', 'aod', 'rin', 'pfn']
+
+SYNTHETIC_SITES = ['Sao_Paulo', 'Manaus_EMBRAPA', 'Rio_Branco', 'Cuiaba-Miranda', 'Alta_Floresta',
+                   'Ji_Parana_SE', 'Petrolina_SONDA', 'CEILAP-BA']
+
+def synthetic_times(filetype, start, years, rng):
+    '''
+=============================================
+Measurement times of a synthetic all-points file: directsun every 3-15
+minutes from 10 to 20 UTC on ~70% of the days, inversions (almucantars)
+near a few fixed hours of the day
+=============================================
+'''
+    days = pd.date_range(start, periods=int(round(365.25*years)), freq='D')
+    days = days[rng.random(len(days)) > 0.3].to_numpy()
+    if filetype == 'directsun':
+        minutes = 600. + np.cumsum(rng.uniform(3., 15., (len(days), 90)), axis=1)
+        keep = minutes < 1200.
+    else:
+        minutes = np.array([660., 720., 780., 840., 1020., 1080., 1140.]) + rng.uniform(0., 10., (len(days), 7))
+        keep = rng.random(minutes.shape) < 0.4
+    times = days[:, None] + (minutes*60.).astype('int64').astype('timedelta64[s]')
+    return pd.DatetimeIndex(np.sort(times[keep]))
+
+def synthetic_aeronet_file(filename, filetype, site, times, rng, missing=0.01):
+    '''
+=============================================
+Write a synthetic AERONET V3 all-points file (directsun or inversion
+product) with the AERONET header lines, column names and -999 for
+missing values
+
+Input:
+filename , string         Path to the file
+filetype , string         'directsun' or an inversion product (e.g. 'ssa')
+site     , string         AERONET site name
+times    , DatetimeIndex  Measurement times
+rng      , numpy Generator
+missing  , float          Fraction of the product values set to -999
+
+Output:
+Number of data rows written
+=============================================
+'''
+    nrows = len(times)
+    names = ['AERONET_Site', 'Date(dd:mm:yyyy)', 'Time(hh:mm:ss)', 'Day_of_Year', 'Day_of_Year(Fraction)']
+    values = [np.full(nrows, site, dtype=object), times.strftime('%d:%m:%Y'), times.strftime('%H:%M:%S'), times.dayofyear,
+              times.dayofyear + (times.hour*3600 + times.minute*60 + times.second)/86400.]
+
+    if filetype == 'directsun':
+        # spectrally consistent AOD: AOD(w) = AOD(500) * (w/500)^-AE
+        aod500 = rng.lognormal(np.log(0.15), 0.7, nrows)
+        ae = rng.uniform(0.2, 2.2, nrows)
+        for w in DIRECTSUN_WAVELENGTHS:
+            names.append('AOD_%dnm' % w)
+            values.append(aod500 * (w/500.)**(-ae) if w in DIRECTSUN_CHANNELS else np.full(nrows, -999.))
+        names.append('Precipitable_Water(cm)')
+        values.append(rng.uniform(0.5, 5., nrows))
+        # AERONET files have repeated column names (e.g. AOD_Empty), so the columns are kept in lists
+        for name in ['AOD_681nm', 'AOD_709nm'] + ['AOD_Empty']*5 + ['Triplet_Variability_%d' % w for w in DIRECTSUN_WAVELENGTHS] \
+                    + ['Triplet_Variability_Precipitable_Water(cm)', 'Triplet_Variability_681', 'Triplet_Variability_709'] \
+                    + ['Triplet_Variability_AOD_Empty']*5:
+            names.append(name)
+            values.append(np.full(nrows, -999.))
+        for name in DIRECTSUN_AE:
+            names.append(name)
+            values.append(ae + rng.normal(0., 0.05, nrows))
+        products = ['AOD_%dnm' % w for w in DIRECTSUN_CHANNELS] + DIRECTSUN_AE
+        trailer = [('Data_Quality_Level', 'lev15'), ('AERONET_Instrument_Number', 1120), ('AERONET_Site_Name', site),
+                   ('Site_Latitude(Degrees)', -23.5615), ('Site_Longitude(Degrees)', -46.734983), ('Site_Elevation(m)', 786.)]
+        header = ['AERONET Version 3;', site, 'Version 3: AOD Level 1.5',
+                  'The following data are automatically cloud cleared and quality assured with pre-field calibration applied.',
+                  'Contact: PI=AERODOG benchmark; PI Email=none']
+    else:
+        products = INVERSION_COLUMNS[filetype]
+        for name in products:
+            low, high = 0.01, 1.
+            for prefix, rlow, rhigh in COLUMN_RANGES:
+                if name.startswith(prefix):
+                    low, high = rlow, rhigh
+                    break
+            names.append(name)
+            values.append(rng.uniform(low, high, nrows))
+        trailer = [(name, 1.) for name in INVERSION_TRAILER[:-8]] \
+                  + [('Last_Processing_Date(dd:mm:yyyy)', '22:09:2024'), ('Last_Processing_Time(hh:mm:ss)', '10:53:24'),
+                     ('Instrument_Number', 1120), ('Latitude(Degrees)', -23.5615), ('Longitude(Degrees)', -46.734983),
+                     ('Elevation(m)', 786.), ('Inversion_Data_Quality_Level', 'lev15'), ('Retrieval_Measurement_Scan_Type', 'Almucantar')]
+        header = ['AERONET Data Download (Version 3 Direct Sun and Inversion Algorithms)', 'AERONET Version 3', site,
+                  'Version 3: Almucantar Level 1.5 Inversion',
+                  'The following data are cloud cleared and quality controls have been applied but these data may not have final calibration applied.  These data may change.',
+                  'All Points,Contact: PI=AERODOG benchmark; PI Email=none']
+
+    for name in products:
+        column = values[names.index(name)]
+        column[rng.random(nrows) < missing] = -999.
+    for name, value in trailer:
+        names.append(name)
+        values.append(np.full(nrows, value))
+
+    with open(filename, 'w') as afile:
+        afile.write('\n'.join(header) + '\n')
+        afile.write(','.join(names) + '\n')
+        pd.DataFrame(dict(enumerate(values))).to_csv(afile, header=False, index=False, float_format='%.6f')
+    return nrows
+
+def synthetic_aeronet_data(rootdir, nsites=1, years=1, seed=0, start='2005-01-01'):
+    '''
+=============================================
+Write synthetic AERONET V3 files, directsun and all the inversion products,
+for nsites sites, each in its own 00-rawdata/<site>_<first year>_<last year>
+folder (as downloaded by dad.py)
+
+Output:
+List of dicts with the site, filetype, rawdatadir, file name, number of rows
+and size in bytes of each file
+=============================================
+'''
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start)
+    end = start + pd.Timedelta(days=int(round(365.25*years)) - 1)
+    rawfiles = []
+    for i in range(nsites):
+        site = SYNTHETIC_SITES[i % len(SYNTHETIC_SITES)]
+        if i >= len(SYNTHETIC_SITES):
+            site = site + '_%d' % (i//len(SYNTHETIC_SITES))
+        rawdatadir = os.sep.join(['00-rawdata', '%s_%d_%d' % (site, start.year, end.year)])
+        os.makedirs(os.sep.join([rootdir, rawdatadir]), exist_ok=True)
+        # all the inversion products of a site come from the same almucantars
+        inversiontimes = synthetic_times('inversion', start, years, rng)
+        for filetype in ['directsun'] + list(INVERSION_COLUMNS):
+            times = synthetic_times(filetype, start, years, rng) if filetype == 'directsun' else inversiontimes
+            rawfile = '%s_%s_%s_level15.%s' % (start.strftime('%Y%m%d'), end.strftime('%Y%m%d'), site, filetype)
+            filename = os.sep.join([rootdir, rawdatadir, rawfile])
+            nrows = synthetic_aeronet_file(filename, filetype, site, times, rng)
+            rawfiles.append({'site': site, 'filetype': filetype, 'rawdatadir': rawdatadir, 'rawfile': rawfile,
+                             'rows': nrows, 'bytes': os.path.getsize(filename)})
+    return rawfiles
+
+def measuring_stage(report, stage, function, args, rows=None, nbytes=None):
+    '''
+=============================================
+Run function(*args) and add to report its wall time, throughput (rows/s
+and MB/s, when rows and nbytes are given) and the peak RSS of the process
+while it ran (sampled every 5 ms)
+
+Output:
+The result of function(*args)
+=============================================
+'''
+    samples = [apf.current_rss()]
+    done = threading.Event()
+    def sampling():
+        while not done.wait(0.005):
+            samples.append(apf.current_rss())
+    sampler = threading.Thread(target=sampling, daemon=True)
+    sampler.start()
+    t0 = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - t0
+    done.set()
+    sampler.join()
+    samples.append(apf.current_rss())
+
+    entry = {'stage': stage, 'seconds': seconds}
+    if rows is not None:
+        entry['rows'] = int(rows)
+        entry['rows_per_second'] = rows/seconds
+    if nbytes is not None:
+        entry['bytes'] = int(nbytes)
+        entry['mb_per_second'] = nbytes/2**20/seconds
+    samples = [sample for sample in samples if sample is not None]
+    entry['peak_rss_mb'] = max(samples)/2**20 if len(samples) > 0 else None
+    report.append(entry)
+    print('  %-40s %10.3f s %12s rows/s %8s MB peak RSS' % (stage + ':', seconds,
+          '%.0f' % entry['rows_per_second'] if rows is not None else '-',
+          '%.0f' % entry['peak_rss_mb'] if entry['peak_rss_mb'] is not None else '-'))
+    return result
+
+def organizing_files(rootdir, rawfiles, filetype, outputdir):
+    '''Organize (Module 1) all the synthetic raw files of one filetype'''
+    for rawfile in rawfiles:
+        adf.organizing_aeronet_data(rootdir, rawfile['rawfile'], filetype, BENCHMARK_USE_COLS[filetype], 'auto', 15,
+                                    rawfile['rawdatadir'], outputdir)
+
+def git_version():
+    '''Git commit of this AERODOG copy (None if it is not in a git repository)'''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark_pipeline(nsites, years, seed=0, avgtime='15min', output='aerodog_benchmark.json', workdir=None):
+    '''
+=============================================
+Time each AERODOG stage on synthetic AERONET V3 files: organizing and
+mining (per filetype), merging, optical_products, summarizing_aeronet_data,
+angmatrixfunc and each graphics function. The results are saved as JSON in
+output, to compare AERODOG versions.
+=============================================
+'''
+    keep = workdir is not None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='aerodog_bench_')
+    print('Writing synthetic AERONET files (%d sites, %g years): %s' % (nsites, years, workdir))
+    rawfiles = synthetic_aeronet_data(workdir, nsites, years, seed)
+    filetypes = ['directsun'] + list(INVERSION_COLUMNS)
+    outputdir = os.sep.join(['01-organized', 'benchmark_datav01'])
+    os.makedirs(os.sep.join([workdir, outputdir]), exist_ok=True)
+    graphdir = os.sep.join([workdir, '04-graphics'])
+    os.makedirs(graphdir, exist_ok=True)
+
+    stages = []
+    print('Module 1 - organizing_aeronet_data')
+    for filetype in filetypes:
+        files = [rawfile for rawfile in rawfiles if rawfile['filetype'] == filetype]
+        measuring_stage(stages, 'organizing_aeronet_data[%s]' % filetype, organizing_files, (workdir, files, filetype, outputdir),
+                        sum([rawfile['rows'] for rawfile in files]), sum([rawfile['bytes'] for rawfile in files]))
+
+    print('Module 2 - mining_aeronet_data (%s) and merging_aeronet_data' % avgtime)
+    products = []
+    for filetype in filetypes:
+        files = adf.reading_aeronet_data(workdir, filetype, outputdir)
+        nbytes = sum([os.path.getsize(os.sep.join([workdir, outputdir, afile])) for afile in files])
+        nrows = sum([rawfile['rows'] for rawfile in rawfiles if rawfile['filetype'] == filetype])
+        product = measuring_stage(stages, 'mining_aeronet_data[%s]' % filetype, adf.mining_aeronet_data,
+                                  (os.sep.join([workdir, outputdir]), files, avgtime), nrows, nbytes)
+        if filetype in BENCHMARK_MERGED:
+            products.append(product)
+    columnnames = adf.reading_column_names(os.sep.join([os.path.dirname(os.path.abspath(__file__)), 'input_dir', '02-inputfile_columns.csv']))
+    merged = measuring_stage(stages, 'merging_aeronet_data', adf.merging_aeronet_data,
+                             (products, ['inner']*len(products), [avgtime]*len(products), columnnames),
+                             sum([len(product) for product in products]))
+
+    print('Module 3 - optical_products')
+    derived = measuring_stage(stages, 'optical_products', adf.optical_products, (merged.copy(),), len(merged))
+
+    print('Module 4 - graphics')
+    climatology = measuring_stage(stages, 'summarizing_aeronet_data', adf.summarizing_aeronet_data, (derived,), len(derived))
+    ssa_data, sae_data, derivssa = measuring_stage(stages, 'angmatrixfunc', adf.angmatrixfunc, (derived,), len(derived))
+    aod = pd.Series([340, 355, 380, 440, 500, 532, 675, 870, 1020])
+    plots = [('aod_temporal_evolution', agf.aod_temporal_evolution, ('AOD', 15, avgtime, derived, 500, graphdir, 'aod.png')),
+             ('aod_temporal_evolution[template]', agf.aod_temporal_evolution, ('AOD', 15, avgtime, derived, 440, graphdir, 'aod440.png')),
+             ('aod_temporal_evolution[lttb]', agf.aod_temporal_evolution,
+              ('AOD', 15, avgtime, derived, 440, graphdir, 'aod440lttb.png', ('lttb', 1200))),
+             ('allaod_temporal_evolution', agf.allaod_temporal_evolution,
+              ('AOD', 15, avgtime, derived, aod, pd.Series(['on']*len(aod)), graphdir, 'allaod.png')),
+             ('angexp_temporal_evolution', agf.angexp_temporal_evolution, ('AE', 15, avgtime, derived, [440, 870], graphdir, 'ae.png')),
+             ('boxplot_temporal_evolution', agf.boxplot_temporal_evolution,
+              ('LR', 15, climatology, 532, graphdir, 'boxplot.png')),
+             ('scatterplot_AODvsAE', agf.scatterplot_AODvsAE, ('AOD_vs_AE', 15, derived, '532, 440, 675', graphdir, 'aodvsae.png')),
+             ('angsmatrix_plot', agf.angsmatrix_plot, (15, ssa_data, sae_data, derivssa, derived, graphdir, 'angsmatrix.png')),
+             ('scatterplot_AODvsAE[density]', agf.scatterplot_AODvsAE,
+              ('AOD_vs_AE', 15, derived, '532, 440, 675', graphdir, 'aodvsaedensity.png', (100, 'mean'))),
+             ('angsmatrix_plot[density]', agf.angsmatrix_plot,
+              (15, ssa_data, sae_data, derivssa, derived, graphdir, 'angsmatrixdensity.png', (100, 'mean')))]
+    for stage, function, args in plots:
+        measuring_stage(stages, stage, function, args, len(derived))
+    agf.closing_templates()
+
+    report = {'benchmark': 'pipeline',
+              'aerodog_version': git_version(),
+              'date': pd.Timestamp.now().isoformat(timespec='seconds'),
+              'platform': platform.platform(),
+              'python': platform.python_version(),
+              'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'matplotlib': matplotlib.__version__},
+              'parameters': {'sites': nsites, 'years': years, 'seed': seed, 'average_time': avgtime},
+              'raw_files': [dict([(key, rawfile[key]) for key in ['site', 'filetype', 'rows', 'bytes']]) for rawfile in rawfiles],
+              'stages': stages,
+              'total_seconds': sum([stage['seconds'] for stage in stages]),
+              'peak_rss_mb': apf.peak_rss()/2**20 if apf.peak_rss() is not None else None}
+    with open(output, 'w') as afile:
+        json.dump(report, afile, indent=1)
+    print('Benchmark report saved in:', output)
+    if not keep:
+        shutil.rmtree(workdir)
+    return report
+
+def benchmark_imports(repeat=5, limit=None):
+    '''
+=============================================
+Time the import of the AERODOG modules, each one in a new interpreter (best
+of repeat runs), and check that importing aerodog.py does not load the
+DEFERRED_IMPORTS. Exits with an error when it does, or when the import of
+aerodog.py takes longer than limit seconds
+=============================================
+'''
+    code = 'import sys, time; t0 = time.perf_counter(); import {0}; print(time.perf_counter() - t0); print(",".join(sorted(sys.modules)))'
+    env = dict(os.environ, MPLBACKEND='Agg')
+    imports = {}
+    for module in ['aerodog', 'aerodog_function', 'aerodog_graphics_function']:
+        seconds = []
+        for i in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', code.format(module)], text=True, env=env,
+                                             cwd=os.path.dirname(os.path.abspath(__file__))).strip().split('\n')
+            seconds.append(float(output[-2]))
+        imports[module] = (min(seconds), output[-1].split(','))
+        print('import %-28s %8.3f s' % (module, min(seconds)))
+
+    loaded = [module for module in DEFERRED_IMPORTS if module in imports['aerodog'][1]]
+    if len(loaded) > 0:
+        sys.exit('importing aerodog loads ' + ', '.join(loaded) + ', which are only needed by Module 4')
+    if limit is not None and imports['aerodog'][0] > limit:
+        sys.exit('importing aerodog takes %.3f s, more than the limit of %.3f s' % (imports['aerodog'][0], limit))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AERODOG benchmarks')
+    parser.add_argument('benchmark', choices=['globaltime', 'optical', 'compact', 'pipeline', 'imports'])
+    parser.add_argument('--rows', type=int, default=1000000, help='number of synthetic rows')
+    parser.add_argument('--sites', type=int, default=1, help='pipeline: number of synthetic sites')
+    parser.add_argument('--years', type=float, default=1., help='pipeline: years of synthetic data per site (1-20)')
+    parser.add_argument('--seed', type=int, default=0, help='pipeline: seed of the synthetic data')
+    parser.add_argument('--avgtime', default='15min', help='pipeline: average time of Module 2')
+    parser.add_argument('--output', default='aerodog_benchmark.json', help='pipeline: JSON report')
+    parser.add_argument('--workdir', default=None, help='pipeline: keep the synthetic and AERODOG files in this folder')
+    parser.add_argument('--repeat', type=int, default=5, help='imports: number of runs of each import (the best is kept)')
+    parser.add_argument('--limit', type=float, default=None, help='imports: maximum time to import aerodog.py, in seconds')
+    args = parser.parse_args()
+
+    if args.benchmark == 'globaltime':
+        benchmark_globaltime(args.rows)
+    elif args.benchmark == 'optical':
+        benchmark_optical(args.rows)
+    elif args.benchmark == 'compact':
+        benchmark_compact(args.rows)
+    elif args.benchmark == 'pipeline':
+        benchmark_pipeline(args.sites, args.years, args.seed, args.avgtime, args.output, args.workdir)
+    elif args.benchmark == 'imports':
+        benchmark_imports(args.repeat, args.limit)
@@ -0,0 +1,215 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to keep the results of the slow AERODOG steps in an on-disk cache
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+The results of mining_aeronet_data (Module 2), optical_products (Module 3),
+summarizing_aeronet_data and angmatrixfunc (Module 4) are saved in a cache folder, under
+a key made of:
+  - the content hash of the input data (the v01 files or the input DF)
+  - the identity of the function (module, name and a hash of its source code
+    and of the source of its module, so a change in a helper it calls, e.g.
+    mining_aeronet_data_incremental, also changes the key)
+  - the parameters that change the result (e.g. avgtime, list of products,
+    and the identity of the code the function uses from other modules or
+    registries, e.g. the optical products, see registry_identity)
+so running again with the same data and parameters (e.g. to change only the
+graphics) loads the result instead of calculating it. A change in the data,
+in the parameters or in the code gives a new key.
+
+The cache keeps at most CACHE['maxbytes'] bytes: when it is full, the
+results used least recently are removed (each hit updates the modification
+time of the file). The size of the cache is found once per process and then
+kept up to date as results are written, so the folder is only scanned again
+when it grows beyond the limit. Set CACHE['bypass'] (--no-cache) to
+calculate everything without reading or writing the cache.
+"""
+import os
+import json
+import pickle
+import hashlib
+import inspect
+import pandas as pd
+import aerodog_manifest as adm
+
+# folder of the cache (None: no cache), maximum size in bytes, bypass flag (see configuring_cache)
+# and size of the cache folder (None: not known yet, see cached_call)
+CACHE = {'dir': None, 'maxbytes': 2*1024**3, 'bypass': False, 'bytes': None}
+
+# change to invalidate all the results already in the caches
+CACHE_VERSION = 2
+
+# hash of the source of the modules already read in this run, by module name
+SOURCE_HASHES = {}
+
+# content hash of the files already hashed in this run, by (path, size, modification time)
+FILE_HASHES = {}
+
+def configuring_cache(cachedir, maxbytes=None, bypass=False):
+    '''
+=============================================
+Function to set the cache folder, its maximum size and the bypass flag
+
+Input:
+cachedir , string   Folder of the cache (None turns the cache off)
+maxbytes , integer  Maximum size of the cache in bytes (default: 2 GB)
+bypass   , boolean  Calculate everything, without reading or writing the cache
+=============================================
+'''
+    CACHE['dir'] = cachedir
+    if maxbytes is not None:
+        CACHE['maxbytes'] = maxbytes
+    CACHE['bypass'] = bypass
+    CACHE['bytes'] = None
+
+def hashing_files(filenames):
+    '''Function to calculate the content hash of a list of files (each file is hashed once per run, unless it changes)'''
+    hashes = []
+    for filename in sorted(filenames):
+        stat = os.stat(filename)
+        filekey = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        if filekey not in FILE_HASHES:
+            FILE_HASHES[filekey] = adm.hashing_file(filename)
+        hashes.append(os.path.basename(filename) + ':' + FILE_HASHES[filekey])
+    return hashes
+
+def hashing_frame(df):
+    '''Function to calculate the content hash of a DF (values, index, column names and types)'''
+    sha = hashlib.sha256()
+    sha.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    sha.update(repr([(str(name), str(dtype)) for name, dtype in df.dtypes.items()]).encode())
+    sha.update(repr(list(df.index.names)).encode())
+    return sha.hexdigest()
+
+def hashing_source(obj):
+    '''Function to calculate the hash of the source code of a function or module ('' when the source is not available)'''
+    try:
+        source = inspect.getsource(obj)
+    except (OSError, TypeError):
+        source = ''
+    return hashlib.sha256(source.encode()).hexdigest()
+
+def function_identity(function):
+    '''
+=============================================
+Function to identify a function by its module, name and the hash of its
+source code and of the source of its module (the helpers a function calls
+are usually in its module, e.g. mining_aeronet_data_incremental and
+writing_mining_state, or the optical product formulas of aerodog_function)
+=============================================
+'''
+    module = inspect.getmodule(function)
+    if module is None:
+        modulehash = ''
+    else:
+        if module.__name__ not in SOURCE_HASHES:
+            SOURCE_HASHES[module.__name__] = hashing_source(module)
+        modulehash = SOURCE_HASHES[module.__name__]
+    return function.__module__ + '.' + function.__qualname__ + ':' + hashlib.sha256((hashing_source(function) + modulehash).encode()).hexdigest()
+
+def registry_identity(registry):
+    '''
+=============================================
+Function to identify a registry of functions (e.g. adf.OPTICAL_PRODUCTS),
+to be added to the parameters of a cached call that uses it: the hash of
+the name of each entry, the identity of its function and its other fields
+(e.g. the inputs and numexpr expression of an optical product)
+=============================================
+'''
+    entries = []
+    for name, entry in registry.items():
+        fields = {key: (function_identity(value) if callable(value) else value) for key, value in entry.items()}
+        entries.append([name, fields])
+    return hashlib.sha256(json.dumps(entries, sort_keys=True, default=str).encode()).hexdigest()
+
+def caching_key(function, inputs, params):
+    '''
+=============================================
+Function to build the cache key of a call: sha256 of the input hashes, the
+identity of the function and its parameters (JSON-compatible values)
+=============================================
+'''
+    key = {'version': CACHE_VERSION, 'pandas': pd.__version__, 'function': function_identity(function),
+           'inputs': list(inputs), 'params': params}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+def sizing_cache(cachedir):
+    '''Function to add the sizes of the results in the cache folder, in bytes'''
+    total = 0
+    for subdir in os.scandir(cachedir):
+        if subdir.is_dir():
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.pkl'):
+                    total += entry.stat().st_size
+    return total
+
+def evicting_cache(cachedir, maxbytes):
+    '''Function to remove the results used least recently until the cache folder holds at most maxbytes. Returns the size left, in bytes'''
+    entries = []
+    for subdir in os.scandir(cachedir):
+        if subdir.is_dir():
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.pkl'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum([size for mtime, size, path in entries])
+    for mtime, size, path in sorted(entries):
+        if total <= maxbytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+def cached_call(function, inputs, params, *args):
+    '''
+=============================================
+Function to call function(*args) through the cache
+
+Input:
+function , function         Function to call
+inputs   , list of strings  Content hashes of the input data (see hashing_files
+                            and hashing_frame)
+params   , dict             Parameters that change the result (JSON-compatible)
+args     ,                  Arguments of the function
+
+Output:
+The result of function(*args), loaded from the cache when the same call
+was already made (same input data, parameters and function code)
+=============================================
+'''
+    if CACHE['dir'] is None or CACHE['bypass']:
+        return function(*args)
+
+    key = caching_key(function, inputs, params)
+    cachefile = os.sep.join([CACHE['dir'], key[:2], key + '.pkl'])
+    if os.path.exists(cachefile):
+        try:
+            with open(cachefile, 'rb') as afile:
+                result = pickle.load(afile)
+            # the file was used now: it is the last one to be evicted
+            os.utime(cachefile)
+            print('Cache hit:', function.__name__, key[:12])
+            return result
+        except (OSError, EOFError, pickle.UnpicklingError):
+            print('Cache file unreadable, calculating again:', cachefile)
+
+    result = function(*args)
+    os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+    # written to a temporary name first, so other processes never read a partial file
+    tmpfile = cachefile + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpfile, 'wb') as afile:
+        pickle.dump(result, afile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpfile, cachefile)
+    # the folder is scanned once per process, then its size is kept up to date (other processes
+    # writing to the same cache are only seen when the folder is scanned again, to evict)
+    if CACHE['bytes'] is None:
+        CACHE['bytes'] = sizing_cache(CACHE['dir'])
+    else:
+        CACHE['bytes'] += os.path.getsize(cachefile)
+    if CACHE['bytes'] > CACHE['maxbytes']:
+        CACHE['bytes'] = evicting_cache(CACHE['dir'], CACHE['maxbytes'])
+    return result
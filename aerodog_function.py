@@ -10,9 +10,16 @@ Last update: November 19, 2025 by hbarbosa
   - Bug fix: mining_aeronet_data() now concatenates all the files listed. 
 """
 import os
+import re
+import ast
+import json
 import math
+import time
+import fnmatch
+import hashlib
 import numpy as np
 import pandas as pd
+import aerodog_storage as ads
 
 def globaltime_function(row): 
     '''
@@ -25,36 +32,449 @@ globaltime variable - concatenate Date and time
     dateformat = dateframe.strftime('%Y-%m-%d %H:%M:%S')
     return dateformat
 
+def globaltime_column(funcdata):
+    '''
+=============================================
+globaltime variable - vectorized version of globaltime_function
+
+Concatenates the Date(dd:mm:yyyy) and Time(hh:mm:ss) columns and parses
+them in a single call, returning a datetime64 Series (instead of the
+per-row string built by globaltime_function).
+=============================================
+'''
+    date = funcdata['Date(dd:mm:yyyy)'].astype(str) + ' ' + funcdata['Time(hh:mm:ss)'].astype(str)
+    return pd.to_datetime(date, format='%d:%m:%Y %H:%M:%S')
+
 def globaltime_index(funcdata):
     '''
 =============================================
 Function to set Date and Time as globaltime index
 =============================================
 '''
-    funcdata['globaltime'] = pd.to_datetime(funcdata['globaltime'],format= '%Y-%m-%d %H:%M:%S' )
+    # globaltime is already datetime64 when it comes from globaltime_column(),
+    # only files read back from CSV need to be parsed again
+    if not pd.api.types.is_datetime64_any_dtype(funcdata['globaltime']):
+        funcdata['globaltime'] = pd.to_datetime(funcdata['globaltime'],format= '%Y-%m-%d %H:%M:%S' )
     funcdata = funcdata.set_index('globaltime')
     return funcdata
 
+def compacting_frame(funcdata):
+    '''
+=============================================
+Function to change an AERODOG DF (v01, v02 or v03) to compact types, for
+the compact mode:
+  - float64 columns -> float32 (about 7 significant digits, as many as the
+    6 decimals of the AERONET files for values below 10)
+  - Day_of_Year -> integer (Int16, empty values allowed)
+  - AERONET_Site, and the text columns whose values repeat (e.g.
+    Date(dd:mm:yyyy)) -> categorical
+  - globaltime -> datetime64
+The optical products calculated from float32 columns are float32 too
+(calculated in float64, see optical_products).
+
+Input:
+funcdata , pandas DF  AERODOG data (the index is kept)
+
+Output:
+pandas DF with the compact types (about half the memory of the float64 DF)
+=============================================
+'''
+    dtypes = {}
+    for name in funcdata.columns:
+        column = funcdata[name]
+        if name == 'globaltime':
+            if not pd.api.types.is_datetime64_any_dtype(column):
+                dtypes[name] = 'datetime64[ns]'
+        elif name == 'Day_of_Year' and pd.api.types.is_numeric_dtype(column):
+            # only when all the days are integers (e.g. not the mean of bins that cross midnight)
+            values = column.dropna()
+            if (values == values.round()).all():
+                dtypes[name] = 'Int16'
+        elif pd.api.types.is_float_dtype(column) and column.dtype != np.float32:
+            dtypes[name] = np.float32
+        elif (pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column)) and not isinstance(column.dtype, pd.CategoricalDtype):
+            if name == 'AERONET_Site' or column.nunique() <= len(column) // 2:
+                dtypes[name] = 'category'
+    if len(dtypes) == 0:
+        return funcdata
+    return funcdata.astype(dtypes)
+
+'''
+=============================================
+Index of the AERONET files of a folder (00-rawdata/<rawdatadir> or
+01-organized/<outputdir>)
+
+Each folder is scanned once with os.scandir, and its files are grouped by
+site, product (file extension, e.g. ssa) and level, from names like
+20240701_20241031_Sao_Paulo_level15.ssa[.parquet]. The index is kept for
+the rest of the run (FILE_INDEX) and only built again when the folder
+changes (new modification time, e.g. after Module 1 writes the v01 files),
+so the many listings of the same folder in Modules 1 and 2 cost one stat.
+'''
+AERONET_FILENAME = re.compile(r'^\d{8}_\d{8}_(?P<site>.+)_level(?P<level>[^._]+)\.(?P<product>[^.]+)$')
+
+# index of each folder already scanned in this run, by absolute path: (modification time, scan time, index)
+FILE_INDEX = {}
+
+def scanning_aeronet_files(inputdir):
+    '''Generator of the files of a folder, in the order of os.scandir: (name, site, product, level); site and level are None when the name is not an AERONET file name'''
+    with os.scandir(inputdir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            basename = ads.storage_basename(entry.name)
+            match = AERONET_FILENAME.match(basename)
+            if match is None:
+                yield entry.name, None, basename, None
+            else:
+                yield entry.name, match.group('site'), match.group('product'), match.group('level')
+
+def indexing_aeronet_files(inputdir):
+    '''
+=============================================
+Function to index the files of a folder (see scanning_aeronet_files), or
+return the index of this run when the folder did not change
+
+Output:
+dict with:
+  files  - names of the files, in the order of os.scandir
+  groups - {(site, product, level): positions of its files in files}
+=============================================
+'''
+    path = os.path.abspath(inputdir)
+    mtime = os.stat(path).st_mtime_ns
+    cached = FILE_INDEX.get(path)
+    # a folder changed less than 1 s before its scan may change again with the same
+    # modification time (coarse file system clocks), so it is scanned again
+    if cached is not None and cached[0] == mtime and cached[1] - mtime > 1e9:
+        return cached[2]
+    scantime = time.time_ns()
+    index = {'files': [], 'groups': {}}
+    for name, site, product, level in scanning_aeronet_files(path):
+        index['groups'].setdefault((site, product, level), []).append(len(index['files']))
+        index['files'].append(name)
+    FILE_INDEX[path] = (mtime, scantime, index)
+    return index
+
+def iterating_aeronet_files(inputdir, filetype=None, site=None, level=None):
+    '''
+=============================================
+Generator of the AERONET files of a folder (names, in the order of
+os.scandir) of a filetype (files whose name, without the storage extension,
+ends with it, e.g. ssa), site and level (e.g. 15), from the index of the
+folder (see indexing_aeronet_files)
+=============================================
+'''
+    index = indexing_aeronet_files(inputdir)
+    positions = []
+    for (groupsite, product, grouplevel), grouppositions in index['groups'].items():
+        if filetype is not None and not product.endswith(filetype):
+            continue
+        if (site is not None and groupsite != site) or (level is not None and grouplevel != str(level)):
+            continue
+        positions += grouppositions
+    for position in sorted(positions):
+        yield index['files'][position]
+
 def reading_aeronet_data(rootdir,filetype,rawdatadir):
     '''
 =============================================
 Function to read files from AERONET - direct-sun and inversion algorithm - level1.5 or level2.0 
+(names of the files of a filetype in rootdir/rawdatadir, from the index of
+the folder, see iterating_aeronet_files)
+=============================================
+'''
+    # organized files may have a storage extension (e.g. .parquet) after the filetype
+    return list(iterating_aeronet_files(os.sep.join([rootdir,rawdatadir]), filetype))
+
+def loading_aeronet_files(inputdir, files):
+    '''Generator of the DFs of the organized (v01) files of a list, read one at a time in name order'''
+    for afile in sorted(files):
+        yield ads.loading_aeronet_data(os.sep.join([inputdir, afile]))
+
+def parsing_use_cols(use_cols):
+    '''
+=============================================
+Function to convert the use_cols entry of 01-inputfile_rawdata into a list
+
+Columns can be given by position (e.g. "0,1,2,5,88") or by name (e.g.
+"AERONET_Site,Date(dd:mm:yyyy),Time(hh:mm:ss),180.000000[440nm]"), or both.
 =============================================
 '''
+    try:
+        return list(ast.literal_eval(use_cols))
+    except (ValueError, SyntaxError):
+        columns = [name.strip() for name in use_cols.split(',')]
+        return [int(name) if name.isdigit() else name for name in columns]
+
+def sniffing_aeronet_header(filename, maxlines=50):
+    '''
+=============================================
+Function to find the column header line of an AERONET (V3) file
+
+The AERONET download files start with a block of free text lines (site,
+level, contact, etc.) whose size changes between products. The column
+header is the first line with the Date(dd:mm:yyyy) column.
+
+Output:
+rowstoskip , integer          Number of lines before the column header
+names      , list of strings  Column names
+values     , list of strings  Values in the first data line (or empty)
+=============================================
+'''
+    with open(filename, 'r', errors='replace') as rawfile:
+        for rowstoskip in range(0, maxlines):
+            line = rawfile.readline()
+            if line == '':
+                break
+            if 'Date(dd:mm:yyyy)' in line:
+                names = line.rstrip('\r\n').split(',')
+                values = rawfile.readline().rstrip('\r\n').split(',')
+                return rowstoskip, names, values
+    raise ValueError('sniffing_aeronet_header:: no column header found in ' + filename)
+
+def reading_aeronet_columns(filename, use_cols, rowstoskip='auto', engine='auto'):
+    '''
+=============================================
+Function to read only the requested columns of an AERONET (V3) file
+
+Input:
+filename   , string   Path to the AERONET file
+use_cols   , list     Columns to read, by position or by name
+rowstoskip , integer  Lines before the column header, or 'auto' to find it
+                      with sniffing_aeronet_header()
+engine     , string   'pyarrow', 'c' or 'auto' (pyarrow if installed)
+
+Output:
+pandas DF with the requested columns. Columns are typed from the first
+data line: float64 for numbers, string otherwise.
+=============================================
+'''
+    headerline, names, values = sniffing_aeronet_header(filename)
+    if rowstoskip != 'auto' and not pd.isna(rowstoskip) and int(rowstoskip) != headerline:
+        print('reading_aeronet_columns:: rows_to_skip=' + str(rowstoskip) + ' but column header found after '
+              + str(headerline) + ' lines in ' + os.path.basename(filename) + ', using the header found')
+
+    # repeated names are made unique as pandas does (name, name.1, ...)
+    for i in range(0, len(names)):
+        if names[i] in names[:i]:
+            names[i] = names[i] + '.' + str(names[:i].count(names[i]))
+
+    positions = []
+    for column in use_cols:
+        if isinstance(column, str) and not column.isdigit():
+            if column not in names:
+                raise ValueError('reading_aeronet_columns:: column ' + column + ' not found in ' + os.path.basename(filename))
+            positions.append(names.index(column))
+        else:
+            positions.append(int(column))
+    positions = sorted(set(positions))
+    columns = [names[i] for i in positions]
+
+    dtypes = {}
+    for i in positions:
+        try:
+            float(values[i] or 'nan')
+            dtypes[names[i]] = 'float64'
+        except (ValueError, IndexError):
+            dtypes[names[i]] = 'str'
+
+    if engine == 'auto':
+        try:
+            import pyarrow
+            engine = 'pyarrow'
+        except ImportError:
+            engine = 'c'
+
+    if engine == 'pyarrow':
+        import pyarrow
+        import pyarrow.csv
+        arrowtypes = {name: pyarrow.float64() if dtypes[name] == 'float64' else pyarrow.string() for name in columns}
+        table = pyarrow.csv.read_csv(filename,
+                                     read_options=pyarrow.csv.ReadOptions(skip_rows=headerline+1, column_names=names),
+                                     convert_options=pyarrow.csv.ConvertOptions(include_columns=columns, column_types=arrowtypes))
+        return table.to_pandas()
+    return pd.read_csv(filename, skiprows=headerline, usecols=positions, dtype=dtypes, engine=engine)
+
+'''
+=============================================
+Quality control (QC) of the organized data (Module 1)
+=============================================
+
+Each QC rule applies to the numeric columns whose names match a pattern
+(fnmatch, e.g. Single_Scattering_Albedo* or *) of the files of a filetype
+(pattern too, e.g. ssa or *):
+  - sentinels: values that mean "no data" (e.g. -999 and 0 in AERONET files)
+  - range: physical range of the values, in interval notation, e.g. (0,1]
+    for SSA or [0,inf) for AOD
+Values that are sentinels or out of range become NaN. A row is removed when
+a required column is NaN; optional columns only lose that value. When more
+than one rule matches a column, all their sentinels and ranges are applied
+and the last one decides if the column is required. Text columns (e.g.
+AERONET_Site) are only required when the last rule matching them says so.
+The default rules are the ones of the previous AERODOG versions: -999 and 0
+are missing values in all columns, and all the columns are required.
+'''
+QC_DEFAULT_RULES = [{'filetype': '*', 'column': '*', 'sentinels': [-999., 0.], 'range': None, 'required': True,
+                     'label': '* sentinels -999;0'}]
+
+def parsing_qc_range(interval):
+    '''Function to read a range in interval notation, e.g. "(0,1]" -> (0., False, 1., True); None for an empty range. Missing bounds (or inf) are open'''
+    if pd.isna(interval) or str(interval).strip() == '':
+        return None
+    match = re.match(r'^\s*([\(\[])\s*([^,]*?)\s*,\s*([^,]*?)\s*([\)\]])\s*$', str(interval))
+    if match is None:
+        raise ValueError('parsing_qc_range:: range ' + str(interval) + ' is not in interval notation, e.g. (0,1] or [0,inf)')
+    low = float(match.group(2)) if match.group(2) not in ['', '-inf'] else -np.inf
+    high = float(match.group(3)) if match.group(3) not in ['', 'inf', '+inf'] else np.inf
+    return (low, match.group(1) == '[', high, match.group(4) == ']')
+
+def reading_qc_rules(filename):
+    '''
+=============================================
+Function to read the QC rules of Module 1 from a csv file with the columns
+filetype,column,sentinels,range,required, e.g.
+
+    filetype,column,sentinels,range,required
+    *,*,-999;0,,on
+    ssa,Single_Scattering_Albedo*,,"(0,1]",on
+    directsun,AOD_*,,"[0,inf)",off
+
+Output:
+List of rules (dicts with filetype, column, sentinels, range, required and
+label), QC_DEFAULT_RULES when the file does not exist or only has the
+default rules (so the manifests of the organized files stay valid)
+=============================================
+'''
+    if not os.path.exists(filename):
+        return QC_DEFAULT_RULES
+    table = pd.read_csv(filename, sep = ',', dtype=str)
+    rules = []
+    for j in range(0,len(table)):
+        sentinels = []
+        if not pd.isna(table['sentinels'][j]):
+            sentinels = [float(value) for value in str(table['sentinels'][j]).split(';') if value.strip() != '']
+        interval = parsing_qc_range(table['range'][j])
+        label = table['column'][j]
+        if len(sentinels) > 0:
+            label += ' sentinels ' + ';'.join(['%g' % value for value in sentinels])
+        if interval is not None:
+            label += ' range ' + str(table['range'][j]).strip()
+        rules.append({'filetype': table['filetype'][j], 'column': table['column'][j], 'sentinels': sentinels, 'range': interval,
+                      'required': pd.isna(table['required'][j]) or table['required'][j].strip() != 'off', 'label': label})
+    if rules == QC_DEFAULT_RULES:
+        return QC_DEFAULT_RULES
+    return rules
+
+def selecting_qc_rules(qcrules, filetype):
+    '''Function to select the QC rules of a filetype (rules whose filetype pattern matches it)'''
+    return [rule for rule in qcrules if fnmatch.fnmatchcase(str(filetype), rule['filetype'])]
+
+def checking_quality(f, rules):
+    '''
+=============================================
+Function to apply the QC rules to the columns of a DF, in a single pass over
+each column: the rows where a required column is NaN, a sentinel or out of
+range are marked to be removed (the columns are read in place, without a
+copy). Only the rows kept are copied to the new DF, and the values that are
+sentinels or out of range in optional columns are then set to NaN there.
+
+Input:
+f     , pandas DF       Data read from an AERONET file
+rules , list of dicts   QC rules (see reading_qc_rules), already selected for
+                        the filetype of the file
+
+Output:
+pandas DF with the rows kept (same index as f), and dict with the number of
+rows removed by each rule ('missing': values already missing in the file).
+Each row removed is counted once, for the first reason found.
+=============================================
+'''
+    keep = np.ones(len(f), dtype=bool)
+    removed = {'missing': 0}
+    for rule in rules:
+        removed[rule['label']] = 0
+    # optional numeric column -> rows whose value becomes NaN
+    nulled = {}
+    for name in f.columns:
+        matched = [rule for rule in rules if fnmatch.fnmatchcase(name, rule['column'])]
+        required = matched[-1]['required'] if len(matched) > 0 else False
+        missing = f[name].isna().to_numpy()
+        if required:
+            removed['missing'] += int(np.count_nonzero(missing & keep))
+            keep &= ~missing
+        if not pd.api.types.is_numeric_dtype(f[name]) or len(matched) == 0:
+            continue
+        # a read-only view of the column (a float copy only for the nullable types)
+        if isinstance(f[name].dtype, np.dtype):
+            values = f[name].to_numpy()
+        else:
+            values = f[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        invalid = np.zeros(len(f), dtype=bool)
+        for rule in matched:
+            bad = np.zeros(len(f), dtype=bool)
+            if len(rule['sentinels']) > 0:
+                bad |= np.isin(values, rule['sentinels'])
+            if rule['range'] is not None:
+                low, lowinclusive, high, highinclusive = rule['range']
+                bad |= (values < low) if lowinclusive else (values <= low)
+                bad |= (values > high) if highinclusive else (values >= high)
+            if required:
+                removed[rule['label']] += int(np.count_nonzero(bad & keep))
+                keep &= ~bad
+            else:
+                invalid |= bad
+        if invalid.any():
+            nulled[name] = invalid
+
+    kept = f[keep] if not keep.all() else f.copy(deep=False)
+    for name, invalid in nulled.items():
+        invalid = invalid[keep]
+        if not invalid.any():
+            continue
+        # integer columns become float only when they have NaN values (the others keep their type)
+        values = kept[name].to_numpy(dtype=np.result_type(f[name].dtype, np.float32), na_value=np.nan, copy=True)
+        values[invalid] = np.nan
+        kept[name] = values
+    return kept, removed
+
+def organized_filename(rootdir,rawfile,filetype,rawlevel,rawdatadir,outputdir,storage=None):
+    '''
+=============================================
+Function to build the path of the organized (v01) file of a raw AERONET file
+=============================================
+'''
+    if storage is None:
+        storage = ads.default_storage()
     inputdir = os.sep.join([rootdir,rawdatadir])
-    files = [name for name in os.listdir(inputdir) if name.endswith(filetype)]
-    
-    return files
+    newfiles = os.sep.join([inputdir, rawfile])
+    newfilepath = newfiles.replace(rawdatadir, outputdir).replace('_'+str(rawlevel)+'.'+filetype, '.'+str(rawlevel)+'_'+filetype+'_v01')
+    return newfilepath + ads.STORAGE_EXTENSIONS[storage]
 
-def organizing_aeronet_data(rootdir,rawfile,filetype,use_cols,rowstoskip,rawlevel,rawdatadir,outputdir):
+def organizing_aeronet_data(rootdir,rawfile,filetype,use_cols,rowstoskip,rawlevel,rawdatadir,outputdir,storage=None,compact=False,qcrules=None,raw=None,saving=None):
     '''
 =============================================
 Function for organization of AERONET Aerosol Optical Depth (V3) - level1.5 or level2.0 data - direct sun and inversion algorithm
+
+The organized (v01) file is saved with aerodog_storage.saving_aeronet_data()
+in the given storage format ('parquet', 'feather' or 'csv'; default:
+aerodog_storage.default_storage()). The rows are checked with the QC rules
+of the filetype (qcrules, default QC_DEFAULT_RULES, see checking_quality).
+With compact=True the columns are changed to compact types first (see
+compacting_frame). Returns the organized pandas DF, with the number of rows
+read and removed by each QC rule in its attrs['quality_control'].
+
+The columns of the raw file can be given already read (raw, a DF read by
+reading_aeronet_columns), and the v01 file can be saved by another function
+with the same arguments as saving_aeronet_data (saving, e.g. one that queues
+the write on a background thread, see aerodog_tasks.pipelining_organize).
 =============================================
 '''
+    if storage is None:
+        storage = ads.default_storage()
     inputdir = os.sep.join([rootdir,rawdatadir])
     newfiles = os.sep.join([inputdir, rawfile])
-    newfilepath = newfiles.replace(rawdatadir, outputdir).replace('_'+str(rawlevel)+'.'+filetype, '.'+str(rawlevel)+'_'+filetype+'_v01')
+    newfilepath = ads.storage_basename(organized_filename(rootdir,rawfile,filetype,rawlevel,rawdatadir,outputdir,storage))
     #print("organizing_aeronet_data:: rootdir= ", rootdir)
     #print("organizing_aeronet_data:: rawfile= ", rawfile)
     #print("organizing_aeronet_data:: filetype= ", filetype)
@@ -65,15 +485,24 @@ Function for organization of AERONET Aerosol Optical Depth (V3) - level1.5 or le
     #print("organizing_aeronet_data:: outputdir= ", outputdir)
     #print("organizing_aeronet_data:: newfiles= ", newfiles)
     #print("organizing_aeronet_data:: newfilepath= ", newfilepath)
-    f = pd.read_csv(newfiles,usecols=use_cols, skiprows=range(0, rowstoskip))
-    f = f.replace(-999.,np.nan)
-    f = f.replace(0,np.nan)
-    f = f.dropna()
-    f.insert(1,'globaltime',f.apply(globaltime_function, axis=1))
-    f.to_csv(newfilepath,float_format="%.6f",index=False)  
+    if qcrules is None:
+        qcrules = QC_DEFAULT_RULES
+    if saving is None:
+        saving = ads.saving_aeronet_data
+    f = raw if raw is not None else reading_aeronet_columns(newfiles, use_cols, rowstoskip)
+    nrows = len(f)
+    f, removed = checking_quality(f, selecting_qc_rules(qcrules, filetype))
+    print('Quality control:', nrows, 'rows read,', len(f), 'kept; removed:',
+          ', '.join([label + ' = ' + str(count) for label, count in removed.items() if count > 0]) or 'none')
+    f.insert(1,'globaltime',globaltime_column(f))
+    if compact:
+        f = compacting_frame(f)
+    saving(f, newfilepath, storage)
+    f.attrs['quality_control'] = dict(removed, rows_read=nrows)
+    return f
 
-def mining_aeronet_data(inputdir, files, avgtime):
-'''
+def mining_aeronet_data(inputdir, files, avgtime, statedir=None, storage=None):
+    '''
 =============================================
 Function to concatenate direct-sun and inversion algorithm from AERONET data measurements. 
 
@@ -81,31 +510,304 @@ Input:
 inputdir , string           Path to folder where files are
 files    , list of strings  List of files to read from inputdir
 avgtime  , string           Resample time (e.g. 15min, 1hour)
+statedir , string           Folder to keep the resampling state between runs.
+                            When given, only the rows appended to the files
+                            since the last run are resampled (see
+                            mining_aeronet_data_incremental)
+storage  , string           Storage format of the state files
 
 Output:
 A single pandas DF with the data from all files concatenated. 
 =============================================
-'''        
-        lenfiles = len(files)
-        #print("mining_aeronet_data:: inputdir= ", inputdir)
-        #print("mining_aeronet_data:: files= ", files)
-        #print("mining_aeronet_data:: avgtime= ", avgtime)
+'''
+    if statedir is not None:
+        return mining_aeronet_data_incremental(inputdir, files, avgtime, statedir, storage)
 
-        aeronetfile = []
-        for afile in files:
-            aeronetfile.append( pd.read_csv(os.sep.join([inputdir, afile])) )
+    #print("mining_aeronet_data:: inputdir= ", inputdir)
+    #print("mining_aeronet_data:: files= ", files)
+    #print("mining_aeronet_data:: avgtime= ", avgtime)
 
-        aeronetfile = pd.concat(aeronetfile, axis=0)
-            
-        # add time index to dataset
-        aeronetfile_index = globaltime_index(aeronetfile)
-        # resample as XX minutes mean data
-        aeronetfile_mean = aeronetfile_index.groupby('AERONET_Site').resample(avgtime).mean(numeric_only=True)
-        # exclude times when all values are NaN
-        aeronetfile_mean = aeronetfile_mean.dropna()
+    # the files are read one at a time, as the concatenation consumes them
+    aeronetfile = pd.concat(loading_aeronet_files(inputdir, files), axis=0)
+    return resampling_aeronet_data(aeronetfile, avgtime)
+
+def resampling_aeronet_data(aeronetfile, avgtime):
+    '''Function to resample (mean) the concatenated rows of the v01 files as avgtime bins of each site'''
+    # keep the rows in time order (files may be listed in any order)
+    aeronetfile = aeronetfile.sort_values('globaltime', kind='stable')
         
+    # add time index to dataset
+    aeronetfile_index = globaltime_index(aeronetfile)
+    # resample as XX minutes mean data
+    aeronetfile_mean = aeronetfile_index.groupby('AERONET_Site').resample(avgtime).mean(numeric_only=True)
+    # exclude times when all values are NaN
+    aeronetfile_mean = aeronetfile_mean.dropna(how='all')
+    
+    return aeronetfile_mean
+
+def hashing_rows(aeronetfile):
+    '''Hash of the content of a dataframe (used to check that old rows did not change)'''
+    return hashlib.sha256(pd.util.hash_pandas_object(aeronetfile, index=False).to_numpy().tobytes()).hexdigest()
+
+def fixed_step(avgtime):
+    '''True for average times with bins that can be computed from the bin origin (e.g. 15min, 1h, 1D), False for calendar steps (e.g. 2D, 1MS, 1W)'''
+    offset = pd.tseries.frequencies.to_offset(avgtime)
+    return isinstance(offset, pd.offsets.Tick) or (isinstance(offset, pd.offsets.Day) and offset.n == 1)
+
+def bin_start(globaltime, avgtime, origin):
+    '''Start of the resample bin (fixed avgtime, e.g. 15min) that contains globaltime'''
+    step = pd.Timedelta(pd.tseries.frequencies.to_offset(avgtime).nanos, unit='ns')
+    return origin + ((globaltime - origin) // step) * step
+
+def mining_aeronet_data_incremental(inputdir, files, avgtime, statedir, storage=None):
+    '''
+=============================================
+Function to resample only the new rows of the organized (v01) files
+
+Same output as mining_aeronet_data(), but the resampled data of the
+previous run is kept in statedir, together with:
+  - for each v01 file, its size, modification time, number of rows and a
+    hash of its rows;
+  - for each site, the origin of the resample bins (start of the first day,
+    as in pandas resample), the last time read and the rows of the last
+    (still open) time bin.
+New rows (new files, or rows appended to known files) are resampled
+together with the rows of the last open bin of each site, which replaces
+that bin and appends the new ones. The result is the same as resampling the
+whole history, as each bin is always averaged from all its rows.
+
+The whole history is resampled again (and the state rebuilt) when there is
+no state, when avgtime is not a fixed time step (e.g. 1M), when a file was
+removed or its old rows changed, or when new rows are not after the last
+time already read for their site.
+=============================================
+'''
+    if storage is None:
+        storage = ads.default_storage()
+    statefile = os.sep.join([statedir, 'state.json'])
+    state = None
+    if os.path.exists(statefile):
+        with open(statefile, 'r') as afile:
+            state = json.load(afile)
+
+    # fixed time steps (e.g. 15min, 1h, 1D) have bins that can be computed from
+    # the bin origin; calendar steps (e.g. 2D, 1MS, 1W) are always fully resampled
+    offset = pd.tseries.frequencies.to_offset(avgtime)
+    fixedstep = fixed_step(avgtime)
+
+    fullrecompute = state is None or state['avgtime'] != avgtime or not fixedstep
+    if not fullrecompute and not set(state['files']) <= set(files):
+        print('mining_aeronet_data_incremental:: files removed since the last run')
+        fullrecompute = True
+
+    # read the new rows of each file
+    newrows = []
+    filestate = {}
+    for afile in sorted(files):
+        if fullrecompute:
+            break
+        stat = os.stat(os.sep.join([inputdir, afile]))
+        previous = state['files'].get(afile)
+        if previous is not None and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+            filestate[afile] = previous
+            continue
+        aeronetfile = ads.loading_aeronet_data(os.sep.join([inputdir, afile]))
+        nrows = 0
+        if previous is not None:
+            nrows = previous['nrows']
+            if len(aeronetfile) < nrows or hashing_rows(aeronetfile.iloc[:nrows]) != previous['hash']:
+                print('mining_aeronet_data_incremental:: old rows changed in', afile)
+                fullrecompute = True
+                break
+        newrows.append(aeronetfile.iloc[nrows:])
+        filestate[afile] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                            'nrows': len(aeronetfile), 'hash': hashing_rows(aeronetfile)}
+
+    if fullrecompute:
+        if not fixedstep:
+            print('mining_aeronet_data_incremental:: average time ' + avgtime + ' is not a fixed step, resampling all the data')
+        # resample all files and rebuild the state from the same read (in the
+        # name order of loading_aeronet_files, as mining_aeronet_data)
+        aeronetfile = []
+        filestate = {}
+        for afile in sorted(files):
+            stat = os.stat(os.sep.join([inputdir, afile]))
+            aeronetfile.append(ads.loading_aeronet_data(os.sep.join([inputdir, afile])))
+            filestate[afile] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                'nrows': len(aeronetfile[-1]), 'hash': hashing_rows(aeronetfile[-1])}
+        aeronetfile = pd.concat(aeronetfile, axis=0)
+        aeronetfile_mean = resampling_aeronet_data(aeronetfile, avgtime)
+        aeronetfile = aeronetfile.sort_values('globaltime', kind='stable')
+        sitestate = {}
+        tail = []
+        if fixedstep:
+            for site, sitedata in aeronetfile.groupby('AERONET_Site', sort=False):
+                origin = sitedata['globaltime'].min().normalize()
+                last = sitedata['globaltime'].max()
+                sitestate[site] = {'origin': origin.isoformat(), 'last': last.isoformat()}
+                tail.append(sitedata[sitedata['globaltime'] >= bin_start(last, avgtime, origin)])
+        writing_mining_state(statedir, avgtime, filestate, sitestate, aeronetfile_mean, tail, storage)
         return aeronetfile_mean
 
+    aeronetfile_mean = ads.loading_aeronet_data(os.sep.join([statedir, state['means']]), float_precision='round_trip')
+    aeronetfile_mean = globaltime_index(aeronetfile_mean).set_index('AERONET_Site', append=True).swaplevel(0, 1)
+    if len(newrows) == 0 or sum([len(rows) for rows in newrows]) == 0:
+        writing_mining_state(statedir, avgtime, filestate, state['sites'], None, None, storage, state)
+        return aeronetfile_mean
+
+    newrows = pd.concat(newrows, axis=0).sort_values('globaltime', kind='stable')
+    oldtail = ads.loading_aeronet_data(os.sep.join([statedir, state['tail']]), float_precision='round_trip')
+    sitestate = dict(state['sites'])
+    for site in newrows['AERONET_Site'].unique():
+        if site in sitestate and newrows.loc[newrows['AERONET_Site'] == site, 'globaltime'].min() <= pd.Timestamp(sitestate[site]['last']):
+            print('mining_aeronet_data_incremental:: new rows before the last time read for', site, '- resampling all the data')
+            os.remove(statefile)
+            return mining_aeronet_data_incremental(inputdir, files, avgtime, statedir, storage)
+
+    means = [aeronetfile_mean]
+    tail = [oldtail[~oldtail['AERONET_Site'].isin(newrows['AERONET_Site'].unique())]]
+    for site, sitedata in newrows.groupby('AERONET_Site', sort=False):
+        if site in sitestate:
+            origin = pd.Timestamp(sitestate[site]['origin'])
+            sitedata = pd.concat([oldtail[oldtail['AERONET_Site'] == site], sitedata], axis=0)
+        else:
+            origin = sitedata['globaltime'].min().normalize()
+        first = sitedata['globaltime'].min()
+        last = sitedata['globaltime'].max()
+        if isinstance(offset, pd.offsets.Tick):
+            sitemean = globaltime_index(sitedata.copy()).resample(avgtime, origin=origin)
+        else:
+            # daily bins always start at midnight
+            sitemean = globaltime_index(sitedata.copy()).resample(avgtime)
+        sitemean = sitemean.mean(numeric_only=True).dropna(how='all')
+        sitemean.index = pd.MultiIndex.from_arrays([[site]*len(sitemean), sitemean.index], names=['AERONET_Site', 'globaltime'])
+        # the recomputed bins replace the old ones
+        keep = ~((means[0].index.get_level_values('AERONET_Site') == site) &
+                 (means[0].index.get_level_values('globaltime') >= bin_start(first, avgtime, origin)))
+        means[0] = means[0][keep]
+        means.append(sitemean)
+        sitestate[site] = {'origin': origin.isoformat(), 'last': last.isoformat()}
+        tail.append(sitedata[sitedata['globaltime'] >= bin_start(last, avgtime, origin)])
+    aeronetfile_mean = pd.concat(means, axis=0).sort_index(level=['AERONET_Site', 'globaltime'])
+
+    writing_mining_state(statedir, avgtime, filestate, sitestate, aeronetfile_mean, tail, storage)
+    return aeronetfile_mean
+
+# float format of the csv state files (round trip of any float64)
+STATE_FLOAT_FORMAT = '%.17g'
+
+def writing_mining_state(statedir, avgtime, filestate, sitestate, aeronetfile_mean, tail, storage, state=None):
+    '''
+=============================================
+Function to save the state of mining_aeronet_data_incremental(): the
+resampled data, the rows of the last open bin of each site and the json
+file describing them. When aeronetfile_mean and tail are None only the json
+file is updated (with the data files of the previous state).
+
+The data files must be lossless, as the next run averages the old bins
+again with the new rows: with csv storage they are written with 17
+significant digits (STATE_FLOAT_FORMAT) instead of the 6 decimals of the
+v01, v02 and v03 files, and read back with the round-trip float parser.
+=============================================
+'''
+    if not os.path.exists(statedir):
+        os.makedirs(statedir)
+    if aeronetfile_mean is None:
+        meansfile, tailfile = state['means'], state['tail']
+    else:
+        meansfile = ads.saving_aeronet_data(aeronetfile_mean.reset_index(), os.sep.join([statedir, 'means']), storage,
+                                            float_format=STATE_FLOAT_FORMAT)
+        tailfile = ads.saving_aeronet_data(pd.concat(tail, axis=0) if len(tail) > 0 else pd.DataFrame(columns=['AERONET_Site', 'globaltime']),
+                                           os.sep.join([statedir, 'tail']), storage, float_format=STATE_FLOAT_FORMAT)
+        meansfile, tailfile = os.path.basename(meansfile), os.path.basename(tailfile)
+    statefile = os.sep.join([statedir, 'state.json'])
+    with open(statefile + '.tmp', 'w') as afile:
+        json.dump({'avgtime': avgtime, 'files': filestate, 'sites': sitestate,
+                   'means': meansfile, 'tail': tailfile}, afile, indent=1, sort_keys=True)
+    os.replace(statefile + '.tmp', statefile)
+
+MERGE_JOINS = ['inner', 'outer', 'asof']
+
+def reading_column_names(filename):
+    '''
+=============================================
+Function to read the table of AERONET column names and the names used by
+AERODOG after the merge (e.g. Single_Scattering_Albedo[440nm] -> SSA_440nm)
+
+Input:
+filename , string  csv file with the columns aeronet_column,aerodog_column
+
+Output:
+dict {aeronet_column: aerodog_column}
+=============================================
+'''
+    table = pd.read_csv(filename, sep = ',')
+    return dict(zip(table['aeronet_column'], table['aerodog_column']))
+
+def merge_tolerance(avgtime):
+    '''Largest time difference matched by an as-of join: one avgtime bin (None for calendar steps, e.g. 1MS)'''
+    try:
+        return pd.Timedelta(pd.tseries.frequencies.to_offset(avgtime).nanos, unit='ns')
+    except ValueError:
+        return None
+
+def merging_aeronet_data(products, joins, avgtimes, columns=None):
+    '''
+=============================================
+Function to merge the resampled products (output of mining_aeronet_data)
+into a single DF, aligned on the (AERONET_Site, globaltime) index
+
+Input:
+products , list of pandas DF  Resampled products
+joins    , list of strings    Join policy of each product:
+                              inner - only the times present in the product are kept
+                              outer - the product does not remove times (missing values are NaN)
+                              asof  - the product is matched to the nearest time of the
+                                      other products, within one avgtime
+avgtimes , list of strings    Resample time of each product (tolerance of the asof joins)
+columns  , dict               Column names to change after the merge (see reading_column_names)
+
+Output:
+A single pandas DF, with AERONET_Site and globaltime as columns. The times
+kept are the ones common to all inner products or, if there are none, the
+times of any outer product.
+=============================================
+'''
+    for join in joins:
+        if join not in MERGE_JOINS:
+            raise ValueError('merging_aeronet_data:: unknown join ' + str(join))
+
+    # the index of the merged DF is found once, then each product is aligned to it once
+    index = None
+    for product, join in zip(products, joins):
+        if join == 'inner':
+            index = product.index if index is None else index.intersection(product.index, sort=False)
+    if index is None:
+        for product, join in zip(products, joins):
+            if join == 'outer':
+                index = product.index if index is None else index.union(product.index, sort=False)
+    if index is None:
+        raise ValueError('merging_aeronet_data:: at least one product must have an inner or outer join')
+    index = index.sort_values()
+
+    aligned = []
+    for product, join, avgtime in zip(products, joins, avgtimes):
+        if join == 'asof':
+            left = index.to_frame(index=False).reset_index().sort_values('globaltime', kind='stable')
+            right = product.reset_index().sort_values('globaltime', kind='stable')
+            matched = pd.merge_asof(left, right, on='globaltime', by='AERONET_Site', direction='nearest',
+                                    tolerance=merge_tolerance(avgtime))
+            matched = matched.sort_values('index').drop(columns=['index', 'AERONET_Site', 'globaltime'])
+            matched.index = index
+            aligned.append(matched)
+        else:
+            aligned.append(product.reindex(index))
+
+    merged = pd.concat(aligned, axis=1)
+    if columns is not None:
+        merged = merged.rename(columns = columns)
+    return merged.reset_index()
+
 '''
 =============================================
 Functions to calculate aerosol optical parameters from direct-sun and inversion products from AERONET data measurements
@@ -215,38 +917,327 @@ absorption, and single scattering albedo, Atmos. Chem. Phys., 11, 10677–10680,
 =============================================
 Functions to calculate aerosol optical parameters from direct-sun and inversion products from AERONET data measurements
 =============================================
-''' 
-def optical_products(df_function):
-#    df_function['AE_440_675nm'] = df_function.apply(ae532,axis=1)
-#    df_function['AE_340_440nm'] = df_function.apply(ae355,axis=1)
-    df_function['AOD_532nm'] = df_function.apply(aod532,axis=1)
-    df_function['AOD_355nm'] = df_function.apply(aod355,axis=1)
-    df_function['LR_440nm'] = df_function.apply(lr440,axis=1)
-    df_function['LR_675nm'] = df_function.apply(lr675,axis=1)
-    df_function['LR_870nm'] = df_function.apply(lr870,axis=1)
-    df_function['LR_1020nm'] = df_function.apply(lr1020,axis=1)
-    df_function['LRAE_532nm'] = df_function.apply(lrae532,axis=1)
-    df_function['LR_532nm'] = df_function.apply(lr532,axis=1)
-    df_function['LR_355nm'] = df_function.apply(lr355,axis=1)
-    df_function["AAOD_440nm"]=df_function.apply(aaod440,axis=1)
-    df_function["AAOD_675nm"]=df_function.apply(aaod675,axis=1)
-    df_function["SAOD_440nm"]=df_function.apply(saod440,axis=1)
-    df_function["SAOD_675nm"]=df_function.apply(saod675,axis=1)
-    df_function["AAE"]=df_function.apply(aae,axis=1)
-    df_function["SAE"]=df_function.apply(sae,axis=1)
-    df_function["dSSA"]=df_function.apply(dssa,axis=1)
+
+The optical products are registered below. Each entry declares the
+function that computes it, its input columns and the equivalent expression
+used by the numexpr engine. Products may depend on other products (e.g.
+LRAE_532nm needs LR_440nm and LR_870nm, and AAE needs AAOD_440nm and
+AAOD_675nm): resolving_products() sorts them in evaluation order.
+'''
+OPTICAL_PRODUCTS = {}
+
+def register_product(name, function, inputs, expression):
+    '''Add an optical product (output column name) to OPTICAL_PRODUCTS'''
+    OPTICAL_PRODUCTS[name] = {'function': function, 'inputs': inputs, 'expression': expression}
+
+register_product('AOD_532nm',  aod532,  ['AOD_500nm', 'AE_440_675nm'],  'AOD_500nm*(500/532)**((-1.)*AE_440_675nm)')
+register_product('AOD_355nm',  aod355,  ['AOD_380nm', 'AE_340_440nm'],  'AOD_380nm*(380/355)**((-1.)*AE_340_440nm)')
+register_product('LR_440nm',   lr440,   ['pfn180_440nm', 'SSA_440nm'],  '4*pi/pfn180_440nm*SSA_440nm')
+register_product('LR_675nm',   lr675,   ['pfn180_675nm', 'SSA_675nm'],  '4*pi/pfn180_675nm*SSA_675nm')
+register_product('LR_870nm',   lr870,   ['pfn180_870nm', 'SSA_870nm'],  '4*pi/pfn180_870nm*SSA_870nm')
+register_product('LR_1020nm',  lr1020,  ['pfn180_1020nm', 'SSA_1020nm'], '4*pi/pfn180_1020nm*SSA_1020nm')
+register_product('LRAE_532nm', lrae532, ['LR_870nm', 'LR_440nm'],       'log(LR_870nm/LR_440nm)/log(440/870)')
+register_product('LR_532nm',   lr532,   ['LR_675nm', 'LRAE_532nm'],     'LR_675nm*(532/675)**((-1.)*LRAE_532nm)')
+register_product('LR_355nm',   lr355,   ['LR_440nm', 'LRAE_532nm'],     'LR_440nm*(355/440)**((-1.)*LRAE_532nm)')
+register_product('AAOD_440nm', aaod440, ['AOD_440nm', 'SSA_440nm'],     'AOD_440nm*(1. - SSA_440nm)')
+register_product('AAOD_675nm', aaod675, ['AOD_675nm', 'SSA_675nm'],     'AOD_675nm*(1. - SSA_675nm)')
+register_product('SAOD_440nm', saod440, ['AOD_440nm', 'SSA_440nm'],     'AOD_440nm*SSA_440nm')
+register_product('SAOD_675nm', saod675, ['AOD_675nm', 'SSA_675nm'],     'AOD_675nm*SSA_675nm')
+register_product('AAE',        aae,     ['AAOD_440nm', 'AAOD_675nm'],   '(-1)*log(AAOD_440nm/AAOD_675nm)/log(440/675)')
+register_product('SAE',        sae,     ['SAOD_440nm', 'SAOD_675nm'],   '(-1)*log(SAOD_440nm/SAOD_675nm)/log(440/675)')
+register_product('dSSA',       dssa,    ['SSA_440nm', 'SSA_675nm'],     'SSA_440nm-SSA_675nm')
+
+def resolving_products(requested, columns):
+    '''
+=============================================
+Function to sort the requested optical products in evaluation order
+
+Walks the dependency graph of OPTICAL_PRODUCTS depth-first, so each product
+comes after the products it depends on. Products whose inputs are neither
+available in columns nor computable are skipped (with a message). When a
+product cannot be computed but a column with its name already exists (e.g.
+AAOD_440nm from the .tab file), that column is used by its dependents.
+
+Input:
+requested , list of strings  Optical products (keys of OPTICAL_PRODUCTS)
+columns   , list of strings  Columns available in the dataframe
+
+Output:
+List of products to compute, in evaluation order
+=============================================
+'''
+    columns = set(columns)
+    order = []
+    computable = {}
+
+    def visit(name, path):
+        if name in computable:
+            return computable[name]
+        if name in path:
+            raise ValueError('resolving_products:: circular dependency ' + ' -> '.join(path + [name]))
+        missing = []
+        for inputname in OPTICAL_PRODUCTS[name]['inputs']:
+            if inputname in OPTICAL_PRODUCTS and visit(inputname, path + [name]):
+                continue
+            if inputname not in columns:
+                missing.append(inputname)
+        computable[name] = len(missing) == 0
+        if computable[name]:
+            order.append(name)
+        else:
+            print('resolving_products:: skipping ' + name + ', missing columns: ' + ', '.join(missing))
+        return computable[name]
+
+    for name in requested:
+        if name not in OPTICAL_PRODUCTS:
+            raise ValueError('resolving_products:: unknown optical product ' + str(name))
+        visit(name, [])
+    return order
+
+def graphics_products(inputfilev04):
+    '''
+=============================================
+Function to list the optical products needed by 04-inputfile_graphics
+
+Input:
+inputfilev04 , pandas DF  Content of the 04-inputfile_graphics file
+
+Output:
+List of optical products (keys of OPTICAL_PRODUCTS) used by the graphics
+turned on in the input file
+=============================================
+'''
+    columns = []
+    for j in range(0,len(inputfilev04)):
+        if 'on' in [inputfilev04['processed_aod'][j], inputfilev04['processed_boxplot_aod'][j]]:
+            columns.append('AOD_' + str(inputfilev04['AOD'][j]) + 'nm')
+        if inputfilev04['processed_boxplot_LR'][j] == 'on':
+            columns.append('LR_' + str(inputfilev04['LR'][j]) + 'nm')
+        if inputfilev04['AOD_vs_AE_graphics'][j] == 'on':
+            # scatter plot of AOD vs AE, colored by the LR at the AOD wavelength
+            wavelength = str(list(ast.literal_eval(inputfilev04['AOD_vs_AE'][j]))[0])
+            columns += ['AOD_' + wavelength + 'nm', 'LR_' + wavelength + 'nm']
+    return [name for name in OPTICAL_PRODUCTS if name in columns]
+
+def optical_products(df_function, products=None, engine='numpy'):
+    '''
+=============================================
+Function to calculate the optical products registered in OPTICAL_PRODUCTS
+
+Only the requested products (and the products they depend on) are
+calculated, in dependency order. The functions are called once with whole
+columns (numpy arrays) instead of once per row, and all new columns are
+added at the end to a new dataframe (the input dataframe is not changed,
+as when the result comes from the cache, see aerodog_cache.py).
+
+Input:
+df_function , pandas DF        Merged (v02) AERONET data
+products    , list of strings  Optical products to calculate (default: all)
+engine      , string           'numpy' (default, same results as the
+                               per-row functions) or 'numexpr' (fused
+                               expressions, for very wide frames; requires
+                               the numexpr package)
+=============================================
+'''
+    if engine == 'numexpr':
+        try:
+            import numexpr
+        except ImportError:
+            print('optical_products:: numexpr is not installed, using numpy engine')
+            engine = 'numpy'
+    if engine not in ['numpy', 'numexpr']:
+        raise ValueError('optical_products:: unknown engine ' + str(engine))
+    if products is None:
+        products = list(OPTICAL_PRODUCTS)
+
+    # column name -> numpy array, products are added as they are calculated
+    columns = {name: df_function[name].to_numpy() for name in df_function.columns
+               if pd.api.types.is_numeric_dtype(df_function[name])}
+    dtypes = {name: values.dtype for name, values in columns.items()}
+    order = resolving_products(products, columns)
+    # the products are calculated in float64 (the float32 inputs of the compact mode are converted), so
+    # the differences of close values (e.g. 1 - SSA) and the logarithms do not lose the float32 digits
+    for name in order:
+        for column in OPTICAL_PRODUCTS[name]['inputs']:
+            if column in columns and column not in OPTICAL_PRODUCTS and columns[column].dtype.kind == 'f':
+                columns[column] = columns[column].astype(np.float64, copy=False)
+    results = {}
+    for name in order:
+        if engine == 'numexpr':
+            columns[name] = numexpr.evaluate(OPTICAL_PRODUCTS[name]['expression'], local_dict=columns, global_dict={'pi': math.pi})
+        else:
+            columns[name] = OPTICAL_PRODUCTS[name]['function'](columns)
+        # only the stored product keeps the type of its inputs (float32 in the compact mode, see compacting_frame)
+        dtypes[name] = np.result_type(*[dtypes[column] for column in OPTICAL_PRODUCTS[name]['inputs']])
+        results[name] = columns[name].astype(dtypes[name], copy=False)
+
+    if len(results) > 0:
+        # a shallow copy: the columns of the input are shared, the new columns are only in the copy
+        df_function = df_function.copy(deep=False)
+        df_function[list(results)] = pd.DataFrame(results, index=df_function.index)
     return df_function
 
+'''
+=============================================
+Climatology of the derived (v03) data
+
+For each site and each month of the year (codes 1 to 12) and season (codes
+1 to 4: DJF, MAM, JJA, SON) the values of each variable are summarized by
+their count, mean, minimum, quartiles (q1, median, q3, linear interpolation
+as numpy.percentile), maximum and the whiskers of a boxplot (the most
+extreme values within whis*IQR of the quartiles, as in matplotlib and
+seaborn). The values outside the whiskers (fliers) are kept in a second
+table, so the boxplots can be drawn from the summaries (ax.bxp) without
+the rows of the v03 data. When the data have several sites, the values of
+all the sites together are also summarized, as the site ALL_SITES (the
+boxplots pool all the sites, as the seaborn boxplots of the rows did).
+'''
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+# name of the summaries of all the sites together
+ALL_SITES = 'All_Sites'
+
+CLIMATOLOGY_STATISTICS = ['count', 'mean', 'min', 'q1', 'median', 'q3', 'max', 'whislo', 'whishi']
+
+def grouping_statistics(codes, ngroups, values, whis=1.5):
+    '''
+=============================================
+Function to calculate the boxplot statistics of the values of each group,
+in one vectorized pass: the values are sorted once by (group, value), and
+the quantiles of all the groups are read at their positions in the sorted
+array (NaN values are ignored)
+
+Input:
+codes   , numpy array  Group of each value (integers from 0 to ngroups-1)
+ngroups , integer      Number of groups
+values  , numpy array  Values
+whis    , float        Whisker length, in IQR
+
+Output:
+dict of numpy arrays with one value per group (count, mean, min, q1,
+median, q3, max, whislo, whishi; NaN for groups without values), and the
+group and value of each flier (two numpy arrays)
+=============================================
+'''
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    counts = np.bincount(codes, minlength=ngroups)
+    starts = np.cumsum(counts) - counts
+    nonempty = counts > 0
+
+    stats = {'count': counts}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['mean'] = np.bincount(codes, weights=values, minlength=ngroups) / counts
+    for name, q in [('min', 0.), ('q1', 0.25), ('median', 0.5), ('q3', 0.75), ('max', 1.)]:
+        position = starts + q*np.maximum(counts - 1, 0)
+        low = np.minimum(np.floor(position).astype(np.int64), len(values) - 1)
+        high = np.minimum(np.ceil(position).astype(np.int64), len(values) - 1)
+        quantile = np.full(ngroups, np.nan)
+        if len(values) > 0:
+            quantile[nonempty] = values[low[nonempty]] + (values[high[nonempty]] - values[low[nonempty]])*(position - low)[nonempty]
+        stats[name] = quantile
+
+    # whiskers: most extreme values within whis*IQR of the quartiles (the quartile itself when there is none)
+    iqr = stats['q3'] - stats['q1']
+    stats['whislo'], stats['whishi'] = np.full(ngroups, np.nan), np.full(ngroups, np.nan)
+    if len(values) > 0:
+        inside = values >= (stats['q1'] - whis*iqr)[codes]
+        stats['whislo'][nonempty] = np.minimum.reduceat(np.where(inside, values, np.inf), starts[nonempty])
+        inside = values <= (stats['q3'] + whis*iqr)[codes]
+        stats['whishi'][nonempty] = np.maximum.reduceat(np.where(inside, values, -np.inf), starts[nonempty])
+    stats['whislo'] = np.where(stats['whislo'] > stats['q1'], stats['q1'], stats['whislo'])
+    stats['whishi'] = np.where(stats['whishi'] < stats['q3'], stats['q3'], stats['whishi'])
+
+    outside = (values < stats['whislo'][codes]) | (values > stats['whishi'][codes])
+    return stats, codes[outside], values[outside]
+
+def summarizing_aeronet_data(v3aeronetdata, variables=None, whis=1.5):
+    '''
+=============================================
+Function to calculate the monthly and seasonal climatology of the derived
+(v03) data (see grouping_statistics), for each site
+
+Input:
+v3aeronetdata , pandas DF        Derived (v03) AERONET data
+variables     , list of strings  Columns to summarize (default: all the
+                                 numeric columns, except Day_of_Year)
+whis          , float            Whisker length, in IQR
+
+Output:
+Two pandas DF, in long format:
+  climatology - one row per site, period ('month' or 'season'), code (1-12
+                or 1-4) and variable with the groups where the site has
+                data: label (e.g. 07 or JJA), count, mean, min, q1, median,
+                q3, max, whislo, whishi, and the first and last time of the
+                data of the site (with several sites, also the rows of
+                the site ALL_SITES, all the sites together)
+  fliers      - AERONET_Site, period, code, variable and value of the
+                values outside the whiskers
+=============================================
+'''
+    if variables is None:
+        variables = [name for name in v3aeronetdata.columns if name not in ['Day_of_Year', 'globaltime']
+                     and pd.api.types.is_numeric_dtype(v3aeronetdata[name]) and not pd.api.types.is_bool_dtype(v3aeronetdata[name])]
+    times = pd.to_datetime(v3aeronetdata['globaltime'])
+    sitecodes, sites = pd.factorize(v3aeronetdata['AERONET_Site'].astype(str))
+    nsites = len(sites)
+    # integer month codes (1-12), and season codes (1-4, DJF, MAM, JJA, SON)
+    months = times.dt.month.to_numpy().astype(np.int64)
+    seasons = months % 12 // 3 + 1
+    first = times.groupby(sitecodes).min().to_numpy()
+    last = times.groupby(sitecodes).max().to_numpy()
+    # rows of the data summarized (with several sites, each row twice: in its site and in ALL_SITES)
+    rows = np.arange(len(v3aeronetdata))
+    if nsites > 1:
+        rows = np.concatenate([rows, rows])
+        sitecodes = np.concatenate([sitecodes, np.full(len(v3aeronetdata), nsites)])
+        months = months[rows]
+        seasons = seasons[rows]
+        sites = list(sites) + [ALL_SITES]
+        first, last = np.append(first, first.min()), np.append(last, last.max())
+        nsites += 1
+
+    # the columns of the two tables are collected as numpy arrays, and each table is built once
+    summaries = {name: [] for name in ['site', 'period', 'code', 'variable'] + CLIMATOLOGY_STATISTICS}
+    fliers = {name: [] for name in ['site', 'period', 'code', 'variable', 'value']}
+    for period, codes, ncodes in [('month', months, 12), ('season', seasons, 4)]:
+        groups = sitecodes*ncodes + codes - 1
+        ngroups = nsites*ncodes
+        # the groups where the site has data (with or without values of each variable)
+        present = np.flatnonzero(np.bincount(groups, minlength=ngroups) > 0)
+        for name in variables:
+            stats, fliergroups, fliervalues = grouping_statistics(groups, ngroups, v3aeronetdata[name].to_numpy(dtype=np.float64, na_value=np.nan)[rows], whis)
+            for column, values in [('site', present // ncodes), ('period', np.full(len(present), period)),
+                                   ('code', present % ncodes + 1), ('variable', np.full(len(present), name))]:
+                summaries[column].append(values)
+            for stat in CLIMATOLOGY_STATISTICS:
+                summaries[stat].append(stats[stat][present])
+            for column, values in [('site', fliergroups // ncodes), ('period', np.full(len(fliergroups), period)),
+                                   ('code', fliergroups % ncodes + 1), ('variable', np.full(len(fliergroups), name)), ('value', fliervalues)]:
+                fliers[column].append(values)
+
+    summaries = {column: np.concatenate(values) if len(values) > 0 else np.array([]) for column, values in summaries.items()}
+    fliers = {column: np.concatenate(values) if len(values) > 0 else np.array([]) for column, values in fliers.items()}
+    site = summaries.pop('site').astype(np.int64)
+    climatology = pd.DataFrame({'AERONET_Site': np.asarray(sites, dtype=object)[site], 'period': summaries.pop('period'),
+                                'code': summaries.pop('code').astype(np.int64)})
+    climatology['label'] = [('%02d' % code) if period == 'month' else SEASONS[code - 1]
+                            for period, code in zip(climatology['period'], climatology['code'])]
+    climatology['variable'] = summaries.pop('variable')
+    for stat in CLIMATOLOGY_STATISTICS:
+        climatology[stat] = summaries[stat]
+    climatology['first'], climatology['last'] = first[site], last[site]
+    site = fliers.pop('site').astype(np.int64)
+    fliers = pd.DataFrame({'AERONET_Site': np.asarray(sites, dtype=object)[site], 'period': fliers['period'],
+                           'code': fliers['code'].astype(np.int64), 'variable': fliers['variable'], 'value': fliers['value']})
+    return climatology, fliers
+
 def boxplotfunc(v3aeronetdata):
-    '''Adjusting Month variable for boxplot graphics ''' 
-    aeronetdata = globaltime_index(v3aeronetdata)
-    aeronetdata = aeronetdata.reset_index()
-    aeronetdata['Month'] = aeronetdata['globaltime'].dt.strftime('%m')
-     
-    '''Calculation of monthly average values for the boxplot graphics'''
-    aeronetmeanbp = aeronetdata.groupby(['Month']).mean(numeric_only=True)
-     
-    return aeronetdata, aeronetmeanbp
+    '''Climatology of the v03 data for the boxplot graphics (kept for the scripts that call it, see summarizing_aeronet_data and agf.boxplot_temporal_evolution)'''
+    return summarizing_aeronet_data(v3aeronetdata)
 
 def angmatrixfunc(df_aeronetdata):
     
@@ -8,21 +8,282 @@ AERODOG first version created on Wed Dec 23 17:45:08 2020
 
 import os
 import ast
-import time
-import glob
-import math
 import datetime
 import numpy as np
 import pandas as pd
-from os import path
 import seaborn as sns
-from pathlib import Path
 import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 import matplotlib.dates as mdates
-from matplotlib.dates import DateFormatter
+import aerodog_function as adf
 
-def aod_temporal_evolution(graphicflag, datalevel, avgtime, aoddata, lambdaaod1,filegraphpath,graphname):
+# plt.show() after saving each graphic (turned off by the rendering workers, see aerodog_rendering.py)
+SHOW_FIGURES = True
+
+# Figures reused by the next graphics of the same kind (see figure_template):
+# the axes, labels, locators and formatters are built once, and each graphic
+# only swaps the data of the artists (set_data, set_offsets) and saves again
+FIGURE_TEMPLATES = {}
+
+def figure_template(kind, building, *args):
+    '''
+=============================================
+Function to get the figure template of a kind of graphic
+
+Input:
+kind     , tuple     Kind of graphic, e.g. ('temporal', ylabel, ylim)
+building , function  Function to build the template: building(*args)
+                     returns a dict with the figure ('fig') and its artists
+
+Output:
+The template dict, built at the first call (or again, if its figure was
+closed, e.g. the window shown by plt.show())
+=============================================
+'''
+    if kind not in FIGURE_TEMPLATES or not plt.fignum_exists(FIGURE_TEMPLATES[kind]['fig'].number):
+        FIGURE_TEMPLATES[kind] = building(*args)
+    return FIGURE_TEMPLATES[kind]
+
+def saving_template(template, filename):
+    '''Function to save (and show, see SHOW_FIGURES) the current graphic of a template, which is kept open for the next graphic'''
+    template['fig'].savefig(filename)
+    if SHOW_FIGURES:
+        plt.show()
+
+def closing_templates():
+    '''Function to close all the figure templates (and forget the binned points of the density graphics)'''
+    for template in FIGURE_TEMPLATES.values():
+        plt.close(template['fig'])
+    FIGURE_TEMPLATES.clear()
+    BINNED_POINTS.clear()
+
+def styling_ticklabels(ax, rotation=None):
+    '''Function to set the font weight (and rotation) of the current tick labels, which change with the data'''
+    for label in ax.get_xticklabels():
+        label.set_fontweight(550)
+        if rotation is not None:
+            label.set_rotation(rotation)
+            label.set_horizontalalignment('right')
+    for label in ax.get_yticklabels():
+        label.set_fontweight(550)
+
+def building_temporal_figure(ylabel, ymaxlim, mdpi=120):
+    '''
+=============================================
+Function to build the template of the graphics of temporal evolution
+(AOD, all wavelengths AOD and Angstrom Exponent): date axis with its
+locator and formatter, labels and limits of the y axis, and one line
+=============================================
+'''
+    sns.set(style = 'darkgrid')
+    fig,ax = plt.subplots(1,1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi)
+    title = fig.suptitle('', fontsize=18, fontweight='bold')
+    fig.subplots_adjust(top = 0.91)
+    ax.xaxis_date()
+    line, = ax.plot([], [], 'o--', linewidth = 1)
+    ax.set_ylabel(ylabel, fontsize=20, fontweight='bold');
+    ax.set_xlabel('Date', fontsize=20, fontweight='bold');
+    ax.set_ylim(0, ymaxlim)
+    fig.autofmt_xdate(rotation=45, ha='right')
+    ax.tick_params(axis='both', which='major', labelsize=14, width=1, length=5, color='black', direction='in')
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=8))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d %b %y'))
+    return {'fig': fig, 'ax': ax, 'title': title, 'line': line}
+
+def building_scatter_figure(mdpi=120, density=False, **figure):
+    '''
+=============================================
+Function to build the template of the scatter plots colored by a third
+variable (AOD vs AE and Angstrom matrix): the points (or, with density=True,
+the image of the binned points, see binning_density), their colorbar and
+the styling of the ticks
+=============================================
+'''
+    sns.set(style = 'darkgrid')
+    fig,ax = plt.subplots(1, 1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi, **figure)
+    title = fig.suptitle('', fontsize=18, fontweight='bold')
+    fig.subplots_adjust(top = 0.91)
+    if density:
+        points = ax.imshow(np.zeros((1, 1)), origin = 'lower', aspect = 'auto', interpolation = 'nearest', cmap = 'Spectral_r', zorder=2)
+    else:
+        points = ax.scatter(np.zeros(1), np.zeros(1), c = np.zeros(1), cmap = 'Spectral_r', zorder=2)
+    colorbar = fig.colorbar(points, ax=ax)
+    ax.tick_params(axis='both', which='major', labelsize=15, width=5, length=5, color='black', direction='in')
+    return {'fig': fig, 'ax': ax, 'title': title, 'points': points, 'colorbar': colorbar}
+
+def rendering_scatter(template, measurement_title, xdata, ydata, cdata, clabel):
+    '''Function to draw new points on a scatter template (points with NaN in x, y or color are not drawn, as in plt.scatter)'''
+    xdata, ydata, cdata = [np.asarray(data, dtype=float) for data in [xdata, ydata, cdata]]
+    valid = np.isfinite(xdata) & np.isfinite(ydata) & np.isfinite(cdata)
+    template['title'].set_text(measurement_title)
+    template['points'].set_offsets(np.column_stack([xdata[valid], ydata[valid]]))
+    template['points'].set_array(cdata[valid])
+    if valid.any():
+        template['points'].set_clim(cdata[valid].min(), cdata[valid].max())
+    template['colorbar'].set_label(clabel)
+
+def binning_density(xdata, ydata, cdata, xlimits, ylimits, bins=100, statistic='mean'):
+    '''
+=============================================
+Function to bin the points of a scatter plot in a 2-D grid (np.histogram2d),
+so a graphic with many points is drawn as one image of bins x bins pixels
+
+Input:
+xdata, ydata , numpy arrays  Coordinates of the points
+cdata        , numpy array   Variable of the color of the points (e.g. LR, dSSA)
+xlimits      , tuple         (min, max) of the grid in x (the limits of the graphic)
+ylimits      , tuple         (min, max) of the grid in y
+bins         , integer       Number of bins in x and in y
+statistic    , string        'mean' or 'median' of cdata in each bin
+
+Output:
+Dict with the edges of the bins ('xedges', 'yedges'), the number of points
+('counts') and the statistic of cdata ('values', NaN in empty bins) of
+each bin, with shape (bins, bins) indexed [x, y]
+=============================================
+'''
+    if statistic not in ['mean', 'median']:
+        raise ValueError('Unknown density statistic: ' + str(statistic) + ' (use mean or median)')
+    xdata, ydata, cdata = [np.asarray(data, dtype=float) for data in [xdata, ydata, cdata]]
+    valid = np.isfinite(xdata) & np.isfinite(ydata) & np.isfinite(cdata)
+    xdata, ydata, cdata = xdata[valid], ydata[valid], cdata[valid]
+    xedges = np.linspace(xlimits[0], xlimits[1], bins+1)
+    yedges = np.linspace(ylimits[0], ylimits[1], bins+1)
+    counts = np.histogram2d(xdata, ydata, bins=[xedges, yedges])[0]
+    values = np.full(counts.shape, np.nan)
+    if statistic == 'mean':
+        sums = np.histogram2d(xdata, ydata, bins=[xedges, yedges], weights=cdata)[0]
+        np.divide(sums, counts, out=values, where=counts > 0)
+    else:
+        # same bins as np.histogram2d (the last bin includes its right edge)
+        inside = (xdata >= xedges[0]) & (xdata <= xedges[-1]) & (ydata >= yedges[0]) & (ydata <= yedges[-1])
+        xbin = np.clip(np.searchsorted(xedges, xdata[inside], side='right') - 1, 0, bins-1)
+        ybin = np.clip(np.searchsorted(yedges, ydata[inside], side='right') - 1, 0, bins-1)
+        medians = pd.Series(cdata[inside]).groupby(xbin*bins + ybin).median()
+        values.flat[medians.index.to_numpy()] = medians.to_numpy()
+    return {'xedges': xedges, 'yedges': yedges, 'counts': counts, 'values': values}
+
+# binned points of the density graphics, by graphic file (without extension),
+# so the same graphic saved in other formats is not binned again
+BINNED_POINTS = {}
+
+def rendering_density(template, measurement_title, binned, clabel):
+    '''Function to draw the binned points (see binning_density) on a density template'''
+    template['title'].set_text(measurement_title)
+    template['points'].set_data(binned['values'].T)
+    template['points'].set_extent([binned['xedges'][0], binned['xedges'][-1], binned['yedges'][0], binned['yedges'][-1]])
+    if np.isfinite(binned['values']).any():
+        template['points'].set_clim(np.nanmin(binned['values']), np.nanmax(binned['values']))
+    template['colorbar'].set_label(clabel)
+
+def rendering_colored_points(template, measurement_title, xdata, ydata, cdata, clabel, xlimits, ylimits, filename, density=None):
+    '''Function to draw the points (density=None) or their bins (density=(bins, statistic)) on a scatter template'''
+    if density is None:
+        rendering_scatter(template, measurement_title, xdata, ydata, cdata, clabel)
+        return
+    bins, statistic = density
+    key = (os.path.splitext(filename)[0], len(xdata), tuple(xlimits), tuple(ylimits), bins, statistic)
+    if key not in BINNED_POINTS:
+        BINNED_POINTS[key] = binning_density(xdata, ydata, cdata, xlimits, ylimits, bins, statistic)
+    rendering_density(template, measurement_title, BINNED_POINTS[key], clabel + ' (' + statistic + ' per bin)')
+
+def lttb_indices(xdata, ydata, npoints):
+    '''
+=============================================
+Function to select the points of a time series with the
+Largest-Triangle-Three-Buckets algorithm (Steinarsson, 2013): the first and
+last points are kept, the others are split in npoints-2 buckets and, in each
+bucket, the point kept is the one making the largest triangle with the point
+kept in the previous bucket and the mean of the next bucket
+
+Input:
+xdata   , numpy array  Times (as float)
+ydata   , numpy array  Values (without NaN)
+npoints , integer      Number of points to keep
+
+Output:
+Indices of the points kept, in increasing order
+=============================================
+'''
+    n = len(xdata)
+    if npoints >= n or npoints < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n-1, npoints-1).astype(int)
+    edges = np.append(edges, n)
+    selected = np.empty(npoints, dtype=int)
+    selected[0], selected[-1] = 0, n-1
+    a = 0
+    for i in range(npoints-2):
+        start, stop = edges[i], edges[i+1]
+        avgx = xdata[stop:edges[i+2]].mean()
+        avgy = ydata[stop:edges[i+2]].mean()
+        area = np.abs((xdata[a]-avgx)*(ydata[start:stop]-ydata[a]) - (xdata[a]-xdata[start:stop])*(avgy-ydata[a]))
+        a = start + np.argmax(area)
+        selected[i+1] = a
+    return selected
+
+def minmax_indices(xdata, ydata, npoints):
+    '''
+=============================================
+Function to select the points of a time series keeping the minimum and the
+maximum of each of npoints/2 buckets of equal time width (e.g. one bucket per
+pixel column of the graphic), plus the first and last points
+
+Output:
+Indices of the points kept, in increasing order
+=============================================
+'''
+    n = len(xdata)
+    if npoints >= n or npoints < 2:
+        return np.arange(n)
+    nbuckets = npoints//2
+    bucket = np.floor((xdata - xdata[0])/(xdata[-1] - xdata[0] or 1.)*nbuckets).clip(0, nbuckets-1).astype(int)
+    values = pd.Series(ydata).groupby(bucket)
+    return np.unique(np.concatenate([values.idxmin().to_numpy(), values.idxmax().to_numpy(), [0, n-1]]))
+
+# decimation methods of the temporal evolution graphics (see decimating_series)
+DECIMATION_METHODS = {'lttb': lttb_indices, 'minmax': minmax_indices}
+
+def decimating_series(xdata, ydata, decimation=None):
+    '''
+=============================================
+Function to reduce the number of points of a time series before it is
+plotted, so the time to render and the size of the graphic file (mainly
+vector formats, e.g. pdf, svg) do not grow with the length of the series
+
+Input:
+xdata      , numpy array  Times (datetime64)
+ydata      , numpy array  Values
+decimation , tuple        (method, number of points), method in
+                          DECIMATION_METHODS ('lttb' or 'minmax');
+                          None to plot all the points
+
+Output:
+xdata, ydata (without NaN when decimated)
+=============================================
+'''
+    if decimation is None:
+        return xdata, ydata
+    method, npoints = decimation
+    if method not in DECIMATION_METHODS:
+        raise ValueError('Unknown decimation method: ' + str(method) + ' (use one of ' + ', '.join(DECIMATION_METHODS) + ')')
+    ydata = np.asarray(ydata, dtype=float)
+    valid = np.isfinite(ydata)
+    xdata, ydata = xdata[valid], ydata[valid]
+    selected = DECIMATION_METHODS[method](xdata.astype('datetime64[ns]').astype(np.int64).astype(float), ydata, int(npoints))
+    return xdata[selected], ydata[selected]
+
+def rendering_temporal(template, measurement_title, xdata, ydata, xminlim, xmaxlim, filename, **line):
+    '''Function to draw new data (and line color, label, ...) on a template of temporal evolution and save it'''
+    ax = template['ax']
+    template['title'].set_text(measurement_title)
+    template['line'].set_data(xdata, ydata)
+    template['line'].set(**line)
+    ax.set_xlim(xminlim, xmaxlim)
+    styling_ticklabels(ax, rotation=45)
+    ax.legend(fontsize = 12, loc = 'best', markerscale = 1.5, handletextpad = 0.2)
+    saving_template(template, filename)
+
+def aod_temporal_evolution(graphicflag, datalevel, avgtime, aoddata, lambdaaod1,filegraphpath,graphname, decimation=None):
     dateinstr = str.capitalize(aoddata['globaltime'][0].strftime('%b %Y'))
     datefinalstr =  str.capitalize(aoddata['globaltime'][len(aoddata['globaltime'])-1].strftime('%b %Y'))
     leveldata = ''.join(['Level ',str(datalevel)[0],'.',str(datalevel)[1]])
@@ -60,42 +321,14 @@ def aod_temporal_evolution(graphicflag, datalevel, avgtime, aoddata, lambdaaod1,
     ymaxlim = 2
     xminlim = aoddata['globaltime'][0].to_pydatetime() + datetime.timedelta(days=-12)
     xmaxlim = aoddata['globaltime'][len(aoddata['globaltime'])-1].to_pydatetime() + datetime.timedelta(days=2) 
-    mdpi=120
     
-    sns.set(style = 'darkgrid')
-    fig,ax = plt.subplots(1,1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi)
-    fig.suptitle(measurement_title, fontsize=18, fontweight='bold')
-    fig.subplots_adjust(top = 0.91)
-#    ax.plot(globaltime, aoddata, 'o--', color = 'red',
-#             linewidth = 0.5, markersize = 3, label = '$\\tau_a(1020)$')
-    ax.plot(aoddata['globaltime'].to_numpy(), aoddata[''.join([graphicflag,'_',str(lambdaaod1),'nm'])].to_numpy(), 'o--',  markerfacecolor='none', color = colorgraph, 
-            linewidth = 1, label = '$\\tau_a(' + str(lambdaaod1) + ')$ - Time Avg. ' + avgtime )
-#    ax.plot(globaltime, aoddata, 'o--', color = 'forestgreen',
-#             linewidth = 0.5, markersize = 3, label = '$\\tau_a(' + str(lambdaaod1) + ')$')
-#    ax.plot(globaltime, aoddata['AOD_355nm'], 'o--', color = 'rebeccapurple',
-#             linewidth = 0.5, markersize = 3, label = '$\\tau_a(355)$')
-    ax.set_ylabel(gflag + '($\\tau_a$)', fontsize=20, fontweight='bold');
-    ax.set_xlabel('Date', fontsize=20, fontweight='bold');
-    ax.set_xlim(xminlim, xmaxlim)
-    ax.set_ylim(yminlim, ymaxlim)
-    fig.autofmt_xdate(rotation=45, ha='right')
-    ax.tick_params(axis='both', which='major', labelsize=14, width=1, length=5, color='black', direction='in')
-    for label in ax.get_xticklabels():
-        label.set_fontweight(550)
-    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=8))
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d %b %y'))
-    for label in ax.get_yticklabels():
-        label.set_fontweight(550)
-    ax.legend(fontsize = 12, loc = 'best', markerscale = 1.5, handletextpad = 0.2)
-    auxname = os.sep.join([filegraphpath,graphname])
-    plt.savefig(auxname)
-#    auxnamepdf = auxname.replace(figpng,figpdf)
-#    plt.savefig(auxnamepdf)
-    plt.show()
-    plt.close(fig)
+    template = figure_template(('temporal', gflag, ymaxlim), building_temporal_figure, gflag + '($\\tau_a$)', ymaxlim)
+    xdata, ydata = decimating_series(aoddata['globaltime'].to_numpy(), aoddata[''.join([graphicflag,'_',str(lambdaaod1),'nm'])].to_numpy(), decimation)
+    rendering_temporal(template, measurement_title, xdata, ydata, xminlim, xmaxlim,
+                       os.sep.join([filegraphpath,graphname]), color = colorgraph, markerfacecolor = 'none',
+                       label = '$\\tau_a(' + str(lambdaaod1) + ')$ - Time Avg. ' + avgtime)
 
-def allaod_temporal_evolution(graphicflag, datalevel, avgtime, aoddata, aod, processed_aod,filegraphpathall,graphnameall):
+def allaod_temporal_evolution(graphicflag, datalevel, avgtime, aoddata, aod, processed_aod,filegraphpathall,graphnameall, decimation=None):
     dateinstr = str.capitalize(aoddata['globaltime'][0].strftime('%b %Y'))
     datefinalstr =  str.capitalize(aoddata['globaltime'][len(aoddata['globaltime'])-1].strftime('%b %Y'))
     leveldata = ''.join(['Level ',str(datalevel)[0],'.',str(datalevel)[1]])
@@ -112,11 +345,12 @@ def allaod_temporal_evolution(graphicflag, datalevel, avgtime, aoddata, aod, pro
 
     if graphicflag == 'AOD':
         gflag = 'Aerosol Optical Depth'
-        
-    sns.set(style = 'darkgrid')
-    fig,ax = plt.subplots(1,1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi)
-    fig.suptitle(measurement_title, fontsize=18, fontweight='bold')
-    fig.subplots_adjust(top = 0.91)
+
+    # one line per wavelength: the axes are styled once, after all the lines
+    template = building_temporal_figure(gflag + '($\\tau_a$)', ymaxlim, mdpi)
+    fig, ax = template['fig'], template['ax']
+    template['title'].set_text(measurement_title)
+    template['line'].remove()
     for i in range(0,len(aod)):
         if processed_aod[i] == 'on':
             if aod[i] == 340:
@@ -140,31 +374,22 @@ def allaod_temporal_evolution(graphicflag, datalevel, avgtime, aoddata, aod, pro
             elif aod[i] == 1640:
                 colorgraph = 'maroon'
                 
-            ax.plot(aoddata['globaltime'].to_numpy(), aoddata[''.join([graphicflag,'_',str(aod[i]),'nm'])].to_numpy(), 'o--',  markerfacecolor='none', color = colorgraph,
+            xdata, ydata = decimating_series(aoddata['globaltime'].to_numpy(), aoddata[''.join([graphicflag,'_',str(aod[i]),'nm'])].to_numpy(), decimation)
+            ax.plot(xdata, ydata, 'o--',  markerfacecolor='none', color = colorgraph,
                     linewidth = 1, label = '$\\tau_a(' + str(aod[i]) + ')$ - Time Avg. ' + avgtime )
 
-        ax.set_ylabel(gflag + '($\\tau_a$)', fontsize=20, fontweight='bold');
-        ax.set_xlabel('Date', fontsize=20, fontweight='bold');
-        ax.set_xlim(xminlim, xmaxlim)
-        ax.set_ylim(yminlim, ymaxlim)
-        fig.autofmt_xdate(rotation=45, ha='right')
-        ax.tick_params(axis='both', which='major', labelsize=14, width=1, length=5, color='black', direction='in')
-        for label in ax.get_xticklabels():
-            label.set_fontweight(550)
-        ax.xaxis.set_major_locator(mdates.MonthLocator(interval=8))
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d %b %y'))
-        for label in ax.get_yticklabels():
-            label.set_fontweight(550)
-        ax.legend(fontsize = 12, loc = 'best', markerscale = 1.5, handletextpad = 0.2)
+    ax.set_xlim(xminlim, xmaxlim)
+    styling_ticklabels(ax, rotation=45)
+    ax.legend(fontsize = 12, loc = 'best', markerscale = 1.5, handletextpad = 0.2)
     auxname = os.sep.join([filegraphpathall,graphnameall])
-    plt.savefig(auxname)
+    fig.savefig(auxname)
 #    auxnamepdf = auxname.replace(figpng,figpdf)
 #    plt.savefig(auxnamepdf)
-    plt.show()
+    if SHOW_FIGURES:
+        plt.show()
     plt.close(fig)
 
-def angexp_temporal_evolution(graphicflag, datalevel, avgtime, angexpdata, lambdaAE, filegraphpathae,graphnameae):
+def angexp_temporal_evolution(graphicflag, datalevel, avgtime, angexpdata, lambdaAE, filegraphpathae,graphnameae, decimation=None):
     dateinstr = str.capitalize(angexpdata['globaltime'][0].strftime('%b %Y'))
     datefinalstr =  str.capitalize(angexpdata['globaltime'][len(angexpdata['globaltime'])-1].strftime('%b %Y'))
     leveldata = ''.join(['Level ',str(datalevel)[0],'.',str(datalevel)[1]])
@@ -214,44 +439,28 @@ def angexp_temporal_evolution(graphicflag, datalevel, avgtime, angexpdata, lambd
     ymaxlim = 2.5
     xminlim = angexpdata['globaltime'][0].to_pydatetime() + datetime.timedelta(days=-12)
     xmaxlim = angexpdata['globaltime'][len(angexpdata['globaltime'])-1].to_pydatetime() + datetime.timedelta(days=2) 
-    mdpi=120
     
-    sns.set(style = 'darkgrid')
-    fig,ax = plt.subplots(1, 1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi)
-    fig.suptitle(measurement_title, fontsize=18, fontweight='bold')
-    fig.subplots_adjust(top = 0.91)
-#    ax.plot(globaltime, angexpdata['AOD_1020nm'], 'o--', color = 'red',
-#             linewidth = 0.5, markersize = 3, label = '$\\tau_a(1020)$')
-    ax.plot(angexpdata['globaltime'].to_numpy(), angexpdata[''.join([graphicflag,'_',str(lambdaAE[0]),'_',str(lambdaAE[1]),'nm'])].to_numpy(), 'o--', markerfacecolor= colorgraph, color = colorgraph,
-             linewidth = 1, label = '$\\AAngström \; Exponent \; ('+ str(lambdaAE[0])+'/'+str(lambdaAE[1])+'nm)$  - Time Avg. ' + avgtime)
-#    ax.plot(globaltime, angexpdata['AOD_355nm'], 'o--', color = 'rebeccapurple',
-#             linewidth = 0.5, markersize = 3, label = '$\\tau_a(355)$')
-    ax.set_ylabel('Angström Exponent', fontsize=20, fontweight='bold');
-    ax.set_xlabel('Date', fontsize=20, fontweight='bold');
-    ax.set_xlim(xminlim, xmaxlim)
-    ax.set_ylim(yminlim, ymaxlim)
-    fig.autofmt_xdate(rotation=45, ha='right')
-    ax.tick_params(axis='both', which='major', labelsize=14, width=1, length=5, color='black', direction='in')
-    for label in ax.get_xticklabels():
-        label.set_fontweight(550)
-    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=8))
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d %b %y'))
-    for label in ax.get_yticklabels():
-        label.set_fontweight(550)
-    ax.legend(fontsize = 12, loc = 'best', markerscale = 1.5, handletextpad = 0.2)
-    auxname = os.sep.join([filegraphpathae, graphnameae])
-    plt.savefig(auxname)
-#    auxnamepdf = auxname.replace(figpng,figpdf)
-#    plt.savefig(auxnamepdf)
-    plt.show()
-    plt.close(fig)
+    template = figure_template(('temporal', gflag, ymaxlim), building_temporal_figure, 'Angström Exponent', ymaxlim)
+    xdata, ydata = decimating_series(angexpdata['globaltime'].to_numpy(), angexpdata[''.join([graphicflag,'_',str(lambdaAE[0]),'_',str(lambdaAE[1]),'nm'])].to_numpy(), decimation)
+    rendering_temporal(template, measurement_title, xdata, ydata, xminlim, xmaxlim,
+                       os.sep.join([filegraphpathae, graphnameae]), color = colorgraph, markerfacecolor = colorgraph,
+                       label = '$Angström \\; Exponent \\; ('+ str(lambdaAE[0])+'/'+str(lambdaAE[1])+'nm)$  - Time Avg. ' + avgtime)
     
-def boxplot_temporal_evolution(graphicflag, datalevel, aeronetdatabp, aeronetmeanbp, lambdagraph, filegraphpathlr,graphnamelr):
-    dateinstr = str.capitalize(aeronetdatabp['globaltime'][0].strftime('%b %Y'))
-    datefinalstr =  str.capitalize(aeronetdatabp['globaltime'][len(aeronetdatabp['globaltime'])-1].strftime('%b %Y'))
+def boxplot_temporal_evolution(graphicflag, datalevel, climatology, lambdagraph, filegraphpathlr,graphnamelr):
+    '''Monthly boxplots of a variable, drawn (ax.bxp) from the climatology of the v03 data (adf.summarizing_aeronet_data: summaries and fliers), all the sites together'''
+    summaries, fliers = climatology
+    variable = graphicflag + '_' + str(lambdagraph) + 'nm'
+    monthly = summaries[(summaries['period'] == 'month') & (summaries['variable'] == variable)]
+    # the summaries of all the sites together (adf.ALL_SITES) when there are several sites
+    # (a climatology saved before ALL_SITES was added only has the summaries of each site)
+    sites = [site for site in monthly['AERONET_Site'].unique() if site != adf.ALL_SITES]
+    site = adf.ALL_SITES if adf.ALL_SITES in set(monthly['AERONET_Site']) else sites[0]
+    monthly = monthly[monthly['AERONET_Site'] == site].sort_values('code')
+    fliers = fliers[(fliers['period'] == 'month') & (fliers['variable'] == variable) & (fliers['AERONET_Site'] == site)]
+    dateinstr = str.capitalize(pd.Timestamp(monthly['first'].iloc[0]).strftime('%b %Y'))
+    datefinalstr =  str.capitalize(pd.Timestamp(monthly['last'].iloc[0]).strftime('%b %Y'))
     leveldata = ''.join(['Level ',str(datalevel)[0],'.',str(datalevel)[1]])
-    station_name = aeronetdatabp['AERONET_Site'][0].replace('_',' ')
+    station_name = ', '.join(sites).replace('_',' ')
     measurement_title = 'AERONET Data - ' + dateinstr + ' to ' + datefinalstr + ' - ' + graphicflag + ' Retrieval '\
                  + leveldata + '\n' + station_name + ' Station'
     if lambdagraph == 340:
@@ -298,10 +507,22 @@ def boxplot_temporal_evolution(graphicflag, datalevel, aeronetdatabp, aeronetmea
     fig,ax = plt.subplots(1, 1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi)
     fig.suptitle(measurement_title, fontsize=18, fontweight='bold')
     fig.subplots_adjust(top = 0.91)
-    ax.plot(aeronetmeanbp[''.join([graphicflag,'_',str(lambdagraph),'nm'])].to_numpy(), 'o--', markerfacecolor= colorgraphmean, color = colorgraphmean,
+    ax.plot(monthly['mean'].to_numpy(), 'o--', markerfacecolor= colorgraphmean, color = colorgraphmean,
              linewidth = 1, label = 'Monthly mean ' + graphicflag + ' at ' + str(lambdagraph) + ' nm')
-    sns.boxplot(x = 'Month', y = graphicflag + '_' + str(lambdagraph) + 'nm', data = aeronetdatabp, color = colorbox, 
-                linewidth = 1, saturation = 1, flierprops = dict(marker = 'o', markersize = 3))
+    # one box per month with data, at positions 0, 1, ... as the categorical months of the seaborn boxplot
+    boxes = []
+    for code, label, row in zip(monthly['code'], monthly['label'], monthly.itertuples(index=False)):
+        boxes.append({'label': label, 'med': row.median, 'q1': row.q1, 'q3': row.q3, 'whislo': row.whislo, 'whishi': row.whishi,
+                      'fliers': fliers.loc[fliers['code'] == code, 'value'].to_numpy()})
+    ax.bxp(boxes, positions = range(len(boxes)), widths = 0.8, patch_artist = True, showfliers = True,
+           boxprops = dict(facecolor = colorbox, edgecolor = '0.25', linewidth = 1),
+           medianprops = dict(color = '0.25', linewidth = 1), whiskerprops = dict(color = '0.25', linewidth = 1),
+           capprops = dict(color = '0.25', linewidth = 1),
+           flierprops = dict(marker = 'o', markersize = 3, markerfacecolor = 'none', markeredgecolor = '0.25'))
+    ax.set_xticks(range(len(boxes)), [box['label'] for box in boxes])
+    # categorical x axis, as in seaborn: no vertical grid lines, half a box of margin
+    ax.xaxis.grid(False)
+    ax.set_xlim(-0.5, len(boxes) - 0.5)
     # ax.grid(b = True)
     ax.set_ylabel(gflag + ' at ' +str(lambdagraph) + 'nm \nMonthly Columns', fontsize=18, fontweight='bold');
     ax.set_xlabel('Month of the Year', fontsize=18, fontweight='bold');
@@ -317,10 +538,11 @@ def boxplot_temporal_evolution(graphicflag, datalevel, aeronetdatabp, aeronetmea
     plt.savefig(auxname)
 #    auxnamepdf = auxname.replace(figpng,figpdf)
 #    plt.savefig(auxnamepdf)
-    plt.show()
+    if SHOW_FIGURES:
+        plt.show()
     plt.close(fig)
 
-def scatterplot_AODvsAE(graphicflag, datalevel, df_aeronetdata, lambdagraph, filegraphpath, graphname):
+def scatterplot_AODvsAE(graphicflag, datalevel, df_aeronetdata, lambdagraph, filegraphpath, graphname, density=None):
 
     dateinstr = str.capitalize(df_aeronetdata['globaltime'][0].strftime('%b %Y'))
     datefinalstr =  str.capitalize(df_aeronetdata['globaltime'][len(df_aeronetdata['globaltime'])-1].strftime('%b %Y'))
@@ -338,41 +560,37 @@ def scatterplot_AODvsAE(graphicflag, datalevel, df_aeronetdata, lambdagraph, fil
     ymaxlim = round(df_aeronetdata['AE_' + str(list(ast.literal_eval(lambdagraph))[1]) +'_' + str(list(ast.literal_eval(lambdagraph))[2])+'nm'].max())+0.5*(round(df_aeronetdata['AE_' + str(list(ast.literal_eval(lambdagraph))[1]) +'_' + str(list(ast.literal_eval(lambdagraph))[2])+'nm'].max()))
     xminlim = 0
     xmaxlim = round(2*df_aeronetdata['AOD_' + str(list(ast.literal_eval(lambdagraph))[0]) + 'nm'].max())
-    mdpi=120
-        
-    sns.set(style = 'darkgrid')
-    fig,ax = plt.subplots(1, 1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi)
-    fig.suptitle(measurement_title, fontsize=18, fontweight='bold')
-    fig.subplots_adjust(top = 0.91)
+    aodname = 'AOD_' + str(list(ast.literal_eval(lambdagraph))[0]) + 'nm'
+    aename = 'AE_' + str(list(ast.literal_eval(lambdagraph))[1]) +'_' + str(list(ast.literal_eval(lambdagraph))[2])+'nm'
 
-#    ax.plot(df_aeronetdata['AOD_' + str(list(ast.literal_eval(lambdagraph))[0]) + 'nm'].to_numpy(), df_aeronetdata['AE_' + str(list(ast.literal_eval(lambdagraph))[1]) +'_' + str(list(ast.literal_eval(lambdagraph))[2])+'nm'].to_numpy(), 
-#                           marker = 'o', color = colorgraphmean, markersize = 5, linestyle='none', alpha=0.5, label = '$AOD_{' + str(list(ast.literal_eval(lambdagraph))[0]) + '}$ vs. $AE_{' + str(list(ast.literal_eval(lambdagraph))[1]) +'\_' + str(list(ast.literal_eval(lambdagraph))[2]) +'}$',zorder=2)
+    def building():
+        template = building_scatter_figure(density = density is not None)
+        template['hline'] = template['ax'].hlines(0.0, 0.0, 1.0, color = 'black', linestyle = 'dashed', linewidth = 1.3, zorder=10)
+        template['vline'] = template['ax'].vlines(0.0, 0.0, 1.0, color = 'black', linestyle = 'dashed', linewidth = 1.3, zorder=5)
+        return template
 
-    plt.scatter(df_aeronetdata['AOD_' + str(list(ast.literal_eval(lambdagraph))[0]) + 'nm'].to_numpy(), df_aeronetdata['AE_' + str(list(ast.literal_eval(lambdagraph))[1]) +'_' + str(list(ast.literal_eval(lambdagraph))[2])+'nm'].to_numpy(), c = df_aeronetdata['LR_' + str(list(ast.literal_eval(lambdagraph))[0]) +'nm'], 
-                               cmap = 'Spectral_r', zorder=2)
-    plt.colorbar(label = 'LR at '+ str(list(ast.literal_eval(lambdagraph))[0]) + 'nm')
+    template = figure_template(('AOD_vs_AE', density is not None), building)
+    ax = template['ax']
+    rendering_colored_points(template, measurement_title, df_aeronetdata[aodname].to_numpy(), df_aeronetdata[aename].to_numpy(),
+                             df_aeronetdata['LR_' + str(list(ast.literal_eval(lambdagraph))[0]) +'nm'].to_numpy(),
+                             'LR at '+ str(list(ast.literal_eval(lambdagraph))[0]) + 'nm', (xminlim, xmaxlim), (yminlim, ymaxlim),
+                             os.sep.join([filegraphpath, graphname]), density)
     
-    plt.hlines(df_aeronetdata['AE_' + str(list(ast.literal_eval(lambdagraph))[1]) +'_' + str(list(ast.literal_eval(lambdagraph))[2])+'nm'].mean(numeric_only=True), 0.0, xmaxlim, color = 'black', linestyle = 'dashed', linewidth = 1.3, zorder=10)
-    
-    plt.vlines(df_aeronetdata['AOD_' + str(list(ast.literal_eval(lambdagraph))[0]) + 'nm'].mean(numeric_only=True), 0.0, ymaxlim, color = 'black', linestyle = 'dashed', linewidth = 1.3, zorder=5)
+    aemean = df_aeronetdata[aename].mean(numeric_only=True)
+    aodmean = df_aeronetdata[aodname].mean(numeric_only=True)
+    template['hline'].set_segments([[(0.0, aemean), (xmaxlim, aemean)]])
+    template['vline'].set_segments([[(aodmean, 0.0), (aodmean, ymaxlim)]])
     
     ax.set_xlabel('Aerosol Optical Depth at ' + str(list(ast.literal_eval(lambdagraph))[0]) + 'nm \n', fontsize=18, fontweight='bold');
     ax.set_ylabel('Angstrom Exponent relation ' + str(list(ast.literal_eval(lambdagraph))[1]) +'-' + str(list(ast.literal_eval(lambdagraph))[2])+'nm', fontsize=18, fontweight='bold');
     ax.set_xlim(xminlim, xmaxlim)
     ax.set_ylim(yminlim, ymaxlim)
-    ax.tick_params(axis='both', which='major', labelsize=15, width=5, length=5, color='black', direction='in')
-    for label in ax.get_xticklabels():
-            label.set_fontweight(550)
-    for label in ax.get_yticklabels():
-            label.set_fontweight(550)
+    styling_ticklabels(ax)
 #    ax.legend(fontsize = 16, loc = 'best', markerscale = 1.5, handletextpad = 0.2)    
-    auxname = os.sep.join([filegraphpath, graphname])
-    plt.savefig(auxname)
-    plt.show()
-    plt.close(fig)
+    saving_template(template, os.sep.join([filegraphpath, graphname]))
         
         
-def angsmatrix_plot(datalevel, ssa_data, sae_data, derivssa, df_aeronetdata, filegraphpath_angmatrix,graphname_angmatrix):
+def angsmatrix_plot(datalevel, ssa_data, sae_data, derivssa, df_aeronetdata, filegraphpath_angmatrix,graphname_angmatrix, density=None):
     
     mdpi=120
     dateinstr = str.capitalize(df_aeronetdata['globaltime'][0].strftime('%b %Y'))
@@ -382,42 +600,41 @@ def angsmatrix_plot(datalevel, ssa_data, sae_data, derivssa, df_aeronetdata, fil
     measurement_title = 'AERONET Data - ' + dateinstr + ' to ' + datefinalstr + ' - ' + 'Angström Matrix '\
                  + leveldata + '\n' + station_name + ' Station'       
                  
-    sns.set(style = 'darkgrid')
-    fig1,ax = plt.subplots(1, 1, sharey = 'row', figsize=(1200/mdpi, 800/mdpi),dpi=mdpi,facecolor='w', edgecolor='k')
-    fig1.suptitle(measurement_title, fontsize=18, fontweight='bold')
-    fig1.subplots_adjust(top = 0.91, right = 1.05)
-    plt.scatter(sae_data, df_aeronetdata['AAE_440-870nm'], c = derivssa, cmap = 'Spectral_r')
-    plt.colorbar(label = 'dSSA(440-870nm)')
-    # Traçando as demarcações verticais e horizontais.
-    x = np.linspace(1.0, 1.5, 20)
-    plt.hlines(1.0, -1.0, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
-    plt.hlines(1.5, -1.0, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
-    plt.hlines(2.0, -1.0, 0.0, color = 'black', linestyle = 'dashed', linewidth = 1.0)
-    plt.hlines(2.0, 1.5, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
-    plt.vlines(0.0, 2.0, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
-    plt.vlines(1.5, 1.5, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
-    plt.vlines(1.0, -1.0, 1.0, color = 'black', linestyle = 'dashed', linewidth = 1.0)
-    plt.plot(x, x, color = 'black', linestyle = 'dashed', linewidth = 1.1)
-    # Textos das demarcações.
-    plt.text(-0.88, 2.7, 'Dust Dominated', fontsize = 11, fontweight='bold')
-    plt.text(2.25, 2.7, 'Strong BrC', fontsize = 11, fontweight='bold')
-    plt.text(-0.2, 1.7, 'Mixed Dust/BC/BrC', fontsize = 11, fontweight='bold')
-    plt.text(2.15, 1.7, 'Mixed BC/BrC', fontsize = 11, fontweight='bold')
-    plt.text(-0.5, 1.2, 'Large Particle/BC Mix', fontsize = 11, fontweight='bold')
-    plt.text(2.13, 1.2, 'BC Dominated', fontsize = 11, fontweight='bold')
-    plt.text(-0.65, 0.0, 'Large Particle/Low Abs. Mix', fontsize = 11, fontweight='bold')
-    plt.text(1.8, 0.0, 'Small Particle/Low Abs. Mix', fontsize = 11, fontweight='bold')
-    ax.set_xlabel(r'Scaterring Ångström Exponent 440-870 nm', fontsize=18, fontweight='bold');
-    ax.set_ylabel(r'Absorption Ångström Exponent 440-870 nm', fontsize=18, fontweight='bold');
-    ax.set_xlim(-1.0, round(max(sae_data))+1.5)
-    ax.set_ylim(-1.0, round(max(df_aeronetdata['AAE_440-870nm']))+1.5)
-    ax.tick_params(axis='both', which='major', labelsize=15, width=5, length=5, color='black', direction='in')
-    for label in ax.get_xticklabels():
-            label.set_fontweight(550)
-    for label in ax.get_yticklabels():
-            label.set_fontweight(550)
+    def building():
+        template = building_scatter_figure(mdpi, density is not None, facecolor='w', edgecolor='k')
+        template['fig'].subplots_adjust(top = 0.91, right = 1.05)
+        ax = template['ax']
+        # Traçando as demarcações verticais e horizontais.
+        x = np.linspace(1.0, 1.5, 20)
+        ax.hlines(1.0, -1.0, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
+        ax.hlines(1.5, -1.0, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
+        ax.hlines(2.0, -1.0, 0.0, color = 'black', linestyle = 'dashed', linewidth = 1.0)
+        ax.hlines(2.0, 1.5, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
+        ax.vlines(0.0, 2.0, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
+        ax.vlines(1.5, 1.5, 3.5, color = 'black', linestyle = 'dashed', linewidth = 1.0)
+        ax.vlines(1.0, -1.0, 1.0, color = 'black', linestyle = 'dashed', linewidth = 1.0)
+        ax.plot(x, x, color = 'black', linestyle = 'dashed', linewidth = 1.1)
+        # Textos das demarcações.
+        ax.text(-0.88, 2.7, 'Dust Dominated', fontsize = 11, fontweight='bold')
+        ax.text(2.25, 2.7, 'Strong BrC', fontsize = 11, fontweight='bold')
+        ax.text(-0.2, 1.7, 'Mixed Dust/BC/BrC', fontsize = 11, fontweight='bold')
+        ax.text(2.15, 1.7, 'Mixed BC/BrC', fontsize = 11, fontweight='bold')
+        ax.text(-0.5, 1.2, 'Large Particle/BC Mix', fontsize = 11, fontweight='bold')
+        ax.text(2.13, 1.2, 'BC Dominated', fontsize = 11, fontweight='bold')
+        ax.text(-0.65, 0.0, 'Large Particle/Low Abs. Mix', fontsize = 11, fontweight='bold')
+        ax.text(1.8, 0.0, 'Small Particle/Low Abs. Mix', fontsize = 11, fontweight='bold')
+        ax.set_xlabel(r'Scaterring Ångström Exponent 440-870 nm', fontsize=18, fontweight='bold');
+        ax.set_ylabel(r'Absorption Ångström Exponent 440-870 nm', fontsize=18, fontweight='bold');
+        return template
+
+    xlimits = (-1.0, round(max(sae_data))+1.5)
+    ylimits = (-1.0, round(max(df_aeronetdata['AAE_440-870nm']))+1.5)
+    template = figure_template(('angsmatrix', density is not None), building)
+    ax = template['ax']
+    rendering_colored_points(template, measurement_title, sae_data, df_aeronetdata['AAE_440-870nm'], derivssa, 'dSSA(440-870nm)',
+                             xlimits, ylimits, os.sep.join([filegraphpath_angmatrix, graphname_angmatrix]), density)
+    ax.set_xlim(xlimits)
+    ax.set_ylim(ylimits)
+    styling_ticklabels(ax)
     ##ax.legend(fontsize = 16, loc = 'best', markerscale = 1.5, handletextpad = 0.2)    
-    auxname = os.sep.join([filegraphpath_angmatrix, graphname_angmatrix])
-    plt.savefig(auxname)
-    plt.show()
-    plt.close(fig1)        
+    saving_template(template, os.sep.join([filegraphpath_angmatrix, graphname_angmatrix]))
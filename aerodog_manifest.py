@@ -0,0 +1,125 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to keep track of the raw AERONET files already organized (Module 1)
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+Each 01-organized/<outputdir> folder has a manifest (aerodog_manifest.json)
+with one entry per raw file: its size, modification time and content hash,
+the parameters used to organize it (filetype, use_cols, rows_to_skip, level,
+storage and the QC rules, when they are not the defaults), the v01 file
+written and the number of rows removed by each QC rule. A raw file only needs to be organized
+again if it changed, if the parameters changed or if the v01 file is gone.
+"""
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = 'aerodog_manifest.json'
+
+def hashing_file(filename, blocksize=1024*1024):
+    '''
+=============================================
+Function to calculate the sha256 hash of the content of a file
+=============================================
+'''
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as afile:
+        for block in iter(lambda: afile.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def reading_manifest(outputdir):
+    '''
+=============================================
+Function to read the manifest of an output folder (empty if there is none)
+=============================================
+'''
+    manifestfile = os.sep.join([outputdir, MANIFEST_NAME])
+    if not os.path.exists(manifestfile):
+        return {}
+    with open(manifestfile, 'r') as afile:
+        return json.load(afile)
+
+def writing_manifest(outputdir, manifest):
+    '''
+=============================================
+Function to write the manifest of an output folder. The file is written
+to a temporary name first, so an interrupted run never leaves a broken
+manifest behind.
+=============================================
+'''
+    manifestfile = os.sep.join([outputdir, MANIFEST_NAME])
+    with open(manifestfile + '.tmp', 'w') as afile:
+        json.dump(manifest, afile, indent=1, sort_keys=True)
+    os.replace(manifestfile + '.tmp', manifestfile)
+
+def organizing_params(filetype, use_cols, rowstoskip, rawlevel, storage, compact=False, qcrules=None):
+    '''
+=============================================
+Function to collect the parameters of organizing_aeronet_data() that
+change the v01 file, as JSON-compatible values (compact is only recorded
+when it is on and qcrules, the QC rules of the filetype, only when they
+are given, so the manifests of earlier runs stay valid)
+=============================================
+'''
+    params = {'filetype': str(filetype),
+              'use_cols': [column if isinstance(column, str) else int(column) for column in use_cols],
+              'rows_to_skip': str(rowstoskip),
+              'level': str(rawlevel),
+              'storage': str(storage)}
+    if compact:
+        params['compact'] = True
+    if qcrules is not None:
+        params['qc'] = [{'column': rule['column'],
+                         'sentinels': rule['sentinels'],
+                         'range': list(rule['range']) if rule['range'] is not None else None,
+                         'required': rule['required']} for rule in qcrules]
+    return params
+
+def checking_manifest(manifest, rawfile, params, outputfile):
+    '''
+=============================================
+Function to check if the v01 file organized from a raw file is up to date
+
+Input:
+manifest   , dict    Manifest read by reading_manifest()
+rawfile    , string  Path to the raw AERONET file
+params     , dict    Parameters used to organize the file
+outputfile , string  Path to the v01 file
+
+Output:
+True if the raw file and the parameters are the same as in the manifest and
+the v01 file exists. The content hash is only calculated when the size or
+the modification time of the raw file changed (e.g. a new download with the
+same content); the manifest entry is then updated with the new time.
+=============================================
+'''
+    entry = manifest.get(os.path.basename(rawfile))
+    if entry is None or entry['params'] != params or entry['outputfile'] != os.path.basename(outputfile):
+        return False
+    if not os.path.exists(outputfile):
+        return False
+    stat = os.stat(rawfile)
+    if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+        return True
+    if stat.st_size != entry['size'] or hashing_file(rawfile) != entry['sha256']:
+        return False
+    entry['mtime_ns'] = stat.st_mtime_ns
+    return True
+
+def updating_manifest(manifest, rawfile, params, outputfile, quality=None):
+    '''
+=============================================
+Function to record in the manifest that a raw file was organized (with the
+number of rows read and removed by each QC rule, when given)
+=============================================
+'''
+    stat = os.stat(rawfile)
+    manifest[os.path.basename(rawfile)] = {'size': stat.st_size,
+                                           'mtime_ns': stat.st_mtime_ns,
+                                           'sha256': hashing_file(rawfile),
+                                           'params': params,
+                                           'outputfile': os.path.basename(outputfile)}
+    if quality is not None:
+        manifest[os.path.basename(rawfile)]['quality_control'] = quality
@@ -0,0 +1,284 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to save the v02 and v03 data in a store partitioned by site, year and month, and to query it by site and time range
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+A store is a folder with one file per site and month (in the storage format
+of the intermediate files, see aerodog_storage.py):
+
+    <store>/site=<AERONET_Site>/year=<YYYY>/month=<MM>/data.parquet
+
+and an index (store_index.json) with, for each partition, its number of
+rows, the first and last globaltime, the minimum and maximum of each
+numeric column and the time range of each row group (chunk of at most
+STORE_ROWGROUP rows). The rows of a partition are sorted by globaltime.
+
+querying_store reads the index first and only opens the partitions of the
+sites and months asked for; in parquet and feather files, only the row
+groups whose time range overlaps the query are read (in parquet files, the
+time range of each row group is read from the statistics kept in the file,
+so an index out of date with its files cannot skip or misread rows). Reading one month of
+one site of a large archive then touches only that month's bytes.
+"""
+import os
+import json
+import shutil
+import pandas as pd
+import aerodog_storage as ads
+
+STORE_INDEX = 'store_index.json'
+
+# maximum number of rows of a row group (parquet) or record batch (feather)
+STORE_ROWGROUP = 10000
+
+def store_dirname(savefilename):
+    '''Function to name the store of a v02 or v03 file (path without extension), e.g. ..._v02 -> ..._v02.store'''
+    return savefilename + '.store'
+
+def partition_path(site, year, month, storage):
+    '''Function to build the path of a partition file, relative to the store folder'''
+    return os.sep.join(['site=' + str(site), 'year=%04d' % year, 'month=%02d' % month, 'data' + ads.STORAGE_EXTENSIONS[storage]])
+
+def opening_store(storedir, storage='parquet'):
+    '''
+=============================================
+Function to start writing a store (see writing_store and closing_store).
+The partitions are written in a temporary folder, which replaces the store
+folder when it is closed, so a store is never read half written.
+
+Input:
+storedir , string  Path to the store folder
+storage  , string  Storage format of the partition files
+
+Output:
+The store writer (dict)
+=============================================
+'''
+    if storage not in ads.STORAGE_EXTENSIONS:
+        raise ValueError('opening_store:: unknown storage format ' + str(storage))
+    tmpdir = storedir + '.' + str(os.getpid()) + '.tmp'
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    return {'dir': storedir, 'tmpdir': tmpdir, 'storage': storage, 'writers': {}, 'partitions': {}}
+
+def updating_stats(stats, df):
+    '''Function to update the minimum and maximum of the numeric columns of a partition with the rows of a chunk'''
+    for name in df.columns:
+        if name == 'globaltime' or not pd.api.types.is_numeric_dtype(df[name]) or pd.api.types.is_bool_dtype(df[name]):
+            continue
+        low, high = df[name].min(), df[name].max()
+        if pd.isna(low):
+            continue
+        old = stats.get(name)
+        stats[name] = [float(low), float(high)] if old is None else [min(old[0], float(low)), max(old[1], float(high))]
+
+def writing_store(store, df):
+    '''
+=============================================
+Function to add the rows of a DF (with AERONET_Site and globaltime columns)
+to a store opened by opening_store. The rows are sorted by globaltime and
+appended to the partition of their site and month, in row groups of at most
+STORE_ROWGROUP rows. A DF can be given in many chunks (e.g. one per site and
+time window); a partition whose chunks do not come in time order is sorted
+again when it is closed.
+=============================================
+'''
+    if len(df) == 0:
+        return
+    df = df.sort_values(['AERONET_Site', 'globaltime'], kind='stable')
+    times = df['globaltime']
+    for (site, year, month), rows in df.groupby([df['AERONET_Site'].astype(str), times.dt.year, times.dt.month], sort=False, observed=True):
+        relpath = partition_path(site, year, month, store['storage'])
+        if relpath not in store['writers']:
+            os.makedirs(os.path.dirname(os.sep.join([store['tmpdir'], relpath])), exist_ok=True)
+            store['writers'][relpath] = ads.opening_chunk_writer(ads.storage_basename(os.sep.join([store['tmpdir'], relpath])), store['storage'])
+            store['partitions'][relpath] = {'site': site, 'year': int(year), 'month': int(month), 'rows': 0,
+                                            'first': None, 'last': None, 'sorted': True, 'rowgroups': [], 'stats': {}}
+        partition = store['partitions'][relpath]
+        for i in range(0, len(rows), STORE_ROWGROUP):
+            rowgroup = rows.iloc[i:i + STORE_ROWGROUP]
+            first, last = rowgroup['globaltime'].iloc[0], rowgroup['globaltime'].iloc[-1]
+            if partition['last'] is not None and first < partition['last']:
+                partition['sorted'] = False
+            ads.writing_chunk(store['writers'][relpath], rowgroup)
+            partition['rowgroups'].append([first, last, len(rowgroup)])
+            partition['rows'] += len(rowgroup)
+            partition['first'] = first if partition['first'] is None else min(partition['first'], first)
+            partition['last'] = last if partition['last'] is None else max(partition['last'], last)
+            updating_stats(partition['stats'], rowgroup)
+
+def sorting_partition(store, relpath):
+    '''Function to sort by globaltime a partition whose chunks did not come in time order (it is read back and written again)'''
+    filename = os.sep.join([store['tmpdir'], relpath])
+    df = ads.loading_aeronet_data(filename).sort_values('globaltime', kind='stable')
+    partition = store['partitions'][relpath]
+    writer = ads.opening_chunk_writer(ads.storage_basename(filename), store['storage'])
+    partition['rowgroups'] = []
+    for i in range(0, len(df), STORE_ROWGROUP):
+        rowgroup = df.iloc[i:i + STORE_ROWGROUP]
+        ads.writing_chunk(writer, rowgroup)
+        partition['rowgroups'].append([rowgroup['globaltime'].iloc[0], rowgroup['globaltime'].iloc[-1], len(rowgroup)])
+    ads.closing_chunk_writer(writer)
+    partition['sorted'] = True
+
+def closing_store(store):
+    '''
+=============================================
+Function to finish a store: close the partition files, write the index and
+replace the store folder by the new one
+
+Output:
+Path to the store folder and number of partitions
+=============================================
+'''
+    for relpath, writer in store['writers'].items():
+        ads.closing_chunk_writer(writer)
+        if not store['partitions'][relpath]['sorted']:
+            sorting_partition(store, relpath)
+    index = {'storage': store['storage'], 'rowgroup': STORE_ROWGROUP,
+             'partitions': dict(sorted(store['partitions'].items()))}
+    # times as ISO 8601 strings in the index
+    for partition in index['partitions'].values():
+        del partition['sorted']
+        partition['first'], partition['last'] = partition['first'].isoformat(), partition['last'].isoformat()
+        partition['rowgroups'] = [[first.isoformat(), last.isoformat(), rows] for first, last, rows in partition['rowgroups']]
+    with open(os.sep.join([store['tmpdir'], STORE_INDEX]), 'w') as afile:
+        json.dump(index, afile, indent=1)
+    if os.path.exists(store['dir']):
+        shutil.rmtree(store['dir'])
+    os.replace(store['tmpdir'], store['dir'])
+    return store['dir'], len(index['partitions'])
+
+def saving_store(data, storedir, storage='parquet'):
+    '''
+=============================================
+Function to save data in a store partitioned by site, year and month
+
+Input:
+data     , pandas DF or iterable of pandas DF  Data to save (e.g. the merged DF, or
+                                               the chunks of a v02 file read by
+                                               ads.loading_aeronet_chunks)
+storedir , string                              Path to the store folder
+storage  , string                              Storage format of the partition files
+
+Output:
+Path to the store folder and number of partitions
+=============================================
+'''
+    store = opening_store(storedir, storage)
+    try:
+        for df in ([data] if isinstance(data, pd.DataFrame) else data):
+            writing_store(store, df)
+    except BaseException:
+        shutil.rmtree(store['tmpdir'], ignore_errors=True)
+        raise
+    return closing_store(store)
+
+def reading_store_index(storedir):
+    '''Function to read the index of a store (see closing_store)'''
+    with open(os.sep.join([storedir, STORE_INDEX]), 'r') as afile:
+        return json.load(afile)
+
+def pruning_partitions(index, sites=None, start=None, end=None):
+    '''
+=============================================
+Function to select the partitions (paths relative to the store folder) that
+may have rows of the sites in the time range [start, end), from the first
+and last globaltime of each partition in the index
+=============================================
+'''
+    selected = []
+    for relpath, partition in index['partitions'].items():
+        if sites is not None and partition['site'] not in sites:
+            continue
+        if start is not None and pd.Timestamp(partition['last']) < start:
+            continue
+        if end is not None and pd.Timestamp(partition['first']) >= end:
+            continue
+        selected.append(relpath)
+    return sorted(selected, key=lambda relpath: (index['partitions'][relpath]['site'], index['partitions'][relpath]['year'],
+                                                 index['partitions'][relpath]['month']))
+
+def reading_partition(filename, partition, start=None, end=None, columns=None):
+    '''
+=============================================
+Function to read the rows of a partition file in the time range [start, end).
+In parquet and feather files only the row groups that overlap the range are
+read: in parquet files their time ranges are the globaltime statistics of
+the file (ads.row_group_times), in feather files they are in the index
+(all the batches are read when the file does not have as many batches as
+the index has row groups); csv files are read whole.
+=============================================
+'''
+    readcolumns = None if columns is None else list(dict.fromkeys(['globaltime'] + list(columns)))
+    storage = ads.storage_format(filename)
+    if storage == 'parquet':
+        import pyarrow.parquet
+        parquetfile = pyarrow.parquet.ParquetFile(filename)
+        unit = parquetfile.schema_arrow.field('globaltime').type.unit
+        first = None if start is None else ads.timestamp_value(start, unit)
+        last = None if end is None else ads.timestamp_value(end, unit)
+        # a row group without statistics is always read
+        rowgroups = [i for i, times in enumerate(ads.row_group_times(parquetfile))
+                     if times is None or ((first is None or times[1] >= first) and (last is None or times[0] < last))]
+        df = parquetfile.read_row_groups(rowgroups, columns=readcolumns).to_pandas()
+    elif storage == 'feather':
+        import pyarrow
+        import pyarrow.ipc
+        rowgroups = [i for i, (first, last, rows) in enumerate(partition['rowgroups'])
+                     if (start is None or pd.Timestamp(last) >= start) and (end is None or pd.Timestamp(first) < end)]
+        with pyarrow.memory_map(filename) as source:
+            reader = pyarrow.ipc.open_file(source)
+            if reader.num_record_batches != len(partition['rowgroups']):
+                rowgroups = range(reader.num_record_batches)
+            batches = [reader.get_batch(i) for i in rowgroups]
+            table = pyarrow.Table.from_batches(batches, schema=reader.schema)
+            if readcolumns is not None:
+                table = table.select(readcolumns)
+            df = table.to_pandas()
+    else:
+        df = ads.loading_aeronet_data(filename, columns=readcolumns)
+    if start is not None:
+        df = df[df['globaltime'] >= start]
+    if end is not None:
+        df = df[df['globaltime'] < end]
+    return df
+
+def querying_store(storedir, sites=None, start=None, end=None, columns=None):
+    '''
+=============================================
+Function to read the rows of some sites in a time range from a store, e.g.
+querying_store(storedir, ['Sao_Paulo'], '2024-08-01', '2024-09-01',
+['AERONET_Site', 'AOD_500nm'])
+
+Input:
+storedir , string           Path to the store folder
+sites    , list of strings  Sites to read (default: all)
+start    , timestamp        First time of the range (inclusive, default: no limit)
+end      , timestamp        End of the range (exclusive, default: no limit)
+columns  , list of strings  Columns to read (default: all; globaltime is always read)
+
+Output:
+pandas DF sorted by site and globaltime (only the partitions and row groups
+that overlap the query are read)
+=============================================
+'''
+    index = reading_store_index(storedir)
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    if isinstance(sites, str):
+        sites = [sites]
+    chunks = []
+    for relpath in pruning_partitions(index, sites, start, end):
+        chunks.append(reading_partition(os.sep.join([storedir, relpath]), index['partitions'][relpath], start, end, columns))
+    if len(chunks) == 0:
+        # no rows: an empty DF with the columns of any partition
+        anypath = next(iter(index['partitions']), None)
+        if anypath is None:
+            return pd.DataFrame(columns=columns)
+        empty = ads.loading_aeronet_schema(os.sep.join([storedir, anypath]))
+        return empty if columns is None else empty[list(dict.fromkeys(['globaltime'] + list(columns)))]
+    # the partitions are read in site, year, month order, so the result is sorted
+    return pd.concat(chunks, axis=0, ignore_index=True)
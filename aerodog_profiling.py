@@ -0,0 +1,222 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to measure the AERODOG stages and function calls and write run reports
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+When the profiling is on (see configuring_profiling, --report in aerodog.py),
+each stage (organize, merge, derive, climatology, plot) and each call of
+organizing_aeronet_data, mining_aeronet_data, optical_products and of the
+graphics functions is run through measuring_call, which records:
+  - wall time and CPU time (of the whole process, so it includes the other
+    threads when the tasks run on threads)
+  - rows in (rows of the DF arguments) and rows out (rows of the DF returned)
+  - bytes read and written by the process (from /proc/self/io, Linux only)
+  - peak resident memory (RSS) while the call ran (sampled every 5 ms)
+The records of the worker processes are sent back with the results of their
+tasks (see aerodog_tasks.running_task). writing_report saves all the records
+in a JSON and a CSV file. One stage or function can also be profiled with
+cProfile (a .prof file, read with pstats or snakeviz) or with pyinstrument
+(an .html file, when it is installed).
+"""
+import os
+import sys
+import csv
+import json
+import time
+import threading
+import pandas as pd
+
+# profiling state: on/off, stage or function to profile, profiler and folder of the profiles
+PROFILING = {'on': False, 'profile': None, 'profiler': 'cprofile', 'dir': '.'}
+
+# one dict per measured call (see measuring_call)
+RECORDS = []
+
+# stages being measured in each thread (the parent of a call is the last one)
+RUNNING = threading.local()
+
+def configuring_profiling(on=True, profile=None, profiler='cprofile', profiledir='.'):
+    '''
+=============================================
+Function to turn the measurements on (or off) and choose a stage or
+function to profile
+
+Input:
+on         , boolean  Measure the stages and function calls
+profile    , string   Name of the stage (e.g. merge) or function (e.g.
+                      optical_products) to profile, optional
+profiler   , string   'cprofile' or 'pyinstrument'
+profiledir , string   Folder of the profile files
+=============================================
+'''
+    if profiler not in ['cprofile', 'pyinstrument']:
+        raise ValueError('configuring_profiling:: unknown profiler ' + str(profiler))
+    PROFILING.update({'on': on, 'profile': profile, 'profiler': profiler, 'dir': profiledir})
+
+def current_rss():
+    '''Resident memory (RSS) of this process in bytes (from /proc on Linux, else the peak RSS)'''
+    try:
+        with open('/proc/self/statm', 'r') as afile:
+            return int(afile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+def peak_rss():
+    '''Peak resident memory (RSS) of this process in bytes (None if unknown, e.g. on Windows)'''
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+def io_bytes():
+    '''Bytes read and written by this process so far (rchar and wchar of /proc/self/io; None, None if unknown)'''
+    try:
+        with open('/proc/self/io', 'r') as afile:
+            counters = dict([line.split(':') for line in afile.read().splitlines()])
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def counting_rows(value):
+    '''Number of rows of a DF (or of the first DF of a tuple/list), None if there is none'''
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                return len(item)
+    return None
+
+def profiling_call(name, function, args):
+    '''Function to run function(*args) under the chosen profiler, saving the profile as <dir>/<name>_<pid>_<n>.prof (cProfile) or .html (pyinstrument)'''
+    os.makedirs(PROFILING['dir'], exist_ok=True)
+    basename = os.sep.join([PROFILING['dir'], '%s_%d_%d' % (name, os.getpid(), len(RECORDS))])
+    if PROFILING['profiler'] == 'pyinstrument':
+        try:
+            import pyinstrument
+        except ImportError:
+            print('profiling_call:: pyinstrument is not installed, using cProfile')
+        else:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            try:
+                return function(*args)
+            finally:
+                profiler.stop()
+                with open(basename + '.html', 'w') as afile:
+                    afile.write(profiler.output_html())
+                print('Profile of', name, 'saved:', basename + '.html')
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(basename + '.prof')
+        print('Profile of', name, 'saved:', basename + '.prof')
+
+def measuring_call(name, function, *args):
+    '''
+=============================================
+Function to call function(*args) and record its wall and CPU time, rows in
+and out, bytes read and written and peak RSS (see the module docstring).
+When the profiling is off, the function is only called.
+
+Input:
+name     , string    Name of the stage or function (e.g. merge, optical_products)
+function , function  Function to call
+args     ,           Arguments of the function
+
+Output:
+The result of function(*args)
+=============================================
+'''
+    if not PROFILING['on']:
+        return function(*args)
+
+    stack = getattr(RUNNING, 'stack', [])
+    RUNNING.stack = stack + [name]
+    samples = [current_rss()]
+    done = threading.Event()
+    def sampling():
+        while not done.wait(0.005):
+            samples.append(current_rss())
+    sampler = threading.Thread(target=sampling, daemon=True)
+    sampler.start()
+    read0, written0 = io_bytes()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    try:
+        if PROFILING['profile'] == name:
+            result = profiling_call(name, function, args)
+        else:
+            result = function(*args)
+    finally:
+        wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+        read1, written1 = io_bytes()
+        done.set()
+        sampler.join()
+        samples.append(current_rss())
+        RUNNING.stack = stack
+
+    rowsin = [counting_rows(arg) for arg in args]
+    rowsin = [rows for rows in rowsin if rows is not None]
+    samples = [sample for sample in samples if sample is not None]
+    RECORDS.append({'name': name,
+                    'parent': stack[-1] if len(stack) > 0 else None,
+                    'pid': os.getpid(),
+                    'start': time.time() - wall,
+                    'wall_seconds': wall,
+                    'cpu_seconds': cpu,
+                    'rows_in': sum(rowsin) if len(rowsin) > 0 else None,
+                    'rows_out': counting_rows(result),
+                    'bytes_read': read1 - read0 if read0 is not None else None,
+                    'bytes_written': written1 - written0 if written0 is not None else None,
+                    'peak_rss_mb': max(samples)/2**20 if len(samples) > 0 else None})
+    return result
+
+def taking_records(start=0):
+    '''Function to remove and return the records from position start on (e.g. the records of a task, sent back by a worker process)'''
+    records = RECORDS[start:]
+    del RECORDS[start:]
+    return records
+
+def writing_report(basename):
+    '''
+=============================================
+Function to write the run report: all the records in basename.json (with
+the python/pandas versions and the total of each name) and basename.csv
+(one line per record), and print the total of each name
+
+Output:
+Paths of the JSON and CSV files
+=============================================
+'''
+    totals = {}
+    for record in RECORDS:
+        total = totals.setdefault(record['name'], {'calls': 0, 'wall_seconds': 0., 'cpu_seconds': 0., 'peak_rss_mb': 0.})
+        total['calls'] += 1
+        total['wall_seconds'] += record['wall_seconds']
+        total['cpu_seconds'] += record['cpu_seconds']
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'] or 0.)
+    print('%-40s %6s %10s %10s %10s' % ('Run report', 'calls', 'wall (s)', 'CPU (s)', 'peak MB'))
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]['wall_seconds']):
+        print('%-40s %6d %10.3f %10.3f %10.0f' % (name, total['calls'], total['wall_seconds'], total['cpu_seconds'], total['peak_rss_mb']))
+
+    directory = os.path.dirname(basename)
+    if directory != '':
+        os.makedirs(directory, exist_ok=True)
+    report = {'python': sys.version.split()[0], 'pandas': pd.__version__, 'argv': sys.argv,
+              'totals': totals, 'records': RECORDS}
+    with open(basename + '.json', 'w') as afile:
+        json.dump(report, afile, indent=1)
+    columns = ['name', 'parent', 'pid', 'start', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out',
+               'bytes_read', 'bytes_written', 'peak_rss_mb']
+    with open(basename + '.csv', 'w', newline='') as afile:
+        writer = csv.DictWriter(afile, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(RECORDS)
+    print('Run report saved:', basename + '.json', basename + '.csv')
+    return basename + '.json', basename + '.csv'
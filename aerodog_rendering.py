@@ -0,0 +1,267 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to render the Module 4 graphics in parallel, on a pool of worker processes
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+Each graphic turned on in the 04-inputfile is a job (function name of
+aerodog_graphics_function and its arguments). The data arguments are
+given by name ('<v03>', '<climatology>', ...) and are built in each
+worker from the v03 DF, which is put once in shared memory: the workers
+read its columns in place, without receiving a pickled copy per job.
+The workers render with the non-interactive Agg backend and never call
+plt.show().
+"""
+import os
+import ast
+import threading
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+import aerodog_function as adf
+import aerodog_tasks as at
+import aerodog_cache as adc
+import aerodog_profiling as apf
+
+# data arguments of the jobs, built from the v03 DF by rendering_inputs()
+RENDERING_INPUTS = ['<v03>', '<climatology>', '<ssa_data>', '<sae_data>', '<derivssa>']
+
+# v03 DF and data arguments of the worker (set by attaching_frame)
+SHARED = {}
+
+# pyplot, SHARED and the figure templates are not thread-safe: the graphics
+# rendered in this process are rendered by one thread at a time
+RENDERING_LOCK = threading.Lock()
+
+# number of points kept by the decimation of the temporal graphics, when the
+# 04-inputfile does not give it (about the width of the graphics in pixels)
+DECIMATION_POINTS = 1200
+
+def reading_decimation(inputfilev04, j):
+    '''Function to read the decimation of the temporal graphics of line j of a 04-inputfile, e.g. ('lttb', 1200), or None (off or not given)'''
+    if 'decimation' not in inputfilev04.columns or pd.isna(inputfilev04['decimation'][j]) or inputfilev04['decimation'][j] == 'off':
+        return None
+    npoints = DECIMATION_POINTS
+    if 'decimation_points' in inputfilev04.columns and not pd.isna(inputfilev04['decimation_points'][j]):
+        npoints = int(inputfilev04['decimation_points'][j])
+    return (inputfilev04['decimation'][j], npoints)
+
+# bins (in x and in y) and statistic of the density graphics, when the 04-inputfile does not give them
+DENSITY_BINS = 100
+DENSITY_STATISTIC = 'mean'
+
+def reading_density(inputfilev04, j):
+    '''Function to read the scatter mode of the AOD vs AE (and Angstrom matrix) graphics of line j of a 04-inputfile: None (points) or e.g. (100, 'mean') (density)'''
+    if 'scatter_mode' not in inputfilev04.columns or pd.isna(inputfilev04['scatter_mode'][j]) or inputfilev04['scatter_mode'][j] == 'points':
+        return None
+    if inputfilev04['scatter_mode'][j] != 'density':
+        raise ValueError('Unknown scatter_mode: ' + str(inputfilev04['scatter_mode'][j]) + ' (use points or density)')
+    bins, statistic = DENSITY_BINS, DENSITY_STATISTIC
+    if 'density_bins' in inputfilev04.columns and not pd.isna(inputfilev04['density_bins'][j]):
+        bins = int(inputfilev04['density_bins'][j])
+    if 'density_statistic' in inputfilev04.columns and not pd.isna(inputfilev04['density_statistic'][j]):
+        statistic = inputfilev04['density_statistic'][j]
+    return (bins, statistic)
+
+def plotting_jobs(rootdir, inputfilev04, graphbasename, level, avgtime):
+    '''
+=============================================
+Function to list the graphics turned on in a 04-inputfile
+
+Input:
+rootdir       , string     AERODOG folder
+inputfilev04  , pandas DF  04-inputfile
+graphbasename , string     Name of the v03 file, e.g. 20240701_20241031_Sao_Paulo_level15.derived
+level         , integer    AERONET data level (e.g. 15)
+avgtime       , string     Average time of the v02 data (e.g. 15min)
+
+Output:
+List of jobs (message, function name, arguments, folder and name of the graphic)
+=============================================
+'''
+    outputdir = os.sep.join([rootdir, '04-graphics', inputfilev04['v04outputdir'][0]])
+    filetype = inputfilev04['graphic_file_type'][0]
+    columns = inputfilev04.columns
+    jobs = []
+
+    for j in range(0,len(inputfilev04)):
+        if inputfilev04['processed_aod'][j] == 'on':
+            aod = inputfilev04['AOD'][j]
+            filegraphpath = os.sep.join([outputdir, columns[1], ''.join([columns[1],'_',str(aod),'nm'])])
+            graphname = ''.join([graphbasename.replace('.derived','_AOD_'),str(aod),'nm.',filetype])
+            jobs.append(('The AOD graphic at '+ str(aod) + ' nm will be plotted', 'aod_temporal_evolution',
+                         (columns[0], level, avgtime, '<v03>', aod, filegraphpath, graphname, reading_decimation(inputfilev04, j)), filegraphpath, graphname))
+
+    for k in range(0,len(inputfilev04)):
+        if inputfilev04['processed_aod_allgraphics'][k] == 'on':
+            filegraphpath = os.sep.join([outputdir, columns[3].replace('graphics','wavelengths')])
+            graphname = ''.join([graphbasename.replace('.derived','_AOD_'),'allwavelengths.',filetype])
+            jobs.append(('The AOD graphics of all wavelengths will be plotted', 'allaod_temporal_evolution',
+                         (columns[0], level, avgtime, '<v03>', list(inputfilev04['AOD']), list(inputfilev04['processed_aod']),
+                          filegraphpath, graphname, reading_decimation(inputfilev04, k)), filegraphpath, graphname))
+
+    for l in range(0,len(inputfilev04)):
+        if inputfilev04['processed_AE'][l] == 'on':
+            lambdaAE = list(ast.literal_eval(inputfilev04['AE'][l]))
+            pair = ''.join([str(lambdaAE[0]),'-',str(lambdaAE[1])])
+            filegraphpath = os.sep.join([outputdir, columns[5], ''.join([columns[5],pair,'nm'])])
+            graphname = ''.join([graphbasename.replace('.derived','_AE'),pair,'nm.',filetype])
+            jobs.append(('The Angstrom Exponent graphic relation at ' + pair + ' nm will be plotted', 'angexp_temporal_evolution',
+                         (columns[4], level, avgtime, '<v03>', lambdaAE, filegraphpath, graphname, reading_decimation(inputfilev04, l)), filegraphpath, graphname))
+
+    for m in range(0,len(inputfilev04)):
+        if inputfilev04['AOD_vs_AE_graphics'][m] == 'on':
+            lambdagraph = list(ast.literal_eval(inputfilev04['AOD_vs_AE'][m]))
+            pair = ''.join([str(lambdagraph[0]),'vs',str(lambdagraph[1]),str(lambdagraph[2])])
+            filegraphpath = os.sep.join([outputdir, columns[9], ''.join([pair,'nm'])])
+            graphname = ''.join([graphbasename.replace('.derived','_AODvsAE_'),pair,'nm.',filetype])
+            jobs.append(('The AOD x AE scatter plot graphic with AOD at '+ str(lambdagraph[0]) + ' and AE relation at '
+                         + str(lambdagraph[1]) + '-' + str(lambdagraph[2]) + ' nm will be plotted', 'scatterplot_AODvsAE',
+                         (columns[9], level, '<v03>', inputfilev04['AOD_vs_AE'][m], filegraphpath, graphname, reading_density(inputfilev04, m)),
+                         filegraphpath, graphname))
+
+    for n in range(0,len(inputfilev04)):
+        if inputfilev04['processed_boxplot_LR'][n] == 'on':
+            lr = inputfilev04['LR'][n]
+            filegraphpath = os.sep.join([outputdir, columns[8], ''.join([columns[8],'_',str(lr),'nm'])])
+            graphname = ''.join([graphbasename.replace('.derived','_LR_'),str(lr),'nm.',filetype])
+            jobs.append(('The boxplot LR graphic at '+ str(lr) + ' nm will be plotted', 'boxplot_temporal_evolution',
+                         (columns[7], level, '<climatology>', lr, filegraphpath, graphname), filegraphpath, graphname))
+
+    '''Angstrom Matrix graphics'''
+    filegraphpath = os.sep.join([outputdir, 'processed_angstrom_matrix', 'processed_angstrom_matrix_440-870nm'])
+    graphname = ''.join([graphbasename.replace('.derived','_Angs_Matrix_'),'440-870nm.',filetype])
+    jobs.append(('The Angstrom Matrix graphic will be plotted', 'angsmatrix_plot',
+                 (level, '<ssa_data>', '<sae_data>', '<derivssa>', '<v03>', filegraphpath, graphname, reading_density(inputfilev04, 0)),
+                 filegraphpath, graphname))
+    return jobs
+
+def rendering_inputs(df_aeronetdata, climatology=None):
+    '''
+=============================================
+Function to build the data arguments of the jobs from the v03 DF and its
+climatology (summaries and fliers of adf.summarizing_aeronet_data, used by
+the boxplots; calculated here when it is not given)
+=============================================
+'''
+    # both are kept in the cache of results (see aerodog_cache.py), keyed by the content of the v03 DF
+    inputs = [adc.hashing_frame(df_aeronetdata)]
+    '''Organizing data to boxplot graphics'''
+    if climatology is None:
+        climatology = adc.cached_call(adf.summarizing_aeronet_data, inputs, {}, df_aeronetdata)
+    '''Organizing data to Angstrom matrix graphics'''
+    ssa_data, sae_data, derivssa = adc.cached_call(adf.angmatrixfunc, inputs, {}, df_aeronetdata)
+    return dict(zip(RENDERING_INPUTS, [df_aeronetdata, climatology, ssa_data, sae_data, derivssa]))
+
+def sharing_frame(df):
+    '''
+=============================================
+Function to copy a DF into a block of shared memory
+
+Numeric and datetime columns are copied as they are; the other columns
+(e.g. AERONET_Site) are stored as integer codes of their categories.
+
+Output:
+The shared memory block and the layout of the columns (small enough to
+send to the workers): list of (column, dtype, offset, categories)
+=============================================
+'''
+    arrays = []
+    for column in df.columns:
+        categories = None
+        if isinstance(df[column].dtype, np.dtype) and df[column].dtype.kind in 'biufcmM':
+            values = df[column].to_numpy()
+        else:
+            codes, categories = pd.factorize(df[column])
+            values, categories = codes.astype(np.int32), list(categories)
+        arrays.append((column, values, categories))
+
+    size = sum([values.nbytes for column, values, categories in arrays])
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    layout = []
+    offset = 0
+    for column, values, categories in arrays:
+        np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, offset=offset)[:] = values
+        layout.append((column, values.dtype.str, offset, categories))
+        offset += values.nbytes
+    return shm, layout
+
+def rendering_headless(backend='Agg'):
+    '''Function to render the graphics with a non-interactive backend (e.g. Agg), without figure windows (plt.show() is not called)'''
+    import matplotlib
+    matplotlib.use(backend)
+    import aerodog_graphics_function as agf
+    agf.SHOW_FIGURES = False
+
+def attaching_frame(name, layout, nrows, climatology=None, backend='Agg'):
+    '''
+=============================================
+Function to start a rendering worker: attaches the shared memory block
+written by sharing_frame() and rebuilds the v03 DF over it (no copy of the
+numeric columns), builds the data arguments of the jobs (with the
+climatology, small enough to be sent to each worker) and turns off the
+interactive graphics
+=============================================
+'''
+    rendering_headless(backend)
+
+    # the workers share the resource tracker of the main process, which removes the block
+    shm = shared_memory.SharedMemory(name=name)
+    df = {}
+    for column, dtype, offset, categories in layout:
+        values = np.ndarray((nrows,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, categories)
+        df[column] = values
+    SHARED['shm'] = shm
+    SHARED['inputs'] = rendering_inputs(pd.DataFrame(df, copy=False), climatology)
+
+def rendering_job(message, function, args, filegraphpath, graphname):
+    '''
+=============================================
+Function to render one graphic: the data arguments given by name are
+replaced by the data of the process (see rendering_inputs and attaching_frame)
+=============================================
+'''
+    import aerodog_graphics_function as agf
+    print(message)
+    args = [SHARED['inputs'][arg] if isinstance(arg, str) and arg in RENDERING_INPUTS else arg for arg in args]
+    print('graphname = ', graphname)
+    apf.measuring_call(function, getattr(agf, function), *args)
+    return os.sep.join([filegraphpath, graphname])
+
+def rendering_plots(jobs, df_aeronetdata, workers=1, climatology=None):
+    '''
+=============================================
+Function to render all the graphics listed by plotting_jobs()
+
+With workers=1 the graphics are rendered in this process, as before (with
+plt.show(), if the backend is interactive). With more workers, the v03 DF
+is shared with the workers (see sharing_frame) and the graphics are
+rendered headless (Agg), in parallel. The messages are printed in the
+order of the jobs in both cases.
+
+Output:
+List with the files of the graphics
+=============================================
+'''
+    import aerodog_graphics_function as agf
+    for message, function, args, filegraphpath, graphname in jobs:
+        os.makedirs(filegraphpath, exist_ok=True)
+    tasks = [(rendering_job, job) for job in jobs]
+
+    if workers <= 1 or len(tasks) <= 1:
+        with RENDERING_LOCK:
+            SHARED['inputs'] = rendering_inputs(df_aeronetdata, climatology)
+            try:
+                return list(at.running_tasks(tasks))
+            finally:
+                SHARED.clear()
+                agf.closing_templates()
+
+    shm, layout = sharing_frame(df_aeronetdata)
+    try:
+        return list(at.running_tasks(tasks, workers, initializer=attaching_frame, initargs=(shm.name, layout, len(df_aeronetdata), climatology)))
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,417 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to save and load the intermediate AERODOG files (v01 organized, v02 merged and v03 derived data)
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+The intermediate files can be stored as:
+  parquet - typed, compressed columnar files (default when pyarrow is installed)
+  feather - uncompressed Arrow IPC files, which are memory-mapped when read
+            back (only the pages of the columns read are loaded)
+  csv     - text files with 6 decimals, as in the previous AERODOG versions
+
+Parquet and feather files are written in row groups (record batches in
+feather files) of the rows of one calendar month, so the rows of a time
+window are read without reading the rest of the file (see
+loading_aeronet_window).
+"""
+import importlib.util
+import numpy as np
+import pandas as pd
+
+STORAGE_EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather', 'csv': ''}
+
+# maximum number of rows of a row group (parquet) or record batch (feather)
+ROWGROUP_ROWS = 100000
+
+def default_storage():
+    '''
+=============================================
+Function to choose the default storage format: parquet if pyarrow is
+installed, csv otherwise (pyarrow is only found here, it is imported when
+the first file is read or written)
+=============================================
+'''
+    if importlib.util.find_spec('pyarrow') is not None:
+        return 'parquet'
+    return 'csv'
+
+def storage_format(filename):
+    '''
+=============================================
+Function to find the storage format of a file from its extension
+(files without a known extension are csv)
+=============================================
+'''
+    for storage, extension in STORAGE_EXTENSIONS.items():
+        if extension != '' and filename.endswith(extension):
+            return storage
+    return 'csv'
+
+def storage_basename(filename):
+    '''
+=============================================
+Function to remove the storage extension from a file name, e.g.
+20240701_20241031_Sao_Paulo_level15.ssa.parquet -> 20240701_20241031_Sao_Paulo_level15.ssa
+=============================================
+'''
+    extension = STORAGE_EXTENSIONS[storage_format(filename)]
+    if extension == '':
+        return filename
+    return filename[:-len(extension)]
+
+def splitting_row_groups(df, maxrows=ROWGROUP_ROWS):
+    '''
+=============================================
+Function to split the rows of a DF in row groups: runs of consecutive rows
+of the same calendar month of globaltime, of at most maxrows rows (only
+maxrows when there is no globaltime column)
+
+Output:
+List of (first row, number of rows) of each row group
+=============================================
+'''
+    starts = [0]
+    if 'globaltime' in df.columns and pd.api.types.is_datetime64_any_dtype(df['globaltime']) and len(df) > 1:
+        times = df['globaltime']
+        months = (times.dt.year * 12 + times.dt.month).to_numpy(dtype=float, na_value=np.nan)
+        changes = np.flatnonzero(months[1:] != months[:-1]) + 1
+        starts = [0] + changes.tolist()
+    rowgroups = []
+    for first, last in zip(starts, starts[1:] + [len(df)]):
+        for i in range(first, last, maxrows):
+            rowgroups.append((i, min(maxrows, last - i)))
+    return rowgroups
+
+def saving_aeronet_data(df, filename, storage='parquet', compression='zstd', float_format='%.6f'):
+    '''
+=============================================
+Function to save an AERODOG dataframe (v01, v02 or v03)
+
+Input:
+df           , pandas DF  Data to save (the index is not saved)
+filename     , string     Path to the output file, without extension
+storage      , string     'parquet', 'feather' or 'csv'
+compression  , string     Compression used by parquet files (feather files are
+                          not compressed, so they can be memory-mapped)
+float_format , string     Format of the floats of csv files (default: 6 decimals,
+                          as the AERONET files)
+
+Output:
+Path to the file written (filename + extension of the storage format),
+with one row group per month (see splitting_row_groups) in parquet and
+feather files
+=============================================
+'''
+    if storage not in STORAGE_EXTENSIONS:
+        raise ValueError('saving_aeronet_data:: unknown storage format ' + str(storage))
+    filename = filename + STORAGE_EXTENSIONS[storage]
+    if storage in ['parquet', 'feather'] and len(df) > 0:
+        import pyarrow
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        if storage == 'parquet':
+            import pyarrow.parquet
+            writer = pyarrow.parquet.ParquetWriter(filename, table.schema, compression=compression)
+        else:
+            import pyarrow.ipc
+            writer = pyarrow.ipc.new_file(filename, table.schema, options=pyarrow.ipc.IpcWriteOptions(compression=None))
+        with writer:
+            for first, nrows in splitting_row_groups(df):
+                writer.write_table(table.slice(first, nrows))
+    elif storage == 'parquet':
+        df.to_parquet(filename, index=False, compression=compression)
+    elif storage == 'feather':
+        df.reset_index(drop=True).to_feather(filename, compression='uncompressed')
+    else:
+        df.to_csv(filename, float_format=float_format, index=False)
+    return filename
+
+def loading_aeronet_data(filename, columns=None, memory_map=True, float_precision=None):
+    '''
+=============================================
+Function to load an AERODOG dataframe (v01, v02 or v03) saved by
+saving_aeronet_data(). The format is found from the file extension.
+
+Input:
+filename        , string           Path to the file
+columns         , list of strings  Columns to read (default: all)
+memory_map      , boolean          Memory-map feather files instead of reading
+                                   them into memory
+float_precision , string           Float parser of csv files (pandas read_csv),
+                                   'round_trip' to read back exactly the floats
+                                   written with 17 significant digits
+
+Output:
+pandas DF, with globaltime as datetime64 (csv files are parsed again)
+=============================================
+'''
+    storage = storage_format(filename)
+    if storage == 'parquet':
+        df = pd.read_parquet(filename, columns=columns)
+    elif storage == 'feather':
+        import pyarrow.feather
+        table = pyarrow.feather.read_table(filename, columns=columns, memory_map=memory_map)
+        df = table.to_pandas()
+    else:
+        df = pd.read_csv(filename, usecols=columns, float_precision=float_precision)
+        if 'globaltime' in df.columns:
+            df['globaltime'] = pd.to_datetime(df['globaltime'], format='ISO8601')
+    return df
+
+def loading_aeronet_schema(filename):
+    '''
+=============================================
+Function to read the columns (and their types) of an AERODOG file without
+reading its data
+
+Output:
+Empty pandas DF with the columns of the file (for csv files, the types are
+found from the first 100 rows)
+=============================================
+'''
+    storage = storage_format(filename)
+    if storage == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(filename).empty_table().to_pandas()
+    elif storage == 'feather':
+        import pyarrow.ipc
+        with pyarrow.ipc.open_file(filename) as reader:
+            return reader.schema.empty_table().to_pandas()
+    return pd.read_csv(filename, nrows=100).iloc[:0]
+
+def timestamp_value(time, unit):
+    '''Function to change a time to the integer stored in arrow and parquet files for the time unit (s, ms, us or ns) of a column'''
+    return int(pd.Timestamp(time).as_unit(unit).asm8.view('int64'))
+
+def row_group_times(parquetfile, column='globaltime'):
+    '''
+=============================================
+Function to read the time range of each row group of a parquet file
+(pyarrow ParquetFile) from the minimum and maximum of the time column kept
+in the file, without reading the data
+
+Output:
+List with (first, last) of each row group, as integers in the time unit of
+the column (see timestamp_value), or None for a row group without
+statistics (it is always read)
+=============================================
+'''
+    metadata = parquetfile.metadata
+    position = [metadata.schema.column(i).path for i in range(metadata.num_columns)].index(column)
+    times = []
+    for i in range(metadata.num_row_groups):
+        statistics = metadata.row_group(i).column(position).statistics
+        if statistics is None or not statistics.has_min_max:
+            times.append(None)
+        else:
+            times.append((statistics.min_raw, statistics.max_raw))
+    return times
+
+def opening_window_reader(filename, site, ordered=False, chunkrows=100000):
+    '''
+=============================================
+Function to start reading the rows of one site of an AERODOG file in time
+windows (see loading_next_window), without holding the rest of the file in
+memory:
+  - parquet files: the time range of each row group is read from the file
+    statistics, and each window reads only the row groups that overlap it;
+  - feather files: the file is memory-mapped and the time range of each
+    record batch found once (only the pages of globaltime are touched), and
+    each window takes only the batches that overlap it;
+  - csv files: when the rows of the site are in time order (ordered), the
+    file is read once for all the windows, chunkrows rows at a time, and the
+    rows read after the end of a window are kept for the next one (the
+    windows must then come in order of start); otherwise every window reads
+    the whole file, chunkrows rows at a time.
+
+Output:
+The reader (dict, see closing_window_reader)
+=============================================
+'''
+    storage = storage_format(filename)
+    reader = {'filename': filename, 'site': site, 'storage': storage, 'chunkrows': chunkrows, 'file': None,
+              'source': None, 'times': None, 'unit': None, 'chunks': None, 'rows': [], 'empty': None,
+              'start': None, 'last': None, 'done': False}
+    if storage == 'parquet':
+        import pyarrow.parquet
+        reader['file'] = pyarrow.parquet.ParquetFile(filename)
+        reader['unit'] = reader['file'].schema_arrow.field('globaltime').type.unit
+        reader['times'] = row_group_times(reader['file'])
+    elif storage == 'feather':
+        import pyarrow
+        import pyarrow.compute as pc
+        import pyarrow.ipc
+        reader['source'] = pyarrow.memory_map(filename)
+        reader['file'] = pyarrow.ipc.open_file(reader['source'])
+        reader['unit'] = reader['file'].schema.field('globaltime').type.unit
+        reader['times'] = []
+        for i in range(reader['file'].num_record_batches):
+            times = pc.min_max(reader['file'].get_batch(i).column('globaltime').cast('int64'))
+            reader['times'].append((times['min'].as_py(), times['max'].as_py()) if times['min'].is_valid else (0, -1))
+    elif ordered:
+        reader['chunks'] = loading_aeronet_chunks(filename, chunkrows)
+    return reader
+
+def loading_next_window(reader, start, end):
+    '''
+=============================================
+Function to load the rows of the site of a reader (see opening_window_reader)
+in the time window [start, end)
+
+Output:
+pandas DF, with globaltime as datetime64
+=============================================
+'''
+    if reader['storage'] in ['parquet', 'feather']:
+        import pyarrow
+        import pyarrow.compute as pc
+        first, last = timestamp_value(start, reader['unit']), timestamp_value(end, reader['unit'])
+        selected = [i for i, times in enumerate(reader['times']) if times is None or (times[1] >= first and times[0] < last)]
+        if reader['storage'] == 'parquet':
+            table = reader['file'].read_row_groups(selected)
+        else:
+            table = pyarrow.Table.from_batches([reader['file'].get_batch(i) for i in selected], schema=reader['file'].schema)
+        times = table['globaltime']
+        mask = pc.and_(pc.equal(table['AERONET_Site'], reader['site']),
+                       pc.and_(pc.greater_equal(times, pyarrow.scalar(start, times.type)), pc.less(times, pyarrow.scalar(end, times.type))))
+        return table.filter(mask).to_pandas()
+
+    if reader['chunks'] is None:
+        chunks = []
+        for chunk in pd.read_csv(reader['filename'], chunksize=reader['chunkrows']):
+            chunk['globaltime'] = pd.to_datetime(chunk['globaltime'], format='ISO8601')
+            chunks.append(chunk[(chunk['AERONET_Site'] == reader['site']) & (chunk['globaltime'] >= start) & (chunk['globaltime'] < end)])
+        return pd.concat(chunks, axis=0, ignore_index=True)
+
+    if reader['start'] is not None and start < reader['start']:
+        raise ValueError('loading_next_window:: windows out of order in ' + reader['filename'])
+    reader['start'] = start
+    # the rows before start are not used by this window or the next ones
+    rows = [chunk[chunk['globaltime'] >= start] for chunk in reader['rows']]
+    # the rows are in time order: read until a row at or after the end of the window
+    while not reader['done'] and (reader['last'] is None or reader['last'] < end):
+        chunk = next(reader['chunks'], None)
+        if chunk is None:
+            reader['done'] = True
+            break
+        if reader['empty'] is None:
+            reader['empty'] = chunk.iloc[:0]
+        chunk = chunk[chunk['AERONET_Site'] == reader['site']]
+        if len(chunk) > 0:
+            reader['last'] = chunk['globaltime'].iloc[-1]
+            rows.append(chunk[chunk['globaltime'] >= start])
+    reader['rows'] = [chunk for chunk in rows if len(chunk) > 0]
+    window = [chunk[chunk['globaltime'] < end] for chunk in reader['rows']]
+    if len(window) == 0:
+        return reader['empty'] if reader['empty'] is not None else pd.DataFrame()
+    return pd.concat(window, axis=0, ignore_index=True)
+
+def closing_window_reader(reader):
+    '''Function to close the file of a reader opened by opening_window_reader'''
+    if reader['chunks'] is not None:
+        reader['chunks'].close()
+    if reader['source'] is not None:
+        reader['source'].close()
+    reader['file'], reader['rows'] = None, []
+
+def loading_aeronet_window(filename, site, start, end, chunkrows=100000):
+    '''
+=============================================
+Function to load the rows of one site in a time window [start, end) of an
+AERODOG file, without holding the rest of the file in memory (only the row
+groups of parquet and feather files that overlap the window are read, csv
+files are read chunkrows rows at a time, see opening_window_reader)
+
+Output:
+pandas DF, with globaltime as datetime64
+=============================================
+'''
+    reader = opening_window_reader(filename, site, chunkrows=chunkrows)
+    try:
+        return loading_next_window(reader, start, end)
+    finally:
+        closing_window_reader(reader)
+
+def loading_aeronet_chunks(filename, chunkrows=100000):
+    '''
+=============================================
+Function to read an AERODOG file in chunks of (about) chunkrows rows
+
+Output:
+Generator of pandas DF, with globaltime as datetime64
+=============================================
+'''
+    storage = storage_format(filename)
+    if storage == 'parquet':
+        import pyarrow.parquet
+        for batch in pyarrow.parquet.ParquetFile(filename).iter_batches(batch_size=chunkrows):
+            yield batch.to_pandas()
+    elif storage == 'feather':
+        import pyarrow.ipc
+        with pyarrow.memory_map(filename) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas()
+    else:
+        for chunk in pd.read_csv(filename, chunksize=chunkrows):
+            if 'globaltime' in chunk.columns:
+                chunk['globaltime'] = pd.to_datetime(chunk['globaltime'], format='ISO8601')
+            yield chunk
+
+def opening_chunk_writer(filename, storage='parquet', compression='zstd'):
+    '''
+=============================================
+Function to start writing an AERODOG file chunk by chunk (see
+writing_chunk and closing_chunk_writer), e.g. one row group per chunk in
+parquet files, so the whole file is never held in memory
+
+Input:
+filename    , string  Path to the output file, without extension
+storage     , string  'parquet', 'feather' or 'csv'
+compression , string  Compression used by parquet files (feather files are not
+                      compressed, see saving_aeronet_data)
+
+Output:
+The writer (dict)
+=============================================
+'''
+    if storage not in STORAGE_EXTENSIONS:
+        raise ValueError('opening_chunk_writer:: unknown storage format ' + str(storage))
+    return {'filename': filename + STORAGE_EXTENSIONS[storage], 'storage': storage, 'compression': compression,
+            'writer': None, 'schema': None, 'empty': None, 'rows': 0}
+
+def writing_chunk(writer, df):
+    '''Function to append a chunk (pandas DF, with the same columns as the first chunk) to a file opened by opening_chunk_writer'''
+    if len(df) == 0:
+        if writer['empty'] is None:
+            writer['empty'] = df
+        return
+    writer['rows'] += len(df)
+    if writer['storage'] == 'csv':
+        df.to_csv(writer['filename'], float_format="%.6f", index=False, mode='w' if writer['schema'] is None else 'a',
+                  header=writer['schema'] is None)
+        writer['schema'] = list(df.columns)
+        return
+    import pyarrow
+    if writer['schema'] is None:
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        writer['schema'] = table.schema
+        if writer['storage'] == 'parquet':
+            import pyarrow.parquet
+            writer['writer'] = pyarrow.parquet.ParquetWriter(writer['filename'], writer['schema'], compression=writer['compression'])
+        else:
+            import pyarrow.ipc
+            writer['writer'] = pyarrow.ipc.new_file(writer['filename'], writer['schema'],
+                                                    options=pyarrow.ipc.IpcWriteOptions(compression=None))
+    else:
+        table = pyarrow.Table.from_pandas(df[writer['schema'].names], schema=writer['schema'], preserve_index=False)
+    writer['writer'].write_table(table)
+
+def closing_chunk_writer(writer):
+    '''Function to finish a file written by writing_chunk (a file with no rows is written when all the chunks were empty). Returns the path of the file'''
+    if writer['writer'] is not None:
+        writer['writer'].close()
+    elif writer['schema'] is None:
+        empty = writer['empty'] if writer['empty'] is not None else pd.DataFrame()
+        saving_aeronet_data(empty, storage_basename(writer['filename']), writer['storage'], writer['compression'])
+    return writer['filename']
@@ -0,0 +1,185 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to run Module 2 (resample and merge) and Module 3 (optical products) in bounded chunks of data
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+In the streaming mode the data is processed one site and one time window
+(e.g. one year, YS, or one month, MS) at a time: the rows of that window are
+read from the v01 files of each product, resampled, merged and appended to
+the v02 file, so the memory used depends on the size of one window and not
+on the size of the archive. The v03 file is then calculated chunk by chunk
+from the v02 file.
+
+Each v01 file is read about once for all the windows of a site: in parquet
+and feather files only the row groups (one per month) of each window are
+read, and a csv file whose rows are in time order is read once, chunk by
+chunk, as the windows advance (see ads.opening_window_reader).
+
+The rows of a product are assigned to a window by the start of their resample
+bin (not by their own time), so a bin is never split between two windows and
+the result is the same as resampling the whole history. This needs average
+times with fixed steps (e.g. 15min, 1h, 1D, see adf.fixed_step).
+"""
+import os
+import pandas as pd
+import aerodog_function as adf
+import aerodog_storage as ads
+
+def grid_ceil(globaltime, avgtime, origin):
+    '''Start of the first resample bin (fixed avgtime, e.g. 15min) that starts at or after globaltime'''
+    step = pd.Timedelta(pd.tseries.frequencies.to_offset(avgtime).nanos, unit='ns')
+    return origin - ((origin - globaltime) // step) * step
+
+def scanning_product(inputdir, files, avgtime, window):
+    '''
+=============================================
+Function to find the sites and time windows of a product, reading only the
+AERONET_Site and globaltime columns of its v01 files (one file at a time)
+
+Input:
+inputdir , string           Path to folder where files are
+files    , list of strings  List of files to read from inputdir
+avgtime  , string           Resample time (fixed step, e.g. 15min)
+window   , string           Time window of the chunks (e.g. YS, MS)
+
+Output:
+dict with:
+  columns - the numeric columns of the product (averaged by the resample)
+  sites   - for each site: the origin of its resample bins (start of its
+            first day, as in pandas resample), the time range of each file
+            ({file: (first, last)}), the files whose rows of the site are in
+            time order ({file: boolean}) and the set of windows (start times)
+            with resample bins of the site
+=============================================
+'''
+    offset = pd.tseries.frequencies.to_offset(window)
+    schema = ads.loading_aeronet_schema(os.sep.join([inputdir, sorted(files)[0]]))
+    columns = [name for name in schema.columns if name not in ['AERONET_Site', 'globaltime']
+               and pd.api.types.is_numeric_dtype(schema[name])]
+
+    sites = {}
+    for afile in sorted(files):
+        times = ads.loading_aeronet_data(os.sep.join([inputdir, afile]), columns=['AERONET_Site', 'globaltime'])
+        for site, sitetimes in times.groupby('AERONET_Site', sort=False)['globaltime']:
+            entry = sites.setdefault(site, {'files': {}, 'ordered': {}, 'days': set()})
+            entry['files'][afile] = (sitetimes.min(), sitetimes.max())
+            entry['ordered'][afile] = sitetimes.is_monotonic_increasing
+            entry['days'].update(sitetimes.dt.normalize().unique())
+
+    for site, entry in sites.items():
+        entry['origin'] = min([first for first, last in entry['files'].values()]).normalize()
+        # the bins of the rows of a day start between the bin of its first and of its last instant
+        days = pd.DatetimeIndex(sorted(entry.pop('days')))
+        binstarts = set()
+        for instants in [days, days + pd.Timedelta(days=1) - pd.Timedelta(1, unit='ns')]:
+            binstarts.update(adf.bin_start(instants, avgtime, entry['origin']).normalize())
+        entry['windows'] = set([offset.rollback(day) for day in binstarts])
+    return {'columns': columns, 'sites': sites}
+
+def resampling_window(inputdir, scan, site, start, end, avgtime, margin=0, readers=None):
+    '''
+=============================================
+Function to resample the rows of one site whose resample bins start in the
+window [start, end) (extended by margin bins on both sides). With readers
+(a dict, empty for the first window of the site), the files are read by
+window readers kept in it for the next windows (see
+ads.opening_window_reader), so the windows must come in time order.
+
+Output:
+pandas DF with the same format as mining_aeronet_data(): index
+(AERONET_Site, globaltime) and the numeric columns of the product
+=============================================
+'''
+    empty = pd.DataFrame(columns=scan['columns'], dtype=float,
+                         index=pd.MultiIndex.from_arrays([pd.Index([], dtype=object), pd.DatetimeIndex([])], names=['AERONET_Site', 'globaltime']))
+    if site not in scan['sites']:
+        return empty
+    entry = scan['sites'][site]
+    step = pd.Timedelta(pd.tseries.frequencies.to_offset(avgtime).nanos, unit='ns')
+    first = grid_ceil(start - margin*step, avgtime, entry['origin'])
+    last = grid_ceil(end + margin*step, avgtime, entry['origin'])
+
+    aeronetfile = []
+    for afile, (filefirst, filelast) in sorted(entry['files'].items()):
+        if filelast >= first and filefirst < last:
+            if readers is None:
+                aeronetfile.append(ads.loading_aeronet_window(os.sep.join([inputdir, afile]), site, first, last))
+                continue
+            if afile not in readers:
+                readers[afile] = ads.opening_window_reader(os.sep.join([inputdir, afile]), site, entry['ordered'][afile])
+            aeronetfile.append(ads.loading_next_window(readers[afile], first, last))
+    aeronetfile = [rows for rows in aeronetfile if len(rows) > 0]
+    if len(aeronetfile) == 0:
+        return empty
+    aeronetfile = pd.concat(aeronetfile, axis=0).sort_values('globaltime', kind='stable')
+
+    if isinstance(pd.tseries.frequencies.to_offset(avgtime), pd.offsets.Tick):
+        sitemean = adf.globaltime_index(aeronetfile).resample(avgtime, origin=entry['origin'])
+    else:
+        # daily bins always start at midnight
+        sitemean = adf.globaltime_index(aeronetfile).resample(avgtime)
+    sitemean = sitemean.mean(numeric_only=True).dropna(how='all')
+    sitemean.index = pd.MultiIndex.from_product([[site], sitemean.index], names=['AERONET_Site', 'globaltime'])
+    return sitemean.reindex(columns=scan['columns'])
+
+def streaming_aeronet_data(products, joins, avgtimes, window, savefilename, storage, columns=None):
+    '''
+=============================================
+Function to resample and merge the products (Module 2) one site and one time
+window at a time, appending each merged chunk to the v02 file
+
+Input:
+products     , list of tuples   (inputdir, files) of each product
+joins        , list of strings  Join policy of each product (see adf.merging_aeronet_data)
+avgtimes     , list of strings  Resample time of each product (fixed steps)
+window       , string           Time window of the chunks (e.g. YS, MS)
+savefilename , string           Path to the v02 file, without extension
+storage      , string           Storage format of the v02 file
+columns      , dict             Column names to change after the merge
+
+Output:
+Path to the v02 file and number of rows written
+=============================================
+'''
+    for avgtime in avgtimes:
+        if not adf.fixed_step(avgtime):
+            raise ValueError('streaming_aeronet_data:: average time ' + avgtime + ' is not a fixed step')
+    offset = pd.tseries.frequencies.to_offset(window)
+    scans = [scanning_product(inputdir, files, avgtime, window) for (inputdir, files), avgtime in zip(products, avgtimes)]
+    sites = sorted(set().union(*[scan['sites'] for scan in scans]))
+
+    writer = ads.opening_chunk_writer(savefilename, storage)
+    for site in sites:
+        windows = sorted(set().union(*[scan['sites'][site]['windows'] for scan in scans if site in scan['sites']]))
+        print('Site', site, '-', len(windows), 'window(s) of', window)
+        # the readers of the files of each product, kept from one window to the next
+        readers = [{} for product in products]
+        try:
+            for start in windows:
+                chunks = []
+                for (inputdir, files), scan, join, avgtime, productreaders in zip(products, scans, joins, avgtimes, readers):
+                    # asof products also need the bins next to the window (within one avgtime)
+                    margin = 1 if join == 'asof' else 0
+                    chunks.append(resampling_window(inputdir, scan, site, start, start + offset, avgtime, margin, productreaders))
+                ads.writing_chunk(writer, adf.merging_aeronet_data(chunks, joins, avgtimes, columns))
+        finally:
+            for productreaders in readers:
+                for reader in productreaders.values():
+                    ads.closing_window_reader(reader)
+    return ads.closing_chunk_writer(writer), writer['rows']
+
+def streaming_products(v02file, savefilename, products, storage, chunkrows=100000):
+    '''
+=============================================
+Function to calculate the optical products (Module 3) chunk by chunk, from
+the v02 file to the v03 file (the products of a row only depend on that row)
+
+Output:
+Path to the v03 file and number of rows written
+=============================================
+'''
+    writer = ads.opening_chunk_writer(savefilename, storage)
+    for chunk in ads.loading_aeronet_chunks(v02file, chunkrows):
+        ads.writing_chunk(writer, adf.optical_products(chunk, products))
+    return ads.closing_chunk_writer(writer), writer['rows']
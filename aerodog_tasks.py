@@ -0,0 +1,361 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Functions to run AERODOG tasks (e.g. organizing_aeronet_data, mining_aeronet_data) in parallel
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+
+A task is a tuple (function, args) where function is a module-level function
+(so it can be sent to a worker process) and args is a tuple of arguments.
+
+A task graph is a dict {name: (function, args, dependencies)}: a task runs
+after all the tasks named in its dependencies, and receives their results
+after its own args (see running_graph).
+
+When Module 1 runs in one process, its tasks run as a pipeline (see
+pipelining_organize): the next raw files are read on a background thread
+and the v01 files are written on another one while the current file is
+cleaned, with bounded queues so that at most a few files are in memory.
+
+The worker processes do not see the configuration set in the main process
+after its start (e.g. the command line options, the cache folder or the
+profiling): with the spawn start method (the default on macOS and Windows)
+they import the modules again. The configuration is sent to each worker
+explicitly, as the arguments of the run initializer of configuring_workers,
+which every pool runs in each worker before its first task.
+"""
+import io
+import os
+import queue
+import multiprocessing
+import threading
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import aerodog_function as adf
+import aerodog_storage as ads
+import aerodog_profiling as apf
+
+# function (and its arguments) run by each worker process before its first task, to set the
+# configuration of the run in the worker, and start method of the worker processes (see configuring_workers)
+WORKERS = {'initializer': None, 'initargs': (), 'context': None}
+
+def configuring_workers(initializer=None, initargs=(), context=None):
+    '''
+=============================================
+Function to set the run initializer of the worker processes and their start
+method, for all the pools of running_tasks and running_graph
+
+Input:
+initializer , function  Module-level function that sets the configuration of
+                        the run in a worker (e.g. the cache and profiling
+                        settings), run by each worker before its first task
+initargs    , tuple     Arguments of the initializer (sent to the workers, so
+                        they must be picklable)
+context     , string    Start method of the worker processes: 'fork', 'spawn'
+                        or 'forkserver' (default: the one of the platform)
+=============================================
+'''
+    if context is not None and context not in multiprocessing.get_all_start_methods():
+        raise ValueError('configuring_workers:: unknown start method ' + str(context))
+    WORKERS.update({'initializer': initializer, 'initargs': tuple(initargs), 'context': context})
+
+def initializing_worker(runinitializer, runinitargs, initializer, initargs):
+    '''Function run by each worker process before its first task: the run initializer (see configuring_workers), then the initializer of the pool'''
+    if runinitializer is not None:
+        runinitializer(*runinitargs)
+    if initializer is not None:
+        initializer(*initargs)
+
+def opening_pool(workers, initializer=None, initargs=()):
+    '''Function to start a pool of worker processes that run the run initializer (see configuring_workers) and then initializer(*initargs) before their first task'''
+    context = None if WORKERS['context'] is None else multiprocessing.get_context(WORKERS['context'])
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializing_worker,
+                               initargs=(WORKERS['initializer'], WORKERS['initargs'], initializer, initargs))
+
+def organizing_task(*args):
+    '''
+=============================================
+Function to run adf.organizing_aeronet_data() as a task. The v01 file is
+already on disk when it returns, so only the number of rows organized and
+the QC report (rows removed by each rule) are sent back to the main process
+(not the whole DF)
+=============================================
+'''
+    f = apf.measuring_call('organizing_aeronet_data', adf.organizing_aeronet_data, *args)
+    return len(f), f.attrs.get('quality_control')
+
+def prefetching(tasks, depth=2):
+    '''
+=============================================
+Function to run a list of tasks (function, args), in order, on a background
+thread, at most depth results ahead of the one being used (the thread waits
+while the queue is full, so at most depth results are held in memory)
+
+Output:
+Generator with the result of each task, in the order of the tasks (an
+error of a task is raised when its result is reached)
+=============================================
+'''
+    results = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def reading():
+        for function, args in tasks:
+            try:
+                item = (function(*args), None)
+            except Exception as error:
+                item = (None, error)
+            # wait for room in the queue, unless the generator was closed
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set() or item[1] is not None:
+                return
+
+    thread = threading.Thread(target=reading, daemon=True)
+    thread.start()
+    try:
+        for task in tasks:
+            result, error = results.get()
+            if error is not None:
+                raise error
+            yield result
+    finally:
+        stop.set()
+        thread.join()
+
+def opening_writer(depth=2):
+    '''
+=============================================
+Function to start a background writer thread (see writing_later and
+closing_writer). At most depth writes wait in its queue: writing_later
+blocks when the queue is full, so the data waiting to be written is bounded.
+
+Output:
+The writer (dict)
+=============================================
+'''
+    writer = {'queue': queue.Queue(maxsize=max(depth, 1)), 'errors': []}
+
+    def writing():
+        while True:
+            item = writer['queue'].get()
+            if item is None:
+                return
+            function, args = item
+            try:
+                function(*args)
+            except Exception as error:
+                writer['errors'].append(error)
+
+    writer['thread'] = threading.Thread(target=writing, daemon=True)
+    writer['thread'].start()
+    return writer
+
+def writing_later(writer, function, *args):
+    '''Function to queue the call function(*args) (e.g. ads.saving_aeronet_data) on a writer opened by opening_writer'''
+    if len(writer['errors']) > 0:
+        raise writer['errors'][0]
+    writer['queue'].put((function, args))
+
+def closing_writer(writer, raising=True):
+    '''Function to wait for the writes queued on a writer, stop its thread and raise the first error of the writes (only printed with raising=False, e.g. when another error is being raised)'''
+    writer['queue'].put(None)
+    writer['thread'].join()
+    if len(writer['errors']) > 0:
+        if raising:
+            raise writer['errors'][0]
+        print('closing_writer:: error in a queued write:', repr(writer['errors'][0]))
+
+def pipelining_organize(tasks, prefetch=2):
+    '''
+=============================================
+Function to run the tasks of Module 1 (organizing_task) in this process as
+a pipeline: the raw files are read (adf.reading_aeronet_columns) up to
+prefetch files ahead on a background thread, and the v01 files are written
+on a writer thread (at most prefetch files waiting), while the current file
+is checked and organized here. The results are the same as running the
+tasks one after the other.
+
+Input:
+tasks    , list of tuples  Tasks (organizing_task, args of adf.organizing_aeronet_data)
+prefetch , integer         Number of raw files read ahead and of v01 files
+                           waiting to be written
+
+Output:
+Generator with the result of each task (as organizing_task), in the order
+of the tasks. All the v01 files are written when the generator ends.
+=============================================
+'''
+    reads = []
+    for function, args in tasks:
+        rootdir, rawfile, filetype, use_cols, rowstoskip, rawlevel, rawdatadir = args[:7]
+        reads.append((adf.reading_aeronet_columns, (os.sep.join([rootdir, rawdatadir, rawfile]), use_cols, rowstoskip)))
+    writer = opening_writer(prefetch)
+
+    def saving(f, filename, storage):
+        # a shallow copy: the DF returned to the caller can change (e.g. its attrs) while it waits
+        writing_later(writer, ads.saving_aeronet_data, f.copy(deep=False), filename, storage)
+
+    try:
+        for (function, args), raw in zip(tasks, prefetching(reads, prefetch)):
+            f = apf.measuring_call('organizing_aeronet_data', adf.organizing_aeronet_data, *args, raw, saving)
+            yield len(f), f.attrs.get('quality_control')
+    except GeneratorExit:
+        # the caller stopped early: the files queued are still written (and their errors raised)
+        closing_writer(writer)
+        raise
+    except BaseException:
+        # the error of the organize step is raised, not an error of the writes queued before it
+        closing_writer(writer, raising=False)
+        raise
+    closing_writer(writer)
+
+def running_task(task):
+    '''
+=============================================
+Function to run one task in a worker process. The messages printed by the
+task are captured and returned with its result, so the main process can
+print them in the same order as a serial run, together with the records of
+the calls measured by the task (see aerodog_profiling.py).
+=============================================
+'''
+    function, args = task
+    log = io.StringIO()
+    start = len(apf.RECORDS)
+    with contextlib.redirect_stdout(log):
+        result = function(*args)
+    return result, log.getvalue(), apf.taking_records(start)
+
+def running_tasks(tasks, workers=1, initializer=None, initargs=()):
+    '''
+=============================================
+Function to run a list of tasks, serially (workers=1) or on a pool of
+worker processes
+
+Input:
+tasks       , list of tuples  Tasks (function, args)
+workers     , integer         Number of worker processes
+initializer , function        Function run once by each worker process before its
+                              first task (e.g. to attach shared data), optional;
+                              it runs after the run initializer (see
+                              configuring_workers)
+initargs    , tuple           Arguments of the initializer
+
+Output:
+Generator with the result of each task, in the order of the tasks. The
+messages printed by each task are printed before its result is returned.
+=============================================
+'''
+    if workers <= 1 or len(tasks) <= 1:
+        for function, args in tasks:
+            yield function(*args)
+        return
+    with opening_pool(min(workers, len(tasks)), initializer, initargs) as executor:
+        for result, log, records in executor.map(running_task, tasks):
+            print(log, end='')
+            apf.RECORDS.extend(records)
+            yield result
+
+def sorting_graph(graph):
+    '''
+=============================================
+Function to sort the tasks of a task graph so that every task comes after
+its dependencies (tasks without dependencies keep the order of the graph)
+
+Output:
+List of task names, and dict with the depth of each task (number of tasks
+in its longest chain of dependencies)
+=============================================
+'''
+    for name, (function, args, dependencies) in graph.items():
+        for dependency in dependencies:
+            if dependency not in graph:
+                raise ValueError('sorting_graph:: unknown dependency ' + str(dependency) + ' of task ' + str(name))
+    order, depth = [], {}
+    while len(order) < len(graph):
+        ready = [name for name, (function, args, dependencies) in graph.items()
+                 if name not in depth and all([dependency in depth for dependency in dependencies])]
+        if len(ready) == 0:
+            raise ValueError('sorting_graph:: the dependencies of the tasks have a cycle')
+        for name in ready:
+            depth[name] = 1 + max([depth[dependency] for dependency in graph[name][2]], default=-1)
+            order.append(name)
+    return order, depth
+
+def running_graph(graph, workers=1, executor='process'):
+    '''
+=============================================
+Function to run a task graph, serially (workers=1) or on a pool of worker
+processes or threads. A task is started as soon as all its dependencies
+are done, and each task receives the results of its dependencies after its
+own args, in the order of the dependencies. When several tasks are ready,
+the deepest ones (e.g. the graphics of a site before the organization of
+the next site) run first, so the results of each site are released early.
+
+Input:
+graph    , dict     Tasks {name: (function, args, dependencies)}
+workers  , integer  Number of tasks running at the same time
+executor , string   'process' (functions must be module-level, the messages
+                    of each task are printed when it finishes) or 'thread'
+                    (for tasks that release the GIL or wait on the disk)
+
+Output:
+dict with the results of the tasks that no other task depends on (the
+results of the other tasks are released once their dependents are done)
+=============================================
+'''
+    if executor not in ['process', 'thread']:
+        raise ValueError('running_graph:: unknown executor ' + str(executor))
+    order, depth = sorting_graph(graph)
+    dependents = {name: 0 for name in graph}
+    for name, (function, args, dependencies) in graph.items():
+        for dependency in dependencies:
+            dependents[dependency] += 1
+
+    results = {}
+    pending = sorted(order, key=lambda name: -depth[name])
+    running = {}
+
+    def finishing(name, result):
+        results[name] = result
+        for dependency in graph[name][2]:
+            dependents[dependency] -= 1
+            if dependents[dependency] == 0:
+                del results[dependency]
+
+    def starting():
+        ready = [name for name in pending if all([dependency in results for dependency in graph[name][2]])]
+        ready = ready[:max(workers, 1) - len(running)]
+        for name in ready:
+            pending.remove(name)
+        return [(name, graph[name][0], tuple(graph[name][1]) + tuple([results[dependency] for dependency in graph[name][2]]))
+                for name in ready]
+
+    if workers <= 1:
+        while len(pending) > 0:
+            for name, function, args in starting():
+                finishing(name, function(*args))
+        return results
+
+    # the threads share the configuration of this process, the processes get it from the run initializer
+    with (opening_pool(workers) if executor == 'process' else ThreadPoolExecutor(max_workers=workers)) as tasks:
+        while len(pending) > 0 or len(running) > 0:
+            for name, function, args in starting():
+                if executor == 'process':
+                    running[tasks.submit(running_task, (function, args))] = name
+                else:
+                    running[tasks.submit(function, *args)] = name
+            done, notdone = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if executor == 'process':
+                    result, log, records = future.result()
+                    print(log, end='')
+                    apf.RECORDS.extend(records)
+                else:
+                    result = future.result()
+                finishing(name, result)
+    return results
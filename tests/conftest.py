@@ -0,0 +1,102 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Shared fixtures of the AERODOG tests: the Sao Paulo sample (00-rawdata/Sao_Paulo_2024_2024, 360 rows)
+and synthetic organized (v01) rows
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOTDIR)
+
+import aerodog_function as adf
+
+SAMPLE_DIR = os.sep.join([ROOTDIR, '00-rawdata', 'Sao_Paulo_2024_2024'])
+
+def reading_sample(filetype, usecols=None):
+    '''Function to read the sample file of a product (e.g. ssa) as it is downloaded'''
+    files = adf.reading_aeronet_data(ROOTDIR, filetype, os.sep.join(['00-rawdata', 'Sao_Paulo_2024_2024']))
+    return pd.read_csv(os.sep.join([SAMPLE_DIR, files[0]]), skiprows=6, usecols=usecols)
+
+@pytest.fixture(scope='session')
+def sample_dates():
+    '''Date(dd:mm:yyyy) and Time(hh:mm:ss) columns of the sample ssa file'''
+    return reading_sample('ssa', usecols=['AERONET_Site', 'Date(dd:mm:yyyy)', 'Time(hh:mm:ss)'])
+
+@pytest.fixture(scope='session')
+def sample_optical():
+    '''
+=============================================
+Frame with the columns used by optical_products(), from the SSA and phase
+function files of the sample. The sample has no directsun file, so the AOD
+and AE columns are filled with (seeded) random values
+=============================================
+'''
+    rename = {}
+    for wavelength in [440, 675, 870, 1020]:
+        rename['Single_Scattering_Albedo[%dnm]' % wavelength] = 'SSA_%dnm' % wavelength
+        rename['180.000000[%dnm]' % wavelength] = 'pfn180_%dnm' % wavelength
+    frames = [reading_sample(filetype, usecols=lambda name: name in rename).rename(columns=rename) for filetype in ['ssa', 'pfn']]
+    f = pd.concat(frames, axis=1)
+    rng = np.random.default_rng(0)
+    for wavelength in [340, 380, 440, 500, 675]:
+        f['AOD_%dnm' % wavelength] = rng.uniform(0.05, 1.5, len(f))
+    f['AE_440_675nm'] = rng.uniform(0.2, 2., len(f))
+    f['AE_340_440nm'] = rng.uniform(0.2, 2., len(f))
+    return f
+
+def synthetic_rows(sites=('Sao_Paulo',), columns=('AOD_500nm',), start='2024-07-01', rows=None, months=None,
+                   step=15., jitter=0., seed=0, low=0.01, high=2., nan=0.):
+    '''
+=============================================
+Function to build organized (v01) rows of some sites with (seeded) random
+values, rounded to 6 decimals as in the AERONET files
+
+Input:
+sites   , list of strings  AERONET_Site of each block of rows
+columns , list of strings  Columns of random values
+start   , timestamp        Time of the first row of each site
+rows    , integer          Rows per site (or months)
+months  , integer          Months of rows per site, from start
+step    , float            Minutes between the rows
+jitter  , float            The steps are random in (1 - jitter, 1 + jitter)*step
+                           (rounded to the second), 0 for regular steps
+seed    , integer          Seed of the random values
+low     , float            Lowest random value
+high    , float            Highest random value
+nan     , float            Fraction of NaN values
+
+Output:
+pandas DF with AERONET_Site, globaltime and the columns, by site and time
+=============================================
+'''
+    rng = np.random.default_rng(seed)
+    if rows is None:
+        rows = int(months*30.5*24*60/step)
+    frames = []
+    for site in sites:
+        if jitter > 0:
+            minutes = np.cumsum(rng.uniform((1. - jitter)*step, (1. + jitter)*step, rows))
+            minutes -= minutes[0]
+            times = pd.Timestamp(start) + pd.to_timedelta(minutes, unit='min').round('s')
+        else:
+            times = pd.date_range(start, periods=rows, freq=pd.Timedelta(minutes=step))
+        f = pd.DataFrame({'AERONET_Site': site, 'globaltime': times})
+        for name in columns:
+            values = rng.uniform(low, high, rows).round(6)
+            values[rng.uniform(size=rows) < nan] = np.nan
+            f[name] = values
+        if months is not None:
+            f = f[f['globaltime'] < pd.Timestamp(start) + pd.DateOffset(months=months)]
+        frames.append(f)
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+@pytest.fixture(scope='session')
+def synthetic_frame():
+    '''Builder of synthetic organized (v01) rows, synthetic_frame(sites=..., columns=..., rows=... or months=..., step=..., seed=...), see synthetic_rows'''
+    return synthetic_rows
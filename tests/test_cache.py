@@ -0,0 +1,45 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the cache of results (aerodog_cache.py): keys, size of the cache and optical products on a miss and on a hit
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import os
+import pandas as pd
+import aerodog_cache as adc
+import aerodog_function as adf
+
+def test_registry_identity():
+    registry = {'A': {'function': adf.optical_products, 'inputs': ['x'], 'expression': 'x*2'}}
+    changed = {'A': {'function': adf.optical_products, 'inputs': ['x'], 'expression': 'x*3'}}
+    assert adc.registry_identity(registry) == adc.registry_identity(dict(registry))
+    assert adc.registry_identity(registry) != adc.registry_identity(changed)
+
+def test_function_identity_module():
+    # the identity covers the source of the module (e.g. the helpers of the function)
+    adc.SOURCE_HASHES['aerodog_function'] = 'changed'
+    try:
+        changed = adc.function_identity(adf.mining_aeronet_data)
+    finally:
+        del adc.SOURCE_HASHES['aerodog_function']
+    assert changed != adc.function_identity(adf.mining_aeronet_data)
+
+def test_cached_call(tmp_path, monkeypatch, sample_optical):
+    adc.configuring_cache(str(tmp_path), 10**9)
+    scans = []
+    sizing = adc.sizing_cache
+    monkeypatch.setattr(adc, 'sizing_cache', lambda cachedir: scans.append(cachedir) or sizing(cachedir))
+    try:
+        df = sample_optical.copy()
+        columns = list(df.columns)
+        params = {'registry': adc.registry_identity(adf.OPTICAL_PRODUCTS)}
+        miss = adc.cached_call(adf.optical_products, [adc.hashing_frame(df)], params, df)
+        assert list(df.columns) == columns
+        hit = adc.cached_call(adf.optical_products, [adc.hashing_frame(df)], params, df)
+        pd.testing.assert_frame_equal(miss, hit)
+        adc.cached_call(adf.optical_products, [adc.hashing_frame(df)], dict(params, other=1), df)
+        assert len(scans) == 1
+        files = [os.path.join(root, name) for root, dirs, names in os.walk(tmp_path) for name in names if name.endswith('.pkl')]
+        assert adc.CACHE['bytes'] == sum([os.path.getsize(name) for name in files])
+    finally:
+        adc.configuring_cache(None)
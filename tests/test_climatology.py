@@ -0,0 +1,48 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the climatology of the v03 data (adf.summarizing_aeronet_data): statistics of each site and of all the sites together
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import numpy as np
+import pandas as pd
+import aerodog_function as adf
+
+def one_site(synthetic_frame):
+    '''Two years of daily AOD at one site, with some NaN values'''
+    return synthetic_frame(start='2023-01-01 12:00', rows=730, step=24*60., nan=0.1)
+
+def two_sites(synthetic_frame):
+    '''Two sites, the second one starting later and with larger values'''
+    other = synthetic_frame(sites=('Other_Site',), start='2023-06-15 12:00', rows=730, step=24*60., seed=1, low=1., high=3., nan=0.1)
+    return pd.concat([one_site(synthetic_frame), other], ignore_index=True)
+
+def checking_month(climatology, site, values):
+    summary = climatology[(climatology['AERONET_Site'] == site) & (climatology['period'] == 'month')
+                          & (climatology['variable'] == 'AOD_500nm') & (climatology['code'] == 1)].iloc[0]
+    values = values[~np.isnan(values)]
+    assert summary['count'] == len(values)
+    np.testing.assert_allclose([summary['q1'], summary['median'], summary['q3'], summary['mean']],
+                               list(np.percentile(values, [25, 50, 75])) + [values.mean()], rtol=1e-12)
+
+def test_summarizing_one_site(synthetic_frame):
+    df = one_site(synthetic_frame)
+    climatology, fliers = adf.summarizing_aeronet_data(df, ['AOD_500nm'])
+    assert adf.ALL_SITES not in set(climatology['AERONET_Site'])
+    january = df['globaltime'].dt.month == 1
+    checking_month(climatology, 'Sao_Paulo', df.loc[january, 'AOD_500nm'].to_numpy(dtype=float))
+
+def test_summarizing_all_sites(synthetic_frame):
+    df = two_sites(synthetic_frame)
+    climatology, fliers = adf.summarizing_aeronet_data(df, ['AOD_500nm'])
+    january = df['globaltime'].dt.month == 1
+    for site in df['AERONET_Site'].unique():
+        checking_month(climatology, site, df.loc[january & (df['AERONET_Site'] == site), 'AOD_500nm'].to_numpy(dtype=float))
+    checking_month(climatology, adf.ALL_SITES, df.loc[january, 'AOD_500nm'].to_numpy(dtype=float))
+    pooled = climatology[climatology['AERONET_Site'] == adf.ALL_SITES]
+    assert (pooled['first'] == df['globaltime'].min()).all() and (pooled['last'] == df['globaltime'].max()).all()
+
+def test_boxplotfunc(synthetic_frame):
+    df = two_sites(synthetic_frame)
+    for expected, result in zip(adf.summarizing_aeronet_data(df), adf.boxplotfunc(df)):
+        pd.testing.assert_frame_equal(expected, result)
@@ -0,0 +1,47 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the decimation of the temporal evolution graphics (agf.lttb_indices and agf.minmax_indices)
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import numpy as np
+import pytest
+
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+pytest.importorskip('seaborn')
+import aerodog_graphics_function as agf
+
+def series(n=10000, seed=0):
+    '''Irregular times (as float) and random values'''
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.uniform(1., 20., n)), rng.normal(0., 1., n)
+
+@pytest.mark.parametrize('npoints', [3, 10, 500])
+def test_lttb_indices(npoints):
+    xdata, ydata = series()
+    selected = agf.lttb_indices(xdata, ydata, npoints)
+    assert len(selected) == npoints
+    assert np.all(np.diff(selected) > 0)
+    assert selected[0] == 0 and selected[-1] == len(xdata) - 1
+
+@pytest.mark.parametrize('npoints', [2, 10, 500])
+def test_minmax_indices(npoints):
+    xdata, ydata = series()
+    selected = agf.minmax_indices(xdata, ydata, npoints)
+    assert np.all(np.diff(selected) > 0)
+    assert selected[0] == 0 and selected[-1] == len(xdata) - 1
+    # the minimum and the maximum of each bucket of equal time width are kept
+    nbuckets = npoints//2
+    bucket = np.floor((xdata - xdata[0])/(xdata[-1] - xdata[0])*nbuckets).clip(0, nbuckets - 1).astype(int)
+    assert len(selected) <= 2*nbuckets + 2
+    for code in range(nbuckets):
+        rows = np.flatnonzero(bucket == code)
+        assert rows[np.argmin(ydata[rows])] in selected
+        assert rows[np.argmax(ydata[rows])] in selected
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+@pytest.mark.parametrize('n', [1, 50, 100])
+def test_short_series_unchanged(method, n):
+    xdata, ydata = series(n)
+    np.testing.assert_array_equal(agf.DECIMATION_METHODS[method](xdata, ydata, 100), np.arange(n))
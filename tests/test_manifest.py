@@ -0,0 +1,55 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the manifest of the organized files (aerodog_manifest.py): when a raw file is skipped or organized again
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import os
+import aerodog_manifest as adm
+
+def test_checking_manifest(tmp_path, monkeypatch):
+    rawfile, outputfile = str(tmp_path / 'site.lev15'), str(tmp_path / 'site.lev15.v01')
+    with open(rawfile, 'w') as afile:
+        afile.write('AERONET_Site,AOD_500nm\nSao_Paulo,0.1\n')
+    with open(outputfile, 'w') as afile:
+        afile.write('v01')
+    params = adm.organizing_params('directsun', ['AERONET_Site', 3], 6, 15, 'parquet')
+    manifest = {}
+    adm.updating_manifest(manifest, rawfile, params, outputfile)
+    adm.writing_manifest(str(tmp_path), manifest)
+    manifest = adm.reading_manifest(str(tmp_path))
+    hashes = []
+    hashing = adm.hashing_file
+    monkeypatch.setattr(adm, 'hashing_file', lambda filename: hashes.append(filename) or hashing(filename))
+
+    # nothing changed: skipped without reading the raw file
+    assert adm.checking_manifest(manifest, rawfile, params, outputfile)
+    assert hashes == []
+
+    # same size and content, new modification time (e.g. downloaded again): hashed once, skipped, new time recorded
+    mtime = os.stat(rawfile).st_mtime_ns + 10**9
+    os.utime(rawfile, ns=(mtime, mtime))
+    assert adm.checking_manifest(manifest, rawfile, params, outputfile)
+    assert hashes == [rawfile]
+    assert manifest[os.path.basename(rawfile)]['mtime_ns'] == mtime
+    assert adm.checking_manifest(manifest, rawfile, params, outputfile)
+    assert hashes == [rawfile]
+
+    # same size, new content and time: organized again
+    with open(rawfile, 'w') as afile:
+        afile.write('AERONET_Site,AOD_500nm\nSao_Paulo,0.2\n')
+    os.utime(rawfile, ns=(mtime + 10**9, mtime + 10**9))
+    assert not adm.checking_manifest(manifest, rawfile, params, outputfile)
+    adm.updating_manifest(manifest, rawfile, params, outputfile)
+    assert adm.checking_manifest(manifest, rawfile, params, outputfile)
+
+    # other parameters (level, compact mode, QC rules): organized again
+    for changed in [adm.organizing_params('directsun', ['AERONET_Site', 3], 6, 20, 'parquet'),
+                    adm.organizing_params('directsun', ['AERONET_Site', 3], 6, 15, 'parquet', compact=True),
+                    adm.organizing_params('directsun', ['AERONET_Site', 3], 6, 15, 'parquet',
+                                          qcrules=[{'column': '*', 'sentinels': [-999.], 'range': None, 'required': False}])]:
+        assert not adm.checking_manifest(manifest, rawfile, changed, outputfile)
+
+    # the v01 file is gone: organized again
+    os.remove(outputfile)
+    assert not adm.checking_manifest(manifest, rawfile, params, outputfile)
@@ -0,0 +1,31 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the incremental resampling of the v01 files (adf.mining_aeronet_data_incremental)
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import os
+import pandas as pd
+import pytest
+import aerodog_function as adf
+import aerodog_storage as ads
+
+@pytest.mark.parametrize('storage', ['parquet', 'csv'])
+@pytest.mark.parametrize('avgtime', ['15min', '7min', '1h', '1D'])
+def test_incremental_matches_full(tmp_path, storage, avgtime, synthetic_frame):
+    if storage == 'parquet':
+        pytest.importorskip('pyarrow')
+    inputdir, statedir = str(tmp_path / 'v01'), str(tmp_path / 'state')
+    os.makedirs(inputdir)
+    # two sites, a measurement every 1 to 20 minutes
+    f = synthetic_frame(sites=('Sao_Paulo', 'Manaus'), columns=('AOD_500nm', 'AE_440_675nm'), start='2024-07-01 10:00',
+                        rows=3000, step=10.5, jitter=0.9)
+    frames = [rows.reset_index(drop=True) for site, rows in f.groupby('AERONET_Site', sort=False)]
+    files = []
+    # first run with part of the rows, then the same files with rows appended
+    for cut in [1000, 2200, 3000]:
+        files = [os.path.basename(ads.saving_aeronet_data(f.iloc[:cut], os.sep.join([inputdir, 'site%d.lev15' % i]), storage))
+                 for i, f in enumerate(frames)]
+        incremental = adf.mining_aeronet_data(inputdir, files, avgtime, statedir, storage)
+    full = adf.mining_aeronet_data(inputdir, files, avgtime)
+    pd.testing.assert_frame_equal(incremental, full, check_exact=True, check_freq=False)
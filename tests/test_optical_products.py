@@ -0,0 +1,58 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Golden tests of the vectorized globaltime_column and optical_products against the per-row functions
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import aerodog_function as adf
+
+def test_globaltime_column(sample_dates):
+    rowwise = pd.to_datetime(sample_dates.apply(adf.globaltime_function, axis=1), format='%Y-%m-%d %H:%M:%S')
+    vectorized = adf.globaltime_column(sample_dates)
+    assert len(vectorized) == 360
+    assert pd.api.types.is_datetime64_any_dtype(vectorized)
+    np.testing.assert_array_equal(vectorized.to_numpy(), rowwise.to_numpy())
+
+def rowwise_products(f):
+    '''The optical products of f computed row by row (df.apply(fn, axis=1)), as before optical_products'''
+    rowwise = f.copy()
+    for name in adf.resolving_products(adf.OPTICAL_PRODUCTS, f.columns):
+        rowwise[name] = rowwise.apply(adf.OPTICAL_PRODUCTS[name]['function'], axis=1)
+    return rowwise
+
+@pytest.mark.parametrize('engine', ['numpy', 'numexpr'])
+def test_optical_products(sample_optical, engine):
+    if engine == 'numexpr':
+        pytest.importorskip('numexpr')
+    rowwise = rowwise_products(sample_optical)
+    columnar = adf.optical_products(sample_optical.copy(), engine=engine)
+    for name in adf.OPTICAL_PRODUCTS:
+        assert columnar[name].dtype == np.float64
+        # numpy's vectorized pow/log may differ from the scalar libm calls in the last bit
+        np.testing.assert_allclose(columnar[name], rowwise[name], rtol=1e-12, atol=0., equal_nan=True, err_msg=name)
+
+def test_optical_products_subset(sample_optical):
+    # only the requested products and the ones they depend on are added
+    f = adf.optical_products(sample_optical.copy(), products=['LR_532nm'])
+    added = [name for name in f.columns if name not in sample_optical.columns]
+    assert sorted(added) == sorted(['LR_440nm', 'LR_675nm', 'LR_870nm', 'LRAE_532nm', 'LR_532nm'])
+
+def test_optical_products_compact(sample_optical):
+    # as in the AERONET files, 6 decimals
+    f = sample_optical.round(6)
+    compact = adf.compacting_frame(f)
+    derived = adf.optical_products(compact)
+    # the float32 inputs, in float64
+    widened = adf.optical_products(compact.astype({name: np.float64 for name in compact.columns if compact[name].dtype == np.float32}))
+    reference = adf.optical_products(f)
+    for name in adf.OPTICAL_PRODUCTS:
+        assert derived[name].dtype == np.float32
+        # calculated in float64 and only rounded to float32 when stored: within half a float32 ulp
+        np.testing.assert_allclose(derived[name].to_numpy(dtype=np.float64), widened[name], rtol=np.finfo(np.float32).eps/2,
+                                   atol=0., equal_nan=True, err_msg=name)
+        # the float32 rounding of the inputs (about 3e-8) grows in the differences of close values, e.g. AAE from 1 - SSA
+        np.testing.assert_allclose(derived[name].to_numpy(dtype=np.float64), reference[name], rtol=1e-6, atol=2e-5,
+                                   equal_nan=True, err_msg=name)
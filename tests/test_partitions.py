@@ -0,0 +1,42 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the store partitioned by site, year and month (aerodog_partitions.py): queries by site and time range
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import json
+import os
+import pandas as pd
+import pyarrow.parquet
+import aerodog_partitions as apt
+
+def expected_rows(df, site, start, end):
+    rows = df[(df['AERONET_Site'] == site) & (df['globaltime'] >= start) & (df['globaltime'] < end)]
+    return rows.reset_index(drop=True)
+
+def test_querying_store(tmp_path, monkeypatch, synthetic_frame):
+    # two sites with 1 min data in one month (3 row groups of STORE_ROWGROUP rows per site)
+    df = synthetic_frame(sites=('Sao_Paulo', 'Manaus'), start='2024-08-01', rows=3*apt.STORE_ROWGROUP, step=1.)
+    storedir = str(tmp_path / 'data.store')
+    apt.saving_store(df, storedir, 'parquet')
+    start, end = pd.Timestamp('2024-08-08'), pd.Timestamp('2024-08-09')
+
+    read = []
+    reading = pyarrow.parquet.ParquetFile.read_row_groups
+    monkeypatch.setattr(pyarrow.parquet.ParquetFile, 'read_row_groups',
+                        lambda self, rowgroups, **kwargs: read.append(list(rowgroups)) or reading(self, rowgroups, **kwargs))
+    result = apt.querying_store(storedir, ['Sao_Paulo'], start, end)
+    pd.testing.assert_frame_equal(result[df.columns], expected_rows(df, 'Sao_Paulo', start, end), check_dtype=False)
+    # the day is in the second row group
+    assert read == [[1]]
+
+    # an index out of date with its files (e.g. rewritten in other row groups) reads the same rows
+    indexfile = os.sep.join([storedir, apt.STORE_INDEX])
+    with open(indexfile) as afile:
+        index = json.load(afile)
+    for partition in index['partitions'].values():
+        partition['rowgroups'] = partition['rowgroups'][:1]
+    with open(indexfile, 'w') as afile:
+        json.dump(index, afile)
+    result = apt.querying_store(storedir, ['Sao_Paulo'], start, end)
+    pd.testing.assert_frame_equal(result[df.columns], expected_rows(df, 'Sao_Paulo', start, end), check_dtype=False)
@@ -0,0 +1,84 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the quality control (QC) rules of Module 1 (adf.reading_qc_rules and adf.checking_quality)
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import aerodog_function as adf
+
+QC_RULES = '''filetype,column,sentinels,range,required
+*,*,-999;0,,on
+ssa,SSA_*,,"(0,1]",on
+*,AOD_*,,"[0,inf)",off
+*,N*,-999;0,,off
+'''
+
+@pytest.mark.parametrize('interval, expected', [('(0,1]', (0., False, 1., True)),
+                                                ('[0,inf)', (0., True, np.inf, False)),
+                                                (' [ -1.5 , ] ', (-1.5, True, np.inf, True)),
+                                                ('(,10)', (-np.inf, False, 10., False)),
+                                                ('', None)])
+def test_parsing_qc_range(interval, expected):
+    assert adf.parsing_qc_range(interval) == expected
+
+def test_parsing_qc_range_error():
+    with pytest.raises(ValueError):
+        adf.parsing_qc_range('0-1')
+
+def test_reading_qc_rules(tmp_path):
+    assert adf.reading_qc_rules(str(tmp_path / 'none.csv')) is adf.QC_DEFAULT_RULES
+    # a file with only the default line gives the default rules (the manifests stay valid)
+    qcfile = tmp_path / 'default.csv'
+    qcfile.write_text('filetype,column,sentinels,range,required\n*,*,-999;0,,on\n')
+    assert adf.reading_qc_rules(str(qcfile)) is adf.QC_DEFAULT_RULES
+    qcfile = tmp_path / 'qc.csv'
+    qcfile.write_text(QC_RULES)
+    rules = adf.reading_qc_rules(str(qcfile))
+    assert [rule['label'] for rule in rules] == ['* sentinels -999;0', 'SSA_* range (0,1]', 'AOD_* range [0,inf)', 'N* sentinels -999;0']
+    assert [rule['required'] for rule in rules] == [True, True, False, False]
+    assert [rule['label'] for rule in adf.selecting_qc_rules(rules, 'directsun')] == \
+        ['* sentinels -999;0', 'AOD_* range [0,inf)', 'N* sentinels -999;0']
+
+def test_checking_quality(tmp_path):
+    qcfile = tmp_path / 'qc.csv'
+    qcfile.write_text(QC_RULES)
+    rules = adf.selecting_qc_rules(adf.reading_qc_rules(str(qcfile)), 'ssa')
+    f = pd.DataFrame({'AERONET_Site': ['Sao_Paulo']*7,
+                      # required: the last rule matching SSA_* (on) decides
+                      'SSA_440nm': [0.9, 1.0, 0., 1.2, 0.95, -999., np.nan],
+                      # optional: the last rule matching AOD_* (off) decides, bad values become NaN
+                      'AOD_500nm': [0.1, -0.01, 0.2, 0.3, -999., 0.4, 0.5],
+                      # optional integer columns: 0 is a sentinel in a kept row (NPoints) or in a removed row (NRemoved)
+                      'NPoints': np.array([3, 0, 5, 5, 5, 5, 5], dtype=np.int64),
+                      'NRemoved': np.array([3, 3, 0, 5, 5, 5, 5], dtype=np.int64),
+                      'Day_of_Year': np.arange(1, 8, dtype=np.int64)},
+                     index=np.arange(10, 17))
+    original = f.copy()
+    kept, removed = adf.checking_quality(f, rules)
+
+    pd.testing.assert_frame_equal(f, original)
+    assert list(kept.index) == [10, 11, 14]
+    np.testing.assert_array_equal(kept['SSA_440nm'], [0.9, 1.0, 0.95])
+    np.testing.assert_array_equal(kept['AOD_500nm'], [0.1, np.nan, np.nan])
+    # integer columns keep their type only when nothing is missing in the rows kept
+    assert kept['NPoints'].dtype == np.float64
+    np.testing.assert_array_equal(kept['NPoints'], [3., np.nan, 5.])
+    assert kept['NRemoved'].dtype == np.int64 and kept['Day_of_Year'].dtype == np.int64
+    assert kept['AERONET_Site'].dtype == f['AERONET_Site'].dtype
+    # each row removed is counted once, for the first reason found: rows 12 and 15 (0 and -999 are
+    # also out of (0,1]) under the sentinels, row 13 under the range, row 16 as missing
+    assert removed == {'missing': 1, '* sentinels -999;0': 2, 'SSA_* range (0,1]': 1, 'AOD_* range [0,inf)': 0,
+                       'N* sentinels -999;0': 0}
+
+def test_checking_quality_default(sample_optical):
+    # the default rules: all the columns are required, rows with -999 or 0 are removed
+    f = sample_optical.copy()
+    f.iloc[3, 0] = -999.
+    f.iloc[7, 2] = 0.
+    kept, removed = adf.checking_quality(f, adf.QC_DEFAULT_RULES)
+    assert len(kept) == len(f) - 2
+    assert removed == {'missing': 0, '* sentinels -999;0': 2}
+    pd.testing.assert_frame_equal(kept, f.drop(index=f.index[[3, 7]]))
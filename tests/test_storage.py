@@ -0,0 +1,35 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the intermediate files (aerodog_storage.py)
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import pandas as pd
+import pytest
+import aerodog_storage as ads
+
+pyarrow = pytest.importorskip('pyarrow')
+
+@pytest.mark.parametrize('storage', ['parquet', 'feather', 'csv'])
+def test_round_trip(tmp_path, storage, synthetic_frame):
+    f = synthetic_frame(rows=20000)
+    filename = ads.saving_aeronet_data(f, str(tmp_path / 'data'), storage)
+    g = ads.loading_aeronet_data(filename)
+    if storage == 'csv':
+        pd.testing.assert_frame_equal(g, f, check_exact=False, atol=1e-6)
+    else:
+        pd.testing.assert_frame_equal(g, f)
+
+def test_feather_memory_mapped(tmp_path, synthetic_frame):
+    # feather files are not compressed, so reading them memory-mapped
+    # allocates no arrow buffers (the columns point into the mapped file)
+    import pyarrow.feather
+    filename = ads.saving_aeronet_data(synthetic_frame(rows=20000), str(tmp_path / 'data'), 'feather')
+    writer = ads.opening_chunk_writer(str(tmp_path / 'chunks'), 'feather')
+    ads.writing_chunk(writer, synthetic_frame(rows=20000))
+    chunks = ads.closing_chunk_writer(writer)
+    for name in [filename, chunks]:
+        allocated = pyarrow.total_allocated_bytes()
+        table = pyarrow.feather.read_table(name, memory_map=True)
+        assert table.num_rows == 20000
+        assert pyarrow.total_allocated_bytes() == allocated
@@ -0,0 +1,70 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the streaming mode (aerodog_streaming.py): reading the v01 files by time window
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import os
+import pandas as pd
+import pytest
+import aerodog_function as adf
+import aerodog_storage as ads
+import aerodog_streaming as astm
+
+def test_window_reads_only_its_row_groups(tmp_path, monkeypatch, synthetic_frame):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    f = synthetic_frame(start='2024-01-01', months=4, step=30., jitter=0.5, seed=0)
+    filename = ads.saving_aeronet_data(f, str(tmp_path / 'v01'), 'parquet')
+    # one row group per month
+    assert pyarrow_parquet.ParquetFile(filename).num_row_groups == 4
+
+    read = []
+    original = pyarrow_parquet.ParquetFile.read_row_groups
+    def recording(self, row_groups, *args, **kwargs):
+        read.append(list(row_groups))
+        return original(self, row_groups, *args, **kwargs)
+    monkeypatch.setattr(pyarrow_parquet.ParquetFile, 'read_row_groups', recording)
+
+    start, end = pd.Timestamp('2024-02-01'), pd.Timestamp('2024-03-01')
+    window = ads.loading_aeronet_window(filename, 'Sao_Paulo', start, end)
+    assert read == [[1]]
+    expected = f[(f['globaltime'] >= start) & (f['globaltime'] < end)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(window, expected)
+
+def test_csv_read_once(tmp_path, monkeypatch, synthetic_frame):
+    f = synthetic_frame(start='2024-01-01', months=4, step=30., jitter=0.5, seed=1)
+    filename = ads.saving_aeronet_data(f, str(tmp_path / 'v01'), 'csv')
+    chunks = []
+    original = ads.loading_aeronet_chunks
+    def counting(*args, **kwargs):
+        for chunk in original(*args, **kwargs):
+            chunks.append(len(chunk))
+            yield chunk
+    monkeypatch.setattr(ads, 'loading_aeronet_chunks', counting)
+
+    reader = ads.opening_window_reader(filename, 'Sao_Paulo', ordered=True, chunkrows=1000)
+    starts = pd.date_range('2024-01-01', '2024-05-01', freq='MS')
+    windows = [ads.loading_next_window(reader, start, end) for start, end in zip(starts[:-1], starts[1:])]
+    ads.closing_window_reader(reader)
+    # every row was read once
+    assert sum(chunks) == len(f)
+    pd.testing.assert_frame_equal(pd.concat(windows, ignore_index=True), ads.loading_aeronet_data(filename))
+
+@pytest.mark.parametrize('storage', ['parquet', 'feather', 'csv'])
+@pytest.mark.parametrize('window', ['MS', 'YS'])
+def test_streaming_matches_in_memory(tmp_path, storage, window, synthetic_frame):
+    if storage != 'csv':
+        pytest.importorskip('pyarrow')
+    inputdir = str(tmp_path / 'v01')
+    os.makedirs(inputdir)
+    products, joins, avgtimes = [], ['inner', 'asof'], ['15min', '1h']
+    for filetype, columns, step, seed in [('directsun', ['AOD_500nm', 'AE_440_675nm'], 5, 2), ('ssa', ['SSA_440nm'], 90, 3)]:
+        filename = ads.saving_aeronet_data(synthetic_frame(sites=('Sao_Paulo', 'Manaus'), columns=columns, start='2024-01-01',
+                                                                   months=4, step=step, jitter=0.5, seed=seed), os.sep.join([inputdir, 'v01.lev15.' + filetype]), storage)
+        products.append((inputdir, [os.path.basename(filename)]))
+
+    streamed, nrows = astm.streaming_aeronet_data(products, joins, avgtimes, window, str(tmp_path / 'streamed'), storage)
+    means = [adf.mining_aeronet_data(inputdir, files, avgtime) for (inputdir, files), avgtime in zip(products, avgtimes)]
+    merged = ads.saving_aeronet_data(adf.merging_aeronet_data(means, joins, avgtimes), str(tmp_path / 'merged'), storage)
+    assert nrows > 0
+    pd.testing.assert_frame_equal(ads.loading_aeronet_data(streamed), ads.loading_aeronet_data(merged))
@@ -0,0 +1,46 @@
+"""
+AERONET Data Organization & Graphics - AERODOG
+Tests of the pipeline of Module 1 (at.pipelining_organize): errors of the organize step and of the writes
+AERODOG first version created on Wed Dec 23 17:45:08 2020
+@author: Alexandre C. Yoshida, Fábio J. S. Lopes and Alexandre Cacheffo
+"""
+import pandas as pd
+import pytest
+import aerodog_function as adf
+import aerodog_storage as ads
+import aerodog_tasks as at
+
+TASKS = [(at.organizing_task, ('.', 'raw%d' % i, 'ssa', [], 6, 15, 'rawdata')) for i in range(3)]
+
+def failing_write(f, filename, storage):
+    raise OSError('disk full')
+
+def organizing(fail):
+    '''organizing_aeronet_data replaced: each file is saved (later, on the writer); with fail, the second file fails before it is saved'''
+    calls = []
+    def organizing_aeronet_data(rootdir, rawfile, *args):
+        raw, saving = args[-2], args[-1]
+        calls.append(rawfile)
+        if fail and len(calls) == 2:
+            raise ValueError('organize failed')
+        saving(pd.DataFrame({'AOD_500nm': [0.1]}), rawfile, 'csv')
+        return pd.DataFrame({'AOD_500nm': [0.1]})
+    return organizing_aeronet_data
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setattr(adf, 'reading_aeronet_columns', lambda *args: None)
+    monkeypatch.setattr(ads, 'saving_aeronet_data', failing_write)
+    return monkeypatch
+
+def test_organize_error_is_raised(pipeline, capsys):
+    # the first write fails on the writer thread, then the organize step of the second file fails: its error is the one raised
+    pipeline.setattr(adf, 'organizing_aeronet_data', organizing(True))
+    with pytest.raises(ValueError, match='organize failed'):
+        list(at.pipelining_organize(TASKS, prefetch=4))
+    assert 'disk full' in capsys.readouterr().out
+
+def test_write_error_is_raised(pipeline):
+    pipeline.setattr(adf, 'organizing_aeronet_data', organizing(False))
+    with pytest.raises(OSError, match='disk full'):
+        list(at.pipelining_organize(TASKS, prefetch=4))